@@ -3,11 +3,34 @@ from .models import AImodels  # Replace 'YourModel' with the actual name of your
 
 # Register your models here.
 admin.site.register(AImodels)
-from django.contrib import admin
-from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
+from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap, Job
 
 admin.site.register(LostProduct)
 admin.site.register(FoundProduct)
-admin.site.register(MatchResult)
-admin.site.register(Notification)
-admin.site.register(RouteMap)
+
+
+@admin.register(MatchResult)
+class MatchResultAdmin(admin.ModelAdmin):
+    # __str__ shows both product names: join them instead of one query per row
+    list_display = ('__str__', 'similarity_score', 'match_status', 'created_at')
+    list_select_related = ('lost_product', 'found_product')
+    raw_id_fields = ('lost_product', 'found_product')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('lost_embedding', 'found_embedding')
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'sent_via', 'is_sent', 'created_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(RouteMap)
+class RouteMapAdmin(admin.ModelAdmin):
+    list_select_related = ('lost_product', 'found_product')
+    raw_id_fields = ('lost_product', 'found_product')
+
+
+admin.site.register(Job)
@@ -0,0 +1,314 @@
+"""Approximate nearest-neighbour backends for the vector index.
+
+All backends share the interface of :class:`AI.index.VectorIndex`
+(``add``/``remove``/``search``/``save``/``load``), so ``ItemIndex`` can swap
+them via ``settings.AI_INDEX_BACKEND``:
+
+* ``exact``   - brute-force matrix product (default, exact results).
+* ``ivf``     - inverted-file index in pure NumPy. Vectors are bucketed by their
+  nearest k-means centroid and a query only scans the ``nprobe`` closest of
+  ``nlist`` buckets; raise ``AI_INDEX_NPROBE`` for recall, lower it for speed.
+* ``hnswlib`` - HNSW graph from the optional ``hnswlib`` package; the
+  recall/latency knob is ``AI_INDEX_EF_SEARCH``.
+* ``mmap``    - exact search over memory-mapped files under ``AI_INDEX_DIR``
+  shared by all processes on the host (see ``mmapindex.py``).
+* ``pgvector`` - vectors and HNSW search inside PostgreSQL, shared by every
+  app server (see ``pgvector.py``).
+"""
+
+import threading
+
+import numpy as np
+
+from .index import VectorIndex, rank_scores, to_unit_vector
+from .mmapindex import MmapIndex
+from .pgvector import PgVectorIndex, index_dim, pgvector_available
+
+try:
+    import hnswlib
+except Exception:
+    hnswlib = None
+
+
+def train_centroids(data, nlist, iterations=10, sample_per_list=256, seed=0):
+    """Spherical k-means over the unit vectors in ``data``; returns ``(nlist, dim)`` centroids."""
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(data))
+    if len(data) > nlist * sample_per_list:
+        data = data[rng.choice(len(data), nlist * sample_per_list, replace=False)]
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = np.flatnonzero(~sums.any(axis=1))
+        if empty.size:
+            # Re-seed empty buckets with random points so every list stays usable
+            sums[empty] = data[rng.choice(len(data), empty.size)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def nearest_centroids(data, centroids, chunk_size=65536):
+    """Index of the most similar centroid for each row of ``data``, computed in chunks."""
+    assign = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        assign[start:start + chunk_size] = np.argmax(data[start:start + chunk_size] @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex:
+    """Inverted-file ANN index built from per-bucket :class:`VectorIndex` lists.
+
+    Until ``min_train_size`` vectors have been added everything lives in one
+    bucket and searches are exact. The centroids are retrained whenever the
+    index has grown fourfold since the last training.
+    """
+
+    def __init__(self, dim=None, nlist=256, nprobe=8, min_train_size=None, dtype='float32', **_options):
+        self.dim = dim
+        self.dtype = dtype
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size or nlist * 39
+        self.centroids = None
+        self._lists = [VectorIndex(dim, dtype)]
+        self._list_of = {}
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._list_of)
+
+    def __contains__(self, item_id):
+        return item_id in self._list_of
+
+    def _nearest_list(self, vec):
+        if self.centroids is None:
+            return 0
+        return int(np.argmax(self.centroids @ vec))
+
+    def add(self, item_id, embedding):
+        vec = to_unit_vector(embedding)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vec.size
+            if vec.size != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d embedding, got {vec.size}-d")
+            target = self._nearest_list(vec)
+            current = self._list_of.get(item_id)
+            if current is not None and current != target:
+                self._lists[current].remove(item_id)
+            self._lists[target].add(item_id, vec)
+            self._list_of[item_id] = target
+            size = len(self._list_of)
+            if ((self.centroids is None and size >= self.min_train_size)
+                    or (self.centroids is not None and size >= 4 * self._trained_size)):
+                self.train()
+
+    def remove(self, item_id):
+        with self._lock:
+            bucket = self._list_of.pop(item_id, None)
+            if bucket is None:
+                return False
+            return self._lists[bucket].remove(item_id)
+
+    def export(self):
+        with self._lock:
+            parts = [vectors.export() for vectors in self._lists if len(vectors)]
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([m for _, m in parts])
+
+    def train(self):
+        """(Re)compute the centroids from the stored vectors and rebucket everything."""
+        with self._lock:
+            ids, matrix = self.export()
+            if len(ids) < 2:
+                return
+            self.centroids = train_centroids(matrix, self.nlist)
+            self._fill(ids, matrix, nearest_centroids(matrix, self.centroids))
+            self._trained_size = len(ids)
+
+    def _fill(self, ids, matrix, assign):
+        lists = [VectorIndex(self.dim, self.dtype) for _ in range(len(self.centroids) if self.centroids is not None else 1)]
+        list_of = {}
+        for item_id, vec, bucket in zip(ids.tolist(), matrix, assign.tolist()):
+            lists[bucket].add(item_id, vec)
+            list_of[item_id] = bucket
+        self._lists, self._list_of = lists, list_of
+
+    def search(self, query, k=None, threshold=None, ids=None):
+        vec = to_unit_vector(query)
+        with self._lock:
+            if not self._list_of or vec.size != self.dim:
+                return []
+            if ids is not None:
+                # A pre-selected candidate set is small: score it exactly in whichever buckets it lives
+                by_bucket = {}
+                for item_id in ids:
+                    if item_id in self._list_of:
+                        by_bucket.setdefault(self._list_of[item_id], []).append(item_id)
+                parts = [self._lists[bucket].score(vec, members) for bucket, members in by_bucket.items()]
+            else:
+                if self.centroids is None:
+                    probe = [0]
+                else:
+                    probe = np.argsort(-(self.centroids @ vec))[:self.nprobe]
+                parts = [self._lists[bucket].score(vec) for bucket in probe]
+        if not parts:
+            return []
+        ids = np.concatenate([part_ids for part_ids, _ in parts])
+        scores = np.concatenate([part_scores for _, part_scores in parts])
+        return rank_scores(ids, scores, k, threshold)
+
+    def save(self, path):
+        ids, matrix = self.export()
+        with self._lock:
+            assign = np.array([self._list_of[item_id] for item_id in ids.tolist()], dtype=np.int64)
+            centroids = self.centroids if self.centroids is not None else np.empty((0, self.dim or 0), np.float32)
+        with open(path, 'wb') as fp:
+            np.savez(fp, ids=ids, matrix=matrix, assign=assign, centroids=centroids,
+                     trained_size=np.array(self._trained_size))
+
+    @classmethod
+    def load(cls, path, **options):
+        with np.load(path) as data:
+            ids, matrix, assign, centroids = data['ids'], data['matrix'], data['assign'], data['centroids']
+            trained_size = int(data['trained_size'])
+        index = cls(dim=matrix.shape[1] if len(ids) else None, **options)
+        if len(centroids):
+            index.centroids = centroids.astype(np.float32)
+            index._trained_size = trained_size
+        index._fill(ids, matrix, assign)
+        return index
+
+
+class HnswIndex:
+    """HNSW graph index backed by the optional ``hnswlib`` package."""
+
+    def __init__(self, dim=None, ef_search=64, m=16, ef_construction=200, **_options):
+        if hnswlib is None:
+            raise ImportError("The 'hnswlib' backend requires the hnswlib package")
+        self.dim = dim
+        self.ef_search = ef_search
+        self.m = m
+        self.ef_construction = ef_construction
+        self._index = None
+        self._ids = set()
+        self._lock = threading.RLock()
+        if dim is not None:
+            self._init_index(dim)
+
+    def _init_index(self, dim, max_elements=1024):
+        self.dim = dim
+        self._index = hnswlib.Index(space='ip', dim=dim)
+        self._index.init_index(max_elements=max_elements, ef_construction=self.ef_construction,
+                               M=self.m, allow_replace_deleted=True)
+        self._index.set_ef(self.ef_search)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._ids
+
+    def add(self, item_id, embedding):
+        vec = to_unit_vector(embedding)
+        with self._lock:
+            if self._index is None:
+                self._init_index(vec.size)
+            if vec.size != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d embedding, got {vec.size}-d")
+            if self._index.get_current_count() >= self._index.get_max_elements():
+                self._index.resize_index(2 * self._index.get_max_elements())
+            self._index.add_items(vec[None, :], [item_id], replace_deleted=True)
+            self._ids.add(item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            if item_id not in self._ids:
+                return False
+            self._index.mark_deleted(item_id)
+            self._ids.discard(item_id)
+            return True
+
+    def search(self, query, k=None, threshold=None, ids=None):
+        vec = to_unit_vector(query)
+        with self._lock:
+            if not self._ids or vec.size != self.dim:
+                return []
+            if ids is not None:
+                # Score the pre-selected candidates exactly from their stored vectors
+                labels = np.fromiter((i for i in ids if i in self._ids), dtype=np.int64)
+                if not labels.size:
+                    return []
+                vectors = np.asarray(self._index.get_items(labels.tolist()), dtype=np.float32)
+                return rank_scores(labels, vectors @ vec, k, threshold)
+            k = len(self._ids) if k is None else min(k, len(self._ids))
+            self._index.set_ef(max(self.ef_search, k))
+            labels, distances = self._index.knn_query(vec[None, :], k=k)
+        # hnswlib's inner-product distance is 1 - dot
+        return rank_scores(labels[0].astype(np.int64), 1.0 - distances[0], None, threshold)
+
+    def save(self, path):
+        with self._lock:
+            if self._index is not None:
+                self._index.save_index(path)
+            ids = np.fromiter(self._ids, dtype=np.int64, count=len(self._ids))
+            with open(f"{path}.ids", 'wb') as fp:
+                np.savez(fp, ids=ids, dim=np.array(self.dim or 0))
+
+    @classmethod
+    def load(cls, path, **options):
+        with np.load(f"{path}.ids") as data:
+            ids, dim = data['ids'], int(data['dim'])
+        index = cls(**options)
+        if dim:
+            index.dim = dim
+            index._index = hnswlib.Index(space='ip', dim=dim)
+            index._index.load_index(path, allow_replace_deleted=True)
+            index._index.set_ef(index.ef_search)
+            index._ids = set(ids.tolist())
+        return index
+
+
+BACKENDS = {
+    'exact': VectorIndex,
+    'ivf': IVFIndex,
+    'hnswlib': HnswIndex,
+    'mmap': MmapIndex,
+    'pgvector': PgVectorIndex,
+}
+
+
+def create_vector_index(backend='exact', **options):
+    """Instantiate the vector storage for ``backend``, falling back to exact search."""
+    cls = BACKENDS.get(backend)
+    if cls is None:
+        raise ValueError(f"Unknown vector index backend: {backend!r}")
+    if cls is HnswIndex and hnswlib is None:
+        print("hnswlib is not installed; falling back to the exact vector index")
+        cls = VectorIndex
+    if cls is MmapIndex and not options.get('path'):
+        print("The mmap index needs AI_INDEX_DIR; falling back to the exact vector index")
+        cls = VectorIndex
+    if cls is PgVectorIndex and not pgvector_available():
+        print("The pgvector index needs PostgreSQL with the vector extension; falling back to the exact vector index")
+        cls = VectorIndex
+    elif cls is PgVectorIndex and index_dim(options.get('name')) is None:
+        print(f"No pgvector table for index {options.get('name')!r} (run `manage.py setup_pgvector`); "
+              "falling back to the exact vector index")
+        cls = VectorIndex
+    if cls is VectorIndex:
+        return VectorIndex(dtype=options.get('dtype', 'float32'))
+    return cls(**options)
+
+
+def load_vector_index(backend, path, **options):
+    cls = BACKENDS.get(backend, VectorIndex)
+    if cls is HnswIndex and hnswlib is None:
+        cls = VectorIndex
+    return cls.load(path, **options)
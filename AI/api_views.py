@@ -3,148 +3,163 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
+
 from django.conf import settings
+from django.utils.cache import patch_cache_control
 
+from .geo import items_near
+from .pagination import CreatedAtCursorPagination
 from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
 from .serializers import (
     LostProductSerializer, FoundProductSerializer, MatchResultSerializer, NotificationSerializer, RouteMapSerializer
 )
-from .utils import generate_embedding, cosine_similarity, send_match_notification  # moved AI helpers to utils
-
-# AI availability check
-try:
-    import torch
-    import clip
-    from PIL import Image
-    AI_AVAILABLE = True
-except Exception:
-    AI_AVAILABLE = False
+from .utils import send_match_notification  # moved AI helpers to utils
+from .embedders import get_embedder
+from .matching import match_item, rank_candidates
+from .tasks import enqueue_match
+
+
+class NearQueryMixin:
+    """``?near=lat,lng&radius=km`` on list views: items within ``radius`` km, nearest first.
+
+    Cells are selected through the indexed ``geohash`` column and refined by
+    haversine distance (see ``geo.py``); each result gets a ``distance_km``.
+    """
+
+    def list(self, request, *args, **kwargs):
+        near = request.query_params.get('near')
+        if near is None:
+            return super().list(request, *args, **kwargs)
+        try:
+            latitude, longitude = (float(value) for value in near.split(','))
+            radius = float(request.query_params.get('radius', getattr(settings, 'AI_NEAR_DEFAULT_RADIUS_KM', 5)))
+        except ValueError:
+            return Response({"detail": "Use near=<latitude>,<longitude> and a numeric radius in km."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or radius <= 0:
+            return Response({"detail": "Coordinates or radius out of range."}, status=status.HTTP_400_BAD_REQUEST)
+        radius = min(radius, getattr(settings, 'AI_NEAR_MAX_RADIUS_KM', 500))
+
+        hits = items_near(self.filter_queryset(self.get_queryset()), latitude, longitude, radius,
+                          limit=getattr(settings, 'AI_NEAR_MAX_RESULTS', 100))
+        items = self.get_queryset().in_bulk([item_id for item_id, _distance in hits])
+        results = []
+        for item_id, distance in hits:
+            if item_id in items:
+                data = self.get_serializer(items[item_id]).data
+                data['distance_km'] = round(distance, 3)
+                results.append(data)
+        return Response(results)
+
+
+class CandidatesMixin:
+    """``GET <item>/candidates/?k=20&min_score=`` ranked candidates from the embedding index.
+
+    Read-only counterpart of ``match``: no ``MatchResult`` rows are written and
+    nothing is embedded (see ``matching.rank_candidates``), so responses may
+    be cached for ``AI_CANDIDATES_CACHE_SECONDS``. Each candidate is
+    serialized with ``candidate_serializer_class`` and gets a ``similarity``.
+    """
+    candidate_serializer_class = None
+
+    @action(detail=True, methods=['get'])
+    def candidates(self, request, pk=None):
+        item = self.get_object()
+        try:
+            k = int(request.query_params.get('k', 20))
+            min_score = request.query_params.get('min_score')
+            min_score = float(min_score) if min_score not in (None, '') else None
+        except ValueError:
+            return Response({"detail": "k must be an integer and min_score a number."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if k <= 0:
+            return Response({"detail": "k must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+        k = min(k, getattr(settings, 'AI_CANDIDATES_MAX_K', 100))
+
+        ranked = rank_candidates(item, k=k, min_score=min_score)
+        if ranked is None:
+            return Response({"detail": "This item has not been embedded yet; try again once matching is done.",
+                             "status": item.matching_status},
+                            status=status.HTTP_409_CONFLICT)
+        results = []
+        for candidate, similarity in ranked:
+            data = self.candidate_serializer_class(candidate, context=self.get_serializer_context()).data
+            data['similarity'] = round(float(similarity), 4)
+            results.append(data)
+        response = Response({'candidates': results})
+        patch_cache_control(response, max_age=getattr(settings, 'AI_CANDIDATES_CACHE_SECONDS', 60))
+        return response
 
 
-class LostProductViewSet(viewsets.ModelViewSet):
+class LostProductViewSet(NearQueryMixin, CandidatesMixin, viewsets.ModelViewSet):
     queryset = LostProduct.objects.all()
     serializer_class = LostProductSerializer
+    pagination_class = CreatedAtCursorPagination
+    candidate_serializer_class = FoundProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def perform_create(self, serializer):
         lost = serializer.save(user=self.request.user)
 
-        if getattr(settings, 'CELERY_ENABLED', False):
-            try:
-                from .tasks import run_match_for_item
-                run_match_for_item.delay('lost', lost.id)
-            except Exception:
-                pass
-            return
-
-        if not AI_AVAILABLE or not lost.image:
-            return
-
-        lost_embedding = generate_embedding(lost.image)
-        for found in FoundProduct.objects.all():
-            if not found.image:
-                continue
-            found_embedding = generate_embedding(found.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding or b'',
-                found_embedding=found_embedding or b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
+        if lost.image:
+            enqueue_match('lost', lost.id)
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
-    def match(self, _request, _pk=None):
+    def match(self, request, pk=None):
         lost = self.get_object()
 
-        if not AI_AVAILABLE:
-            return Response({"detail": "AI dependencies not available."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-
-        lost_embedding = generate_embedding(lost.image) if lost.image else None
-        results = []
+        # The configured model, or whichever fallback loads on this node
+        embedder = get_embedder()
+        if embedder is None:
+            return Response({"detail": "No embedding model is available."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        for found in FoundProduct.objects.all():
-            if not found.image or not lost_embedding:
-                continue
-            found_embedding = generate_embedding(found.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding or b'',
-                found_embedding=found_embedding or b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
-            results.append({'found_id': found.id, 'similarity': similarity, 'status': status_str})
+        matched = match_item(lost, embedder, notify=send_match_notification)
+        results = [
+            {'found_id': found.id, 'similarity': similarity, 'status': status_str}
+            for found, similarity, status_str in matched
+        ]
 
         return Response({'matches': results})
 
 
-class FoundProductViewSet(viewsets.ModelViewSet):
+class FoundProductViewSet(NearQueryMixin, CandidatesMixin, viewsets.ModelViewSet):
     queryset = FoundProduct.objects.all()
     serializer_class = FoundProductSerializer
+    pagination_class = CreatedAtCursorPagination
+    candidate_serializer_class = LostProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def perform_create(self, serializer):
         found = serializer.save(user=self.request.user)
 
-        if getattr(settings, 'CELERY_ENABLED', False):
-            try:
-                from .tasks import run_match_for_item
-                run_match_for_item.delay('found', found.id)
-            except Exception:
-                pass
-            return
-
-        if not AI_AVAILABLE or not found.image:
-            return
-
-        found_embedding = generate_embedding(found.image)
-        for lost in LostProduct.objects.all():
-            if not lost.image:
-                continue
-            lost_embedding = generate_embedding(lost.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding or b'',
-                found_embedding=found_embedding or b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
+        if found.image:
+            enqueue_match('found', found.id)
 
 
 class MatchResultViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = MatchResult.objects.all()
+    # The stored embeddings are never serialized; the products are joined for __str__ (browsable API)
+    queryset = MatchResult.objects.select_related('lost_product', 'found_product').only(
+        *MatchResultSerializer.Meta.fields, 'lost_product__name', 'found_product__name')
     serializer_class = MatchResultSerializer
+    pagination_class = CreatedAtCursorPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
 
 
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
+    pagination_class = CreatedAtCursorPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user)
+        return Notification.objects.filter(user=self.request.user).select_related('user')
 
 
 class RouteMapViewSet(viewsets.ModelViewSet):
-    queryset = RouteMap.objects.all()
+    queryset = RouteMap.objects.select_related('lost_product', 'found_product').only(
+        *RouteMapSerializer.Meta.fields, 'lost_product__name', 'found_product__name')
     serializer_class = RouteMapSerializer
+    pagination_class = CreatedAtCursorPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
 
 
@@ -163,169 +178,3 @@ router.register(r'route-maps', RouteMapViewSet, basename='routemap')
 # router.register(r'userprofiles', UserProfileViewSet)
 
 urlpatterns = router.urls
-
-from rest_framework import viewsets, status
-from rest_framework.decorators import action
-from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
-from django.conf import settings
-
-from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
-from .serializers import (
-    LostProductSerializer, FoundProductSerializer, MatchResultSerializer, NotificationSerializer, RouteMapSerializer
-)
-from .utils import generate_embedding, cosine_similarity, send_match_notification  # moved AI helpers to utils
-
-# AI availability check
-try:
-    import torch
-    import clip
-    from PIL import Image
-    AI_AVAILABLE = True
-except Exception:
-    AI_AVAILABLE = False
-
-
-class LostProductViewSet(viewsets.ModelViewSet):
-    queryset = LostProduct.objects.all()
-    serializer_class = LostProductSerializer
-    permission_classes = [IsAuthenticatedOrReadOnly]
-
-    def perform_create(self, serializer):
-        lost = serializer.save(user=self.request.user)
-
-        if getattr(settings, 'CELERY_ENABLED', False):
-            try:
-                from .tasks import run_match_for_item
-                run_match_for_item.delay('lost', lost.id)
-            except Exception:
-                pass
-            return
-
-        if not AI_AVAILABLE or not lost.image:
-            return
-
-        lost_embedding = generate_embedding(lost.image)
-        for found in FoundProduct.objects.all():
-            if not found.image:
-                continue
-            found_embedding = generate_embedding(found.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding or b'',
-                found_embedding=found_embedding or b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
-
-    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
-    def match(self, _request, _pk=None):
-        lost = self.get_object()
-
-        if not AI_AVAILABLE:
-            return Response({"detail": "AI dependencies not available."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-
-        lost_embedding = generate_embedding(lost.image) if lost.image else None
-        results = []
-
-        for found in FoundProduct.objects.all():
-            if not found.image or not lost_embedding:
-                continue
-            found_embedding = generate_embedding(found.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding or b'',
-                found_embedding=found_embedding or b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
-            results.append({'found_id': found.id, 'similarity': similarity, 'status': status_str})
-
-        return Response({'matches': results})
-
-
-class FoundProductViewSet(viewsets.ModelViewSet):
-    queryset = FoundProduct.objects.all()
-    serializer_class = FoundProductSerializer
-    permission_classes = [IsAuthenticatedOrReadOnly]
-
-    def perform_create(self, serializer):
-        found = serializer.save(user=self.request.user)
-
-        if getattr(settings, 'CELERY_ENABLED', False):
-            try:
-                from .tasks import run_match_for_item
-                run_match_for_item.delay('found', found.id)
-            except Exception:
-                pass
-            return
-
-        if not AI_AVAILABLE or not found.image:
-            return
-
-        found_embedding = generate_embedding(found.image)
-        for lost in LostProduct.objects.all():
-            if not lost.image:
-                continue
-            lost_embedding = generate_embedding(lost.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding or b'',
-                found_embedding=found_embedding or b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
-
-
-class MatchResultViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = MatchResult.objects.all()
-    serializer_class = MatchResultSerializer
-    permission_classes = [IsAuthenticatedOrReadOnly]
-
-
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Notification.objects.all()
-    serializer_class = NotificationSerializer
-    permission_classes = [IsAuthenticated]
-
-    def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user)
-
-
-class RouteMapViewSet(viewsets.ModelViewSet):
-    queryset = RouteMap.objects.all()
-    serializer_class = RouteMapSerializer
-    permission_classes = [IsAuthenticatedOrReadOnly]
-
-
-# DRF router setup
-from rest_framework.routers import DefaultRouter
-
-router = DefaultRouter()
-# Make sure ProfileViewSet/UserProfileViewSet are imported properly from another file
-# router.register(r'profiles', ProfileViewSet)
-# router.register(r'userprofiles', UserProfileViewSet)
-
-urlpatterns = router.urls
-router.register(r'lost-products', LostProductViewSet, basename='lostproduct')
-router.register(r'found-products', FoundProductViewSet, basename='foundproduct')
-router.register(r'match-results', MatchResultViewSet, basename='matchresult')
-router.register(r'notifications', NotificationViewSet, basename='notification')
-router.register(r'route-maps', RouteMapViewSet, basename='routemap')
-urlpatterns += router.urls
-
@@ -0,0 +1,130 @@
+"""Candidate pre-selection for matching.
+
+Before any embedding is compared, :func:`candidate_filter` narrows the items
+of the opposite kind with indexed database filters on the report's metadata:
+
+* date - a found item cannot predate the loss by more than
+  ``AI_MATCH_DATE_SLACK_DAYS`` (dates are often misreported by a day or two),
+  and only items within ``AI_MATCH_DATE_WINDOW_DAYS`` of each other are paired,
+* geography - when the item has coordinates, candidates must lie in the
+  geohash cells and latitude/longitude box of ``AI_MATCH_MAX_DISTANCE_KM``
+  around it (see ``geo.py``),
+* location - with ``AI_MATCH_SAME_LOCATION``, the ``location`` text must be
+  the same (case-insensitively),
+* category - with ``AI_MATCH_SAME_CATEGORY``, the category must be the same.
+
+A candidate that lacks a field (no date, no coordinates, ...) is never
+excluded by the filter on that field, and setting any of these options to
+None (or False) turns its filter off.
+
+When the filter leaves at most ``AI_MATCH_PREFILTER_MAX_IDS`` items,
+:func:`candidate_ids` returns them and the index scores exactly that set.
+Larger sets are left to the index's approximate search; its hits are then
+checked against the filter with :func:`keep_candidates`.
+"""
+
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import In, IsNull
+
+from .geo import KM_PER_DEGREE, cell_filter, covering_cells
+from .index import ITEM_MODELS
+
+
+def date_filter(item, kind):
+    field = 'date_lost' if kind == 'lost' else 'date_found'
+    reported = item.date_found if kind == 'lost' else item.date_lost
+    if not reported:
+        return None
+    slack = getattr(settings, 'AI_MATCH_DATE_SLACK_DAYS', 2)
+    window = getattr(settings, 'AI_MATCH_DATE_WINDOW_DAYS', 180)
+    if slack is None and window is None:
+        return None
+    slack = timedelta(days=slack or 0)
+    window = timedelta(days=window) if window is not None else None
+    if kind == 'found':
+        # Candidates were found after this loss: date_lost - slack <= date_found <= date_lost + window
+        bounds = {f'{field}__gte': reported - slack}
+        if window is not None:
+            bounds[f'{field}__lte'] = reported + window
+    else:
+        # Candidates were lost before this find: date_found - window <= date_lost <= date_found + slack
+        bounds = {f'{field}__lte': reported + slack}
+        if window is not None:
+            bounds[f'{field}__gte'] = reported - window
+    return Q(**bounds) | Q(**{f'{field}__isnull': True})
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """``(min_lat, max_lat, min_lng, max_lng)`` around a point; the longitude pair is None near the poles or the antimeridian."""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    dlng = radius_km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-6 else 360.0
+    if longitude - dlng < -180 or longitude + dlng > 180:
+        return latitude - dlat, latitude + dlat, None, None
+    return latitude - dlat, latitude + dlat, longitude - dlng, longitude + dlng
+
+
+def geo_filter(item):
+    radius = getattr(settings, 'AI_MATCH_MAX_DISTANCE_KM', 50)
+    if radius is None or item.latitude is None or item.longitude is None:
+        return None
+    min_lat, max_lat, min_lng, max_lng = bounding_box(item.latitude, item.longitude, radius)
+    inside = Q(latitude__gte=min_lat, latitude__lte=max_lat)
+    if min_lng is not None:
+        inside &= Q(longitude__gte=min_lng, longitude__lte=max_lng)
+    cells = covering_cells(item.latitude, item.longitude, radius)
+    if cells is not None:
+        # Geohash ranges select the surrounding cells through the geohash index
+        inside &= cell_filter(cells)
+    # Items without coordinates have an empty geohash, which the geohash index finds too
+    return inside | Q(geohash='')
+
+
+def text_filter(item, field, setting, default):
+    value = (getattr(item, field, None) or '').strip()
+    if not value or not getattr(settings, setting, default):
+        return None
+    # Every term is on LOWER(field), so the functional indexes on the item models answer it
+    return Q(In(Lower(field), [value.lower(), ''])) | Q(IsNull(Lower(field), True))
+
+
+def candidate_filter(item, kind):
+    """``Q`` restricting items of ``kind`` to plausible candidates for ``item``, or None for no restriction."""
+    filters = [
+        date_filter(item, kind),
+        geo_filter(item),
+        text_filter(item, 'location', 'AI_MATCH_SAME_LOCATION', False),
+        text_filter(item, 'category', 'AI_MATCH_SAME_CATEGORY', True),
+    ]
+    combined = None
+    for condition in filters:
+        if condition is not None:
+            combined = condition if combined is None else combined & condition
+    return combined
+
+
+
+def candidate_ids(kind, condition):
+    """Ids of the items of ``kind`` matching ``condition``, or None when there are more than ``AI_MATCH_PREFILTER_MAX_IDS``."""
+    ids = ITEM_MODELS[kind].objects.filter(condition).values_list('id', flat=True)
+    limit = getattr(settings, 'AI_MATCH_PREFILTER_MAX_IDS', 2000)
+    if limit is None:
+        return set(ids)
+    ids = list(ids[:limit + 1])
+    return set(ids) if len(ids) <= limit else None
+
+
+def keep_candidates(hits, kind, condition, allowed=None):
+    """``(item_id, score)`` hits restricted to the candidates: ``allowed`` ids, else those matching ``condition``."""
+    if allowed is not None:
+        return [hit for hit in hits if hit[0] in allowed]
+    if condition is None or not hits:
+        return hits
+    kept = set(ITEM_MODELS[kind].objects.filter(condition, id__in=[item_id for item_id, _score in hits])
+               .values_list('id', flat=True))
+    return [hit for hit in hits if hit[0] in kept]
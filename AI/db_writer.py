@@ -0,0 +1,55 @@
+"""Single writer thread for bulk database writes.
+
+SQLite lets one connection write at a time. When several matches finish
+together, each one's ``MatchResult`` INSERTs would otherwise compete for the
+write lock and wait on ``busy_timeout`` (or fail with "database is locked").
+:func:`run_write` hands such work to one long-lived thread per process and
+waits for its result, so writers queue up in Python while readers, which WAL
+mode never blocks, carry on. Across processes the lock itself still
+serializes writers; see ``SQLITE_PRAGMAS`` and ``transaction_mode`` in
+settings.
+
+Writes run inline instead when ``AI_DB_WRITER_QUEUE`` is off, when the
+database is not SQLite or is in memory (another thread would not see the
+caller's data), or when the caller is inside a transaction, whose writes
+must stay in that transaction.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+_writer = None
+_writer_lock = threading.Lock()
+THREAD_NAME_PREFIX = 'ai-db-writer'
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=THREAD_NAME_PREFIX)
+        return _writer
+
+
+def use_writer_thread():
+    return (getattr(settings, 'AI_DB_WRITER_QUEUE', True)
+            and connection.vendor == 'sqlite'
+            and not connection.is_in_memory_db()
+            and not connection.in_atomic_block
+            and not threading.current_thread().name.startswith(THREAD_NAME_PREFIX))
+
+
+def _run(func, args, kwargs):
+    # The writer keeps its connection between jobs; drop it if it is stale or broken
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+def run_write(func, *args, **kwargs):
+    """Call ``func(*args, **kwargs)`` on the writer thread and return its result (or raise its error)."""
+    if not use_writer_thread():
+        return func(*args, **kwargs)
+    return get_writer().submit(_run, func, args, kwargs).result()
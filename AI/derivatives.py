@@ -0,0 +1,126 @@
+"""Resized copies of uploaded item photos.
+
+After an item's image is saved, a background job (``tasks.make_item_derivatives``)
+runs :func:`generate_derivatives`, which stores next to the original (same
+storage, same directory):
+
+* ``<name>.thumb.webp`` / ``<name>.thumb.jpg`` - list/grid thumbnails whose
+  longer side is ``AI_THUMBNAIL_SIZE``; the WebP copy is skipped when Pillow
+  was built without WebP support.
+* ``<name>.model.jpg`` - a copy whose shorter side is ``AI_MODEL_COPY_SIZE``
+  (the largest embedding model input), which the embedding code reads instead
+  of decoding the full-size original.
+
+``<name>`` is the original's full file name, extension included
+(``keys.jpg.thumb.jpg``), so uploads sharing a stem (``keys.jpg`` and
+``keys.png``) never share derivatives. Derivative names are derived from
+the original's name, so no extra database columns are needed.
+Until the job has run, :func:`derivative_url` returns None and
+:func:`embedding_source` falls back to the original.
+``manage.py make_derivatives`` backfills existing items.
+"""
+
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+try:
+    from PIL import Image, features
+except Exception:
+    Image = None
+    features = None
+
+DERIVATIVES = {
+    'thumb_webp': ('thumb.webp', 'WEBP'),
+    'thumb': ('thumb.jpg', 'JPEG'),
+    'model': ('model.jpg', 'JPEG'),
+}
+
+
+def derivative_name(image_name, kind):
+    suffix, _format = DERIVATIVES[kind]
+    return f"{image_name}.{suffix}"
+
+
+def webp_supported():
+    return features is not None and features.check('webp')
+
+
+def encode(image, fmt):
+    buf = io.BytesIO()
+    if fmt == 'WEBP':
+        image.save(buf, format='WEBP', quality=80, method=4)
+    else:
+        image.save(buf, format='JPEG', quality=85, optimize=True)
+    return buf.getvalue()
+
+
+def generate_derivatives(image_field):
+    """Write every derivative of ``image_field`` to its storage; returns the names written."""
+    from .embedders import decode_image
+
+    if not image_field or Image is None:
+        return []
+    thumb_size = getattr(settings, 'AI_THUMBNAIL_SIZE', 320)
+    model_size = getattr(settings, 'AI_MODEL_COPY_SIZE', 256)
+    image = decode_image(image_field, min_size=max(thumb_size, model_size))
+
+    thumb = image.copy()
+    thumb.thumbnail((thumb_size, thumb_size), Image.LANCZOS)
+    model_copy = image
+    if min(image.size) > model_size:
+        scale = model_size / min(image.size)
+        model_copy = image.resize((round(image.width * scale), round(image.height * scale)), Image.BICUBIC)
+
+    outputs = {'thumb': thumb, 'model': model_copy}
+    if webp_supported():
+        outputs['thumb_webp'] = thumb
+    storage = image_field.storage
+    written = []
+    for kind, derived in outputs.items():
+        name = derivative_name(image_field.name, kind)
+        if storage.exists(name):
+            storage.delete(name)
+        # save() may rename on a race; report the name actually used
+        written.append(storage.save(name, ContentFile(encode(derived, DERIVATIVES[kind][1]))))
+    return written
+
+
+def delete_derivatives(storage, image_name):
+    if not image_name:
+        return
+    for kind in DERIVATIVES:
+        name = derivative_name(image_name, kind)
+        try:
+            if storage.exists(name):
+                storage.delete(name)
+        except Exception as e:
+            print(f"Failed to delete derivative {name}: {e}")
+
+
+def derivative_url(image_field, kind):
+    """URL of a derivative of ``image_field``, or None if it has not been generated."""
+    if not image_field:
+        return None
+    name = derivative_name(image_field.name, kind)
+    try:
+        if image_field.storage.exists(name):
+            return image_field.storage.url(name)
+    except Exception:
+        pass
+    return None
+
+
+def embedding_source(image_field):
+    """What the embedding code should read for an item image: the model-sized copy if present."""
+    if not image_field:
+        return image_field
+    name = derivative_name(image_field.name, 'model')
+    try:
+        if image_field.storage.exists(name):
+            return image_field.storage.path(name)
+    except NotImplementedError:
+        # Remote storage without local paths; decode the original instead
+        pass
+    return image_field
@@ -0,0 +1,89 @@
+"""Cheap hand-crafted image descriptors that need only Pillow and NumPy.
+
+:func:`describe` turns a small decoded image into a fixed-length vector whose
+cosine similarity is meaningful, for nodes without torch. It concatenates
+three L2-normalised blocks, weighted so the cosine of two descriptors is the
+weighted sum of the per-block cosines:
+
+* a square-rooted HSV colour histogram (cosine = Bhattacharyya coefficient),
+* a coarse 4x4 colour layout, mean-centred so flat images do not all agree,
+* the 64 bits of a difference hash (dHash) mapped to +-1.
+
+:func:`phash` is the perceptual hash stored on items for near-duplicate
+detection (see ``hashindex.py``).
+"""
+
+import numpy as np
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+DESCRIPTOR_INPUT_SIZE = 64  # side of the square the image is reduced to first
+HUE_BINS, SAT_BINS, VAL_BINS = 18, 3, 3
+LAYOUT_GRID = 4
+HASH_SIZE = 8
+
+WEIGHTS = {'histogram': 0.6, 'layout': 0.2, 'dhash': 0.2}
+DESCRIPTOR_DIM = HUE_BINS * SAT_BINS * VAL_BINS + LAYOUT_GRID * LAYOUT_GRID * 3 + HASH_SIZE * HASH_SIZE
+
+
+def _unit(vec):
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def color_histogram(image):
+    """Square-rooted joint HSV histogram of an RGB image, L2-normalised."""
+    hsv = np.asarray(image.convert('HSV'), dtype=np.uint16).reshape(-1, 3)
+    h = hsv[:, 0] * HUE_BINS // 256
+    s = hsv[:, 1] * SAT_BINS // 256
+    v = hsv[:, 2] * VAL_BINS // 256
+    bins = (h * SAT_BINS + s) * VAL_BINS + v
+    hist = np.bincount(bins, minlength=HUE_BINS * SAT_BINS * VAL_BINS).astype(np.float32)
+    return _unit(np.sqrt(hist))
+
+
+def color_layout(image):
+    """Mean colour of each cell of a ``LAYOUT_GRID`` grid, centred and L2-normalised."""
+    cells = np.asarray(image.resize((LAYOUT_GRID, LAYOUT_GRID), Image.BOX), dtype=np.float32).reshape(-1)
+    return _unit(cells - cells.mean())
+
+
+def dhash_bits(image, hash_size=HASH_SIZE):
+    """Difference hash: whether each pixel is brighter than its right neighbour, as a bool array."""
+    gray = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.BOX), dtype=np.int16)
+    return (gray[:, 1:] > gray[:, :-1]).reshape(-1)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+
+def phash(image, hash_size=HASH_SIZE, highfreq_factor=4):
+    """64-bit perceptual hash (DCT of a 32x32 grey image, thresholded at the median) as an int."""
+    size = hash_size * highfreq_factor
+    gray = np.asarray(image.convert('L').resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ gray @ dct.T)[:hash_size, :hash_size]
+    bits = (low > np.median(low)).reshape(-1)
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def describe(image):
+    """Descriptor vector (float32, unit length) of a PIL image."""
+    image = image.convert('RGB')
+    if max(image.size) > DESCRIPTOR_INPUT_SIZE:
+        image = image.resize((DESCRIPTOR_INPUT_SIZE, DESCRIPTOR_INPUT_SIZE), Image.BOX)
+    blocks = [
+        np.sqrt(WEIGHTS['histogram']) * color_histogram(image),
+        np.sqrt(WEIGHTS['layout']) * color_layout(image),
+        np.sqrt(WEIGHTS['dhash']) * _unit(np.where(dhash_bits(image), 1.0, -1.0)),
+    ]
+    return _unit(np.concatenate(blocks)).astype(np.float32)
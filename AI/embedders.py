@@ -0,0 +1,437 @@
+"""Process-wide registry of image embedding models.
+
+Each model is loaded at most once per process (web worker, ASGI server or
+Celery worker) behind a lock, and every vector it produces is labelled with
+the model's ``name`` and ``version`` so persisted embeddings can be checked
+for staleness. ``settings.AI_EMBEDDING_MODEL`` picks the model used for
+matching; ``warm_up()`` loads it ahead of the first request.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+try:
+    import torch
+except Exception:
+    torch = None
+
+
+def open_image_file(image_field):
+    """Return a readable binary file object positioned at the start of the image.
+
+    Paths are opened here and must be closed by the caller; other file
+    objects are rewound and left open.
+    """
+    if isinstance(image_field, (str, os.PathLike)):
+        return open(image_field, 'rb')
+    fp = image_field.file if hasattr(image_field, 'file') else image_field
+    if hasattr(fp, 'seek'):
+        fp.seek(0)
+    return fp
+
+
+def read_image_bytes(image_field):
+    """Return the raw bytes of a path, uploaded file, FieldFile or file-like object."""
+    fp = open_image_file(image_field)
+    try:
+        return fp.read()
+    finally:
+        if isinstance(image_field, (str, os.PathLike)):
+            fp.close()
+
+
+def decode_image(image_field, min_size=None):
+    """Decode an image to RGB without holding more pixels than the model needs.
+
+    The file is streamed by Pillow instead of being read into memory first.
+    JPEGs are decoded in draft mode, where libjpeg scales by 1/2, 1/4 or 1/8
+    during decoding; other formats are box-reduced right after loading. Either
+    way the shorter side stays at least ``min_size`` pixels, so the model's
+    own resize still sees enough detail. Images above ``AI_MAX_IMAGE_PIXELS``
+    are rejected before decoding.
+    """
+    fp = open_image_file(image_field)
+    try:
+        image = Image.open(fp)
+        max_pixels = getattr(settings, 'AI_MAX_IMAGE_PIXELS', 50_000_000)
+        if max_pixels and image.width * image.height > max_pixels:
+            raise ValueError(f"Image of {image.width}x{image.height} pixels exceeds AI_MAX_IMAGE_PIXELS")
+        if min_size:
+            # Only JPEG implements draft(); it is a no-op for other formats
+            image.draft('RGB', (min_size, min_size))
+        image = image.convert('RGB')
+    finally:
+        if isinstance(image_field, (str, os.PathLike)):
+            fp.close()
+    if min_size:
+        factor = min(image.size) // min_size
+        if factor >= 2:
+            image = image.reduce(factor)
+    return image
+
+
+class Embedder:
+    """Base class for an image embedding model loaded lazily and shared per process."""
+
+    key = ''  # registry key in EMBEDDERS
+    name = ''
+    version = ''
+    input_size = None  # shorter side the preprocess resizes to; images are decoded at least this big
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._load_error = None
+        self.model = None
+        self._preprocess = None
+        self.device = 'cpu'
+
+    @classmethod
+    def is_available(cls):
+        return torch is not None and Image is not None
+
+    def ensure_loaded(self):
+        """Load the model on first use; later calls (from any thread) reuse it."""
+        if not self._loaded:
+            with self._lock:
+                if self._load_error is not None:
+                    raise RuntimeError(f"{self.name} failed to load: {self._load_error}")
+                if not self._loaded:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        # Don't retry a multi-second load on every request
+                        self._load_error = e
+                        raise
+                    self._loaded = True
+        return self
+
+    def load(self):
+        raise NotImplementedError
+
+    def build_preprocess(self):
+        """Return the image -> input tensor transform; must not require the model weights."""
+        raise NotImplementedError
+
+    @property
+    def preprocess(self):
+        # Built separately from the weights so decode workers don't load the model
+        if self._preprocess is None:
+            self._preprocess = self.build_preprocess()
+        return self._preprocess
+
+    def forward(self, batch):
+        raise NotImplementedError
+
+    def prepare(self, image):
+        """Decode and preprocess one image (file or PIL image) into a model input.
+
+        Runs in the worker threads of :meth:`embed_files`.
+        """
+        if Image is not None and not isinstance(image, Image.Image):
+            image = decode_image(image, self.input_size)
+        return self.preprocess(image.convert('RGB'))
+
+    def run_batch(self, prepared):
+        """Run one forward pass over prepared inputs; returns a ``(len(prepared), dim)`` float32 array."""
+        batch = torch.stack(prepared).to(self.device)
+        with torch.no_grad():
+            emb = self.forward(batch)
+        return emb.reshape(len(prepared), -1).cpu().numpy().astype(np.float32)
+
+    def embed_images(self, images):
+        """Embed a list of PIL images; returns a ``(len(images), dim)`` float32 array."""
+        self.ensure_loaded()
+        return self.run_batch([self.prepare(image) for image in images])
+
+    def embed_file(self, image_field):
+        """Return the embedding of one image file as float32 bytes, or None on failure.
+
+        Results are cached by content hash (see ``embedding_cache.py``), so an
+        image seen before is neither decoded nor run through the model again.
+        """
+        if not image_field:
+            return None
+        from .embedding_cache import embedding_cache, file_hash
+
+        try:
+            digest = file_hash(image_field)
+            emb = embedding_cache.get(digest, self.name, self.version)
+            if emb is not None:
+                return emb
+            self.ensure_loaded()
+            emb = self.run_batch([self.prepare(image_field)])[0].tobytes()
+        except Exception as e:
+            print(f"Error generating {self.name} embedding: {e}")
+            return None
+        embedding_cache.put(digest, self.name, self.version, emb)
+        return emb
+
+    def _try_prepare(self, image):
+        try:
+            return self.prepare(image) if image else None
+        except Exception as e:
+            print(f"Error preparing image for {self.name}: {e}")
+            return None
+
+    def embed_files(self, images, batch_size=32, workers=None, executor=None):
+        """Embed many images in batches; returns ``(matrix, ok)``.
+
+        Images are decoded and preprocessed on a thread pool (or on
+        ``executor``, e.g. a process pool fed with file paths) while the
+        previous batch runs through the model. ``matrix`` is a contiguous
+        ``(len(images), dim)`` float32 array and ``ok`` a boolean mask of the
+        rows that were embedded; failed rows are left as zeros.
+        """
+        self.ensure_loaded()
+        images = list(images)
+        matrix = None
+        ok = np.zeros(len(images), dtype=bool)
+        if executor is None:
+            pool = ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1))
+            submit = lambda image: pool.submit(self._try_prepare, image)  # noqa: E731
+        else:
+            # Worker processes look the embedder up in their own registry
+            pool = None
+            submit = lambda image: executor.submit(prepare_image, self.key, image)  # noqa: E731
+        try:
+            pending = [submit(image) for image in images[:batch_size]]
+            for start in range(0, len(images), batch_size):
+                prepared = [future.result() for future in pending]
+                following = images[start + batch_size:start + 2 * batch_size]
+                # Decode the next batch while this one is in the model
+                pending = [submit(image) for image in following]
+                rows = [row for row, item in enumerate(prepared) if item is not None]
+                if not rows:
+                    continue
+                emb = self.run_batch([prepared[row] for row in rows])
+                if matrix is None:
+                    matrix = np.zeros((len(images), emb.shape[1]), dtype=np.float32)
+                matrix[start + np.array(rows)] = emb
+                ok[start + np.array(rows)] = True
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if matrix is None:
+            matrix = np.zeros((len(images), 0), dtype=np.float32)
+        return matrix, ok
+
+
+class ClipEmbedder(Embedder):
+    key = 'clip'
+    name = 'clip-ViT-B/32'
+    version = '1'
+    input_size = 224
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import clip  # noqa: F401
+        except Exception:
+            return False
+        return super().is_available()
+
+    def load(self):
+        import clip
+
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model, self._preprocess = clip.load("ViT-B/32", device=self.device)
+        self.model.eval()
+
+    def build_preprocess(self):
+        from clip.clip import _transform
+
+        return _transform(224)  # ViT-B/32 input resolution
+
+    def forward(self, batch):
+        return self.model.encode_image(batch)
+
+
+class ResNetEmbedder(Embedder):
+    key = 'resnet18'
+    name = 'resnet18'
+    version = 'IMAGENET1K_V1'
+    input_size = 256
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import torchvision  # noqa: F401
+        except Exception:
+            return False
+        return super().is_available()
+
+    def load(self):
+        import torchvision.models as models
+        from torchvision.models import ResNet18_Weights
+
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = models.resnet18(weights=ResNet18_Weights.DEFAULT)
+        self.model = torch.nn.Sequential(*list(model.children())[:-1]).to(self.device)
+        self.model.eval()
+
+    def build_preprocess(self):
+        import torchvision.transforms as transforms
+
+        return transforms.Compose([
+            transforms.Resize(256),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ])
+
+    def forward(self, batch):
+        return self.model(batch)
+
+
+class DescriptorEmbedder(Embedder):
+    """CPU-only colour histogram + layout + dHash descriptor (see ``descriptors.py``).
+
+    Meant for nodes without torch: a few milliseconds per image and, unlike
+    the pseudo-bytes fallback, similar photos get similar vectors.
+    """
+
+    key = 'descriptor'
+    name = 'descriptor'
+    version = '1'
+    input_size = 64
+
+    @classmethod
+    def is_available(cls):
+        return Image is not None
+
+    def load(self):
+        pass
+
+    def build_preprocess(self):
+        from .descriptors import describe
+
+        return describe
+
+    def run_batch(self, prepared):
+        return np.stack(prepared).astype(np.float32)
+
+
+class PseudoBytesEmbedder(Embedder):
+    """Last-resort fallback that turns the raw file bytes into a 512-d vector.
+
+    Needs no imaging library, but the vector reflects the compressed bytes,
+    not the picture, so scores are close to meaningless. Cheaper than hashing
+    the file, so it bypasses the embedding cache.
+    """
+
+    key = 'pseudo-bytes'
+    name = 'pseudo-bytes'
+    version = '1'
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def load(self):
+        pass
+
+    def prepare(self, image):
+        return np.frombuffer(self.embed_file(image), dtype=np.float32)
+
+    def run_batch(self, prepared):
+        return np.stack(prepared).astype(np.float32)
+
+    def embed_file(self, image_field):
+        if image_field is None:
+            return None
+        try:
+            data = read_image_bytes(image_field)
+        except Exception:
+            data = str(image_field).encode('utf-8')
+        arr = np.frombuffer(data, dtype=np.uint8)
+        if arr.size == 0:
+            arr = np.arange(128, dtype=np.uint8)
+        vec = np.resize(arr.astype(np.float32), 512)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return vec.astype(np.float32).tobytes()
+
+
+EMBEDDERS = {
+    'clip': ClipEmbedder,
+    'resnet18': ResNetEmbedder,
+    'descriptor': DescriptorEmbedder,
+    'pseudo-bytes': PseudoBytesEmbedder,
+}
+
+# Tried in order when the configured model cannot be used on this node
+FALLBACK_ORDER = ['clip', 'resnet18', 'descriptor', 'pseudo-bytes']
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_embedder(key=None):
+    """Return the shared embedder registered as ``key``, or None if it cannot be used here.
+
+    Without ``key`` the configured ``AI_EMBEDDING_MODEL`` is used, falling back
+    through ``FALLBACK_ORDER`` when its dependencies are missing or it fails
+    to load (see :func:`default_embedder`).
+    """
+    if key is None:
+        return default_embedder()
+    cls = EMBEDDERS.get(key)
+    if cls is None:
+        raise ValueError(f"Unknown embedding model: {key!r}")
+    with _instances_lock:
+        if key not in _instances:
+            # Unavailable models are cached as None so the imports aren't retried
+            _instances[key] = cls() if cls.is_available() else None
+        return _instances[key]
+
+
+def default_embedder():
+    """The configured embedder, or the first in ``FALLBACK_ORDER`` that imports and loads here.
+
+    Models are loaded before they are picked, so a node whose weights are
+    missing or broken falls back instead of failing every embed; a load
+    failure is remembered by the embedder and not retried.
+    """
+    configured = getattr(settings, 'AI_EMBEDDING_MODEL', 'clip')
+    for key in [configured] + [k for k in FALLBACK_ORDER if k != configured]:
+        embedder = get_embedder(key)
+        if embedder is None or embedder._load_error is not None:
+            continue
+        try:
+            embedder.ensure_loaded()
+        except Exception as e:
+            print(f"Embedding model {embedder.name} failed to load, falling back: {e}")
+            continue
+        return embedder
+    return None
+
+
+def prepare_image(key, image):
+    """Process-pool entry point: decode and preprocess ``image`` with embedder ``key``."""
+    return get_embedder(key)._try_prepare(image)
+
+
+def warm_up(keys=None):
+    """Load the given models (default: the configured one) so the first request does not pay for it."""
+    loaded = []
+    for key in keys or [None]:
+        embedder = get_embedder(key)
+        if embedder is None:
+            continue
+        try:
+            embedder.ensure_loaded()
+            loaded.append(embedder)
+        except Exception as e:
+            print(f"Failed to warm up embedding model {embedder.name}: {e}")
+    return loaded
@@ -0,0 +1,130 @@
+"""Two-tier cache of image embeddings keyed by the content of the image file.
+
+The key is a BLAKE2 hash of the raw file bytes plus the embedding model name
+and version, so re-uploads of the same picture and repeated match runs reuse
+the stored vector without decoding the image or running the model. Lookups go
+to a per-process LRU first and then to the ``CachedEmbedding`` table, which is
+shared by every process. ``AI_EMBEDDING_CACHE_SIZE`` bounds the in-memory tier
+(0 disables it) and ``AI_EMBEDDING_CACHE_PERSIST`` toggles the database tier.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(data):
+    """Hex BLAKE2b digest of raw image bytes."""
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+def file_hash(image_field):
+    """Hex BLAKE2b digest of an image file, read in chunks rather than all at once."""
+    from .embedders import open_image_file
+
+    digest = hashlib.blake2b(digest_size=32)
+    fp = open_image_file(image_field)
+    try:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    finally:
+        if isinstance(image_field, (str, os.PathLike)):
+            fp.close()
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, embedding):
+        max_size = getattr(settings, 'AI_EMBEDDING_CACHE_SIZE', 2048)
+        if max_size <= 0:
+            return
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > max_size:
+                self._memory.popitem(last=False)
+
+    def get(self, digest, model_name, model_version):
+        """Return cached embedding bytes or None, counting the hit or miss."""
+        key = (digest, model_name, model_version)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+
+        if getattr(settings, 'AI_EMBEDDING_CACHE_PERSIST', True):
+            from .models import CachedEmbedding
+
+            try:
+                embedding = CachedEmbedding.objects.filter(
+                    content_hash=digest, embedding_model=model_name, embedding_version=model_version,
+                ).values_list('embedding', flat=True).first()
+            except Exception as e:
+                print(f"Embedding cache lookup failed: {e}")
+                embedding = None
+            if embedding is not None:
+                embedding = bytes(embedding)
+                self._remember(key, embedding)
+                with self._lock:
+                    self.persistent_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, digest, model_name, model_version, embedding):
+        self._remember((digest, model_name, model_version), embedding)
+        if getattr(settings, 'AI_EMBEDDING_CACHE_PERSIST', True):
+            from .models import CachedEmbedding
+
+            try:
+                # ignore_conflicts: another process may have stored the same image meanwhile
+                CachedEmbedding.objects.bulk_create([CachedEmbedding(
+                    content_hash=digest, embedding_model=model_name,
+                    embedding_version=model_version, embedding=embedding,
+                )], ignore_conflicts=True)
+            except Exception as e:
+                print(f"Embedding cache write failed: {e}")
+
+    def clear(self):
+        """Empty the in-memory tier and reset the counters (the table is left alone)."""
+        with self._lock:
+            self._memory.clear()
+            self.memory_hits = self.persistent_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.persistent_hits
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+            }
+
+
+# One cache per process, shared by every embedder
+embedding_cache = EmbeddingCache()
+
+
+def cache_stats():
+    """Hit/miss counters of this process's embedding cache."""
+    return embedding_cache.stats()
@@ -0,0 +1,114 @@
+"""Geohash cells and radius queries over item coordinates.
+
+Every item with a latitude/longitude stores its geohash (``AI_GEOHASH_PRECISION``
+characters) in an indexed ``geohash`` column, kept current by ``signals.py``.
+Items sharing a geohash prefix lie in the same grid cell, so
+:func:`items_near` selects the 3x3 block of cells around a point that is at
+least ``radius`` wide with index range scans on that column, then keeps the
+rows within ``radius`` by exact haversine distance computed in NumPy.
+"""
+
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def encode_geohash(latitude, longitude, precision=None):
+    """Geohash string of a point (``AI_GEOHASH_PRECISION`` characters by default)."""
+    if precision is None:
+        precision = getattr(settings, 'AI_GEOHASH_PRECISION', 9)
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """``(height, width)`` in degrees of a geohash cell of ``precision`` characters."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together contain every point within ``radius_km``.
+
+    The longest precision whose cells are at least ``radius_km`` tall and wide
+    is used, so the cell of the point and its eight neighbours suffice. Returns
+    None when the radius is too large for any prefix to help.
+    """
+    max_precision = getattr(settings, 'AI_GEOHASH_PRECISION', 9)
+    # Cells are narrowest on the side of the circle nearest the pole
+    cos_lat = max(math.cos(math.radians(min(abs(latitude) + radius_km / KM_PER_DEGREE, 90.0))), 1e-6)
+    precision = 0
+    for candidate in range(1, max_precision + 1):
+        height, width = cell_size(candidate)
+        if height * KM_PER_DEGREE < radius_km or width * KM_PER_DEGREE * cos_lat < radius_km:
+            break
+        precision = candidate
+    if precision == 0:
+        return None
+    height, width = cell_size(precision)
+    cells = set()
+    for dlat in (-height, 0.0, height):
+        for dlng in (-width, 0.0, width):
+            lat = min(max(latitude + dlat, -90.0), 90.0)
+            lng = (longitude + dlng + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lng, precision))
+    return sorted(cells)
+
+
+def cell_filter(cells):
+    """``Q`` matching geohashes under any of ``cells``, as index-friendly range conditions."""
+    condition = Q()
+    for prefix in cells:
+        # '~' sorts after every base32 character, so this is "starts with prefix"
+        condition |= Q(geohash__gte=prefix, geohash__lt=prefix + '~')
+    return condition
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distances in km from one point to arrays of points."""
+    lat1, lng1 = np.radians(latitude), np.radians(longitude)
+    lat2, lng2 = np.radians(np.asarray(latitudes, dtype=np.float64)), np.radians(np.asarray(longitudes, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def items_near(queryset, latitude, longitude, radius_km, limit=None):
+    """``[(item_id, distance_km), ...]`` of the items in ``queryset`` within ``radius_km``, nearest first."""
+    cells = covering_cells(latitude, longitude, radius_km)
+    queryset = queryset.exclude(latitude__isnull=True).exclude(longitude__isnull=True)
+    if cells is not None:
+        queryset = queryset.filter(cell_filter(cells))
+    rows = np.array(list(queryset.values_list('id', 'latitude', 'longitude')), dtype=np.float64).reshape(-1, 3)
+    if not len(rows):
+        return []
+    distances = haversine_km(latitude, longitude, rows[:, 1], rows[:, 2])
+    keep = np.flatnonzero(distances <= radius_km)
+    order = keep[np.argsort(distances[keep], kind='stable')]
+    if limit is not None:
+        order = order[:limit]
+    return [(int(rows[i, 0]), float(distances[i])) for i in order]
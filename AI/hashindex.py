@@ -0,0 +1,161 @@
+"""Near-duplicate photo lookup by perceptual hash.
+
+Every item stores the 64-bit pHash of its photo (``image_hash``, hex) computed
+on upload. :class:`HammingIndex` uses multi-index hashing: the hash is split
+into four 16-bit chunks with one lookup table each, and by the pigeonhole
+principle two hashes within Hamming distance 3 agree exactly on at least one
+chunk. A query therefore touches only the few items sharing a chunk instead
+of the whole catalogue; larger radii fall back to a linear scan.
+"""
+
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .descriptors import hamming_distance, phash
+from .index import ITEM_MODELS, item_kind
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def chunks(value):
+    return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def compute_image_hash(image_field):
+    """Hex pHash of an image file, or '' if it cannot be decoded."""
+    from .embedders import decode_image
+
+    if not image_field:
+        return ''
+    try:
+        return f"{phash(decode_image(image_field, min_size=64)):016x}"
+    except Exception as e:
+        print(f"Error hashing image {getattr(image_field, 'name', image_field)}: {e}")
+        return ''
+
+
+class HammingIndex:
+    """Multi-index hash table over 64-bit integer hashes."""
+
+    def __init__(self):
+        self._hashes = {}
+        self._tables = [defaultdict(set) for _ in range(CHUNKS)]
+        self._lock = threading.RLock()
+        # Database watermark of the last top-up (see get_hash_index); signals do not move it
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, item_id, value):
+        with self._lock:
+            self.remove(item_id)
+            self._hashes[item_id] = value
+            for table, chunk in zip(self._tables, chunks(value)):
+                table[chunk].add(item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            value = self._hashes.pop(item_id, None)
+            if value is None:
+                return False
+            for table, chunk in zip(self._tables, chunks(value)):
+                bucket = table[chunk]
+                bucket.discard(item_id)
+                if not bucket:
+                    del table[chunk]
+            return True
+
+    def search(self, value, radius):
+        """Return ``[(item_id, distance), ...]`` within ``radius`` bits, nearest first."""
+        with self._lock:
+            if radius < CHUNKS:
+                candidates = set()
+                for table, chunk in zip(self._tables, chunks(value)):
+                    candidates.update(table.get(chunk, ()))
+            else:
+                candidates = self._hashes.keys()
+            hits = [(item_id, hamming_distance(value, self._hashes[item_id])) for item_id in candidates]
+        return sorted([hit for hit in hits if hit[1] <= radius], key=lambda hit: (hit[1], hit[0]))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_hash_index(kind):
+    """Process-wide hash index for ``kind``, topped up with items changed since the last call.
+
+    Changes are found through ``updated_at``, which other processes' saves
+    bump too, so items they create or re-hash are picked up whatever their
+    id. Like ``ItemIndex.sync``, the watermark trails the top-up's start by
+    ``AI_INDEX_SYNC_OVERLAP_SECONDS`` for rows that commit late.
+    """
+    with _indexes_lock:
+        index = _indexes.get(kind)
+        if index is None:
+            index = _indexes[kind] = HammingIndex()
+    started = timezone.now()
+    qs = ITEM_MODELS[kind].objects.all()
+    if index.synced_at is None:
+        qs = qs.exclude(image_hash='')
+    else:
+        qs = qs.filter(updated_at__gte=index.synced_at)
+    for item_id, value in qs.values_list('id', 'image_hash').iterator(chunk_size=5000):
+        if value:
+            index.add(item_id, int(value, 16))
+        else:
+            index.remove(item_id)
+    overlap = timedelta(seconds=getattr(settings, 'AI_INDEX_SYNC_OVERLAP_SECONDS', 120))
+    index.synced_at = started - overlap
+    return index
+
+
+def reset_hash_indexes():
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def on_item_saved(item):
+    with _indexes_lock:
+        index = _indexes.get(item_kind(item))
+    if index is None:
+        return
+    if item.image_hash:
+        index.add(item.pk, int(item.image_hash, 16))
+    else:
+        index.remove(item.pk)
+
+
+def on_item_deleted(item):
+    with _indexes_lock:
+        index = _indexes.get(item_kind(item))
+    if index is not None:
+        index.remove(item.pk)
+
+
+def find_near_duplicates(item, kind, radius=None):
+    """Items of ``kind`` whose photo is within ``radius`` bits of ``item``'s pHash.
+
+    Returns ``[(item_id, distance), ...]`` nearest first, re-checked against the
+    database so hashes changed by other processes are not trusted blindly.
+    ``AI_DUPLICATE_MAX_DISTANCE = None`` disables the lookup.
+    """
+    if radius is None:
+        radius = getattr(settings, 'AI_DUPLICATE_MAX_DISTANCE', 3)
+    if radius is None or not item.image_hash:
+        return []
+    value = int(item.image_hash, 16)
+    hits = get_hash_index(kind).search(value, radius)
+    if not hits:
+        return []
+    current = dict(ITEM_MODELS[kind].objects.filter(id__in=[item_id for item_id, _ in hits])
+                   .values_list('id', 'image_hash'))
+    return [(item_id, distance) for item_id, distance in hits
+            if current.get(item_id) and hamming_distance(value, int(current[item_id], 16)) <= radius]
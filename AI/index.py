@@ -0,0 +1,462 @@
+"""In-memory vector index over persisted lost/found item embeddings.
+
+Each index keeps the L2-normalised float32 embeddings of one item kind
+('lost' or 'found') for one embedding model in a contiguous matrix, so a
+top-k query is a single matrix-vector product. Indexes are loaded lazily from
+the database and kept current through the model signals in ``signals.py``.
+
+The vector storage behind an index is pluggable (see ``ann.py``): exact
+brute force by default, or an approximate nearest-neighbour backend selected
+with ``settings.AI_INDEX_BACKEND`` for large catalogues. When
+``settings.AI_INDEX_DIR`` is set, indexes are persisted there so a restarted
+process only has to load the rows embedded since the last save.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from .models import LostProduct, FoundProduct
+from .quantize import QuantizedMatrix, decode_embedding
+
+ITEM_MODELS = {'lost': LostProduct, 'found': FoundProduct}
+
+# Rows read and added per step of ItemIndex.sync
+SYNC_BATCH_SIZE = 500
+
+
+def item_kind(item):
+    """Return 'lost' or 'found' for a LostProduct/FoundProduct instance."""
+    return 'lost' if isinstance(item, LostProduct) else 'found'
+
+
+def to_unit_vector(embedding):
+    """Convert embedding bytes (any format in ``quantize.py``) or an array into an L2-normalised float32 vector."""
+    if isinstance(embedding, (bytes, bytearray, memoryview)):
+        vec = decode_embedding(embedding)
+    else:
+        vec = np.asarray(embedding, dtype=np.float32)
+    vec = vec.reshape(-1).astype(np.float32)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+class VectorIndex:
+    """Brute-force cosine index with incremental add/remove and top-k search.
+
+    ``dtype`` selects the matrix precision: 'float32', 'float16' (half the
+    size on disk, held as float32 in memory for fast scoring) or 'int8' (a
+    quarter of the memory, plus one scale per row); see
+    :class:`quantize.QuantizedMatrix`.
+    """
+
+    def __init__(self, dim=None, dtype='float32'):
+        self.dim = dim
+        self.dtype = dtype
+        self._matrix = QuantizedMatrix(dim or 0, dtype)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._rows = {}
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._ids))
+        if self._matrix.dim != self.dim:
+            self._matrix = QuantizedMatrix(self.dim, self.dtype)
+        self._matrix = self._matrix.resized(capacity, self._size)
+        ids = np.empty(capacity, dtype=np.int64)
+        if self._size:
+            ids[:self._size] = self._ids[:self._size]
+        self._ids = ids
+
+    def add(self, item_id, embedding):
+        """Insert or replace the vector stored for ``item_id``."""
+        vec = to_unit_vector(embedding)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vec.size
+            if vec.size != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d embedding, got {vec.size}-d")
+            row = self._rows.get(item_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._rows[item_id] = row
+                self._ids[row] = item_id
+            self._matrix.set_row(row, vec)
+
+    def remove(self, item_id):
+        """Remove ``item_id`` from the index; returns False if it was not present."""
+        with self._lock:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                # Keep the matrix dense by moving the last row into the hole
+                self._matrix.copy_row(row, last)
+                moved = int(self._ids[last])
+                self._ids[row] = moved
+                self._rows[moved] = row
+            self._size = last
+            return True
+
+    def score(self, query, ids=None):
+        """Return ``(ids, scores)`` arrays of the cosine similarity of every vector to ``query``.
+
+        ``ids`` (an iterable of item ids) restricts scoring to those items.
+        """
+        vec = to_unit_vector(query)
+        with self._lock:
+            if self._size == 0 or vec.size != self.dim:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            if ids is not None:
+                rows = np.fromiter((self._rows[i] for i in ids if i in self._rows), dtype=np.int64)
+                return self._ids[rows], self._matrix.dot_rows(vec, rows)
+            return self._ids[:self._size].copy(), self._matrix.dot(vec, self._size)
+
+    def search(self, query, k=None, threshold=None, ids=None):
+        """Return ``[(item_id, score), ...]`` sorted by descending cosine similarity.
+
+        ``k`` limits the number of hits, ``threshold`` drops hits scoring below
+        it and ``ids`` restricts the search to those item ids.
+        """
+        ids, scores = self.score(query, ids)
+        return rank_scores(ids, scores, k, threshold)
+
+    def export(self):
+        """Return copies of the ``(ids, matrix)`` currently stored, as float32."""
+        with self._lock:
+            dim = self.dim or 0
+            if self._size == 0:
+                return np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32)
+            return self._ids[:self._size].copy(), self._matrix.rows(self._size)
+
+    def nbytes(self):
+        """Memory held by the vectors (including unused capacity)."""
+        return self._matrix.nbytes()
+
+    def save(self, path):
+        with self._lock:
+            ids = self._ids[:self._size].copy()
+            matrix = self._matrix.stored(self._size)
+            scales = self._matrix.scales[:self._size].copy() if self._matrix.scales is not None else np.ones(0)
+        with open(path, 'wb') as fp:
+            # Saved in ``dtype`` so a reload needs no re-quantization
+            np.savez(fp, ids=ids, matrix=matrix, scales=scales, dtype=np.array(self.dtype))
+
+    @classmethod
+    def load(cls, path, dtype='float32', **options):
+        with np.load(path) as data:
+            ids, matrix = data['ids'], data['matrix']
+            saved_dtype = str(data['dtype']) if 'dtype' in data else 'float32'
+            scales = data['scales'] if 'scales' in data else None
+        index = cls(dim=matrix.shape[1] if len(ids) else None, dtype=dtype)
+        if not len(ids):
+            return index
+        if saved_dtype != dtype:
+            # Written with a different AI_INDEX_DTYPE; convert through float32
+            rows = matrix.astype(np.float32)
+            if saved_dtype == 'int8':
+                rows *= scales[:, None]
+            for item_id, row in zip(ids.tolist(), rows):
+                index.add(item_id, row)
+            return index
+        index._matrix = QuantizedMatrix(matrix.shape[1], dtype)
+        index._matrix.data = np.ascontiguousarray(matrix, dtype=index._matrix.data.dtype)
+        if dtype == 'int8':
+            index._matrix.scales = scales.astype(np.float32)
+        index._ids = ids.astype(np.int64)
+        index._size = len(ids)
+        index._rows = {int(item_id): row for row, item_id in enumerate(ids)}
+        return index
+
+
+def rank_scores(ids, scores, k=None, threshold=None):
+    """Filter and sort parallel id/score arrays into ``[(item_id, score), ...]``."""
+    if threshold is not None:
+        keep = np.flatnonzero(scores >= threshold)
+        ids, scores = ids[keep], scores[keep]
+    if k is not None and k < scores.size:
+        top = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[top], scores[top]
+    order = np.argsort(-scores, kind='stable')
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def index_options():
+    """Backend name and tuning options for new vector indexes, read from settings."""
+    return getattr(settings, 'AI_INDEX_BACKEND', 'exact'), {
+        'nlist': getattr(settings, 'AI_INDEX_NLIST', 256),
+        'nprobe': getattr(settings, 'AI_INDEX_NPROBE', 8),
+        'ef_search': getattr(settings, 'AI_INDEX_EF_SEARCH', 64),
+        'dtype': getattr(settings, 'AI_INDEX_DTYPE', 'float32'),
+    }
+
+
+def index_name(kind, model_name, model_version, backend_name, options):
+    """Name of an item index: its files in ``AI_INDEX_DIR``, or its pgvector table."""
+    name = f"{kind}-{model_name}-{model_version}-{backend_name}"
+    if options.get('dtype', 'float32') != 'float32':
+        name = f"{name}-{options['dtype']}"
+    return slugify(name)
+
+
+class ItemIndex:
+    """Vector index over one item kind and embedding model, synced from the database."""
+
+    def __init__(self, kind, model_name, model_version):
+        from .ann import create_vector_index
+
+        self.kind = kind
+        self.model_name = model_name
+        self.model_version = model_version
+        self.synced_at = None
+        # embedded_at of the rows loaded inside the re-scanned overlap window (see sync)
+        self.recent = {}
+        self.backend_name, self.options = index_options()
+        base = self.base_path()
+        # Only the mmap backend uses a path (its files are the index itself) and only pgvector a name
+        self.vectors = create_vector_index(self.backend_name, path=base and f"{base}.mmap",
+                                           name=self.name(), **self.options)
+        self.unsaved_changes = 0
+        self._sync_lock = threading.RLock()
+        self.last_sync = None  # time.monotonic() of the last completed sync
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __contains__(self, item_id):
+        return item_id in self.vectors
+
+    def add(self, item_id, embedding):
+        self.vectors.add(item_id, embedding)
+        self.unsaved_changes += 1
+
+    def add_batch(self, rows):
+        """Add ``(item_id, embedding, embedded_at)`` rows read by :meth:`sync`.
+
+        Backends with ``add_many`` (pgvector) write the batch in one statement;
+        rows with the wrong dimension are skipped either way.
+        """
+        if hasattr(self.vectors, 'add_many'):
+            added = set(self.vectors.add_many([(item_id, embedding) for item_id, embedding, _at in rows]))
+        else:
+            added = set()
+            for item_id, embedding, _at in rows:
+                try:
+                    self.vectors.add(item_id, embedding)
+                except ValueError:
+                    continue
+                added.add(item_id)
+        self.unsaved_changes += len(added)
+        for item_id, _embedding, embedded_at in rows:
+            if item_id in added:
+                self.recent[item_id] = embedded_at
+
+    def remove(self, item_id):
+        self.recent.pop(item_id, None)
+        removed = self.vectors.remove(item_id)
+        self.unsaved_changes += int(removed)
+        return removed
+
+    def search(self, query, k=None, threshold=None, ids=None):
+        return self.vectors.search(query, k=k, threshold=threshold, ids=ids)
+
+    def accepts(self, item):
+        return (bool(item.embedding) and item.embedding_model == self.model_name
+                and item.embedding_version == self.model_version)
+
+    def sync(self, max_age=None):
+        """Load embeddings persisted since the last sync (all of them on first use).
+
+        This also picks up items embedded by other processes, which this
+        process never sees through signals.
+
+        ``embedded_at`` is set in Python before the row commits, so a row can
+        become visible after a sync started with an earlier ``embedded_at``.
+        The stored watermark therefore trails the sync start by
+        ``AI_INDEX_SYNC_OVERLAP_SECONDS`` and the overlap is scanned again;
+        rows already loaded with the same ``embedded_at`` are skipped.
+
+        Concurrent calls are serialised on the index. With ``max_age`` the
+        database is not queried again if the last sync finished less than
+        ``max_age`` seconds ago.
+        """
+        with self._sync_lock:
+            if max_age and self.last_sync is not None and time.monotonic() - self.last_sync < max_age:
+                return
+            started = timezone.now()
+            if self.synced_at is None:
+                self.load()
+            qs = ITEM_MODELS[self.kind].objects.filter(
+                embedding_model=self.model_name,
+                embedding_version=self.model_version,
+                embedding__isnull=False,
+            )
+            if self.synced_at is not None:
+                qs = qs.filter(embedded_at__gte=self.synced_at)
+            rows = qs.values_list('id', 'embedding', 'embedded_at').iterator(chunk_size=SYNC_BATCH_SIZE)
+            batch = []
+            for item_id, embedding, embedded_at in rows:
+                if not embedding or self.recent.get(item_id) == embedded_at:
+                    continue
+                batch.append((item_id, embedding, embedded_at))
+                if len(batch) >= SYNC_BATCH_SIZE:
+                    self.add_batch(batch)
+                    batch = []
+            if batch:
+                self.add_batch(batch)
+            overlap = timedelta(seconds=getattr(settings, 'AI_INDEX_SYNC_OVERLAP_SECONDS', 120))
+            self.synced_at = started - overlap
+            self.recent = {item_id: embedded_at for item_id, embedded_at in self.recent.items()
+                           if embedded_at is not None and embedded_at >= self.synced_at}
+            # Persistent backends already hold the rows on disk; only the sync time needs writing
+            save_every = 1 if self.persistent else getattr(settings, 'AI_INDEX_SAVE_EVERY', 1000)
+            if self.unsaved_changes >= save_every:
+                self.save()
+            self.last_sync = time.monotonic()
+
+    @property
+    def persistent(self):
+        return getattr(self.vectors, 'persistent', False)
+
+    # -------------------- Persistence --------------------
+
+    def name(self):
+        return index_name(self.kind, self.model_name, self.model_version, self.backend_name, self.options)
+
+    def base_path(self):
+        index_dir = getattr(settings, 'AI_INDEX_DIR', None)
+        if not index_dir:
+            return None
+        return os.path.join(index_dir, self.name())
+
+    def save(self):
+        """Atomically write the index and its sync metadata to ``AI_INDEX_DIR``.
+
+        Backends shared across hosts (pgvector) keep the sync time themselves.
+        """
+        if hasattr(self.vectors, 'save_sync_state'):
+            if self.synced_at is None:
+                return False
+            self.vectors.save_sync_state(self.synced_at)
+            self.unsaved_changes = 0
+            return True
+        base = self.base_path()
+        if base is None or self.synced_at is None:
+            return False
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        tmp = f"{base}.tmp-{os.getpid()}"
+        if self.persistent:
+            if self.vectors.needs_compaction():
+                self.vectors.compact()
+        else:
+            self.vectors.save(tmp)
+            # Backends may write sidecar files next to the main one (e.g. hnswlib ids)
+            for produced in glob.glob(glob.escape(tmp) + '*'):
+                os.replace(produced, f"{base}.index{produced[len(tmp):]}")
+        with open(f"{tmp}.json", 'w') as fp:
+            json.dump({'synced_at': self.synced_at.isoformat(), 'count': len(self)}, fp)
+        os.replace(f"{tmp}.json", f"{base}.json")
+        self.unsaved_changes = 0
+        return True
+
+    def load(self):
+        """Replace the in-memory vectors with the saved copy, if one exists."""
+        from .ann import load_vector_index
+
+        if hasattr(self.vectors, 'load_sync_state'):
+            synced_at = self.vectors.load_sync_state()
+            if synced_at is None:
+                return False
+            self.synced_at = synced_at
+            self.unsaved_changes = 0
+            return True
+        base = self.base_path()
+        if base is None or not os.path.exists(f"{base}.json"):
+            return False
+        try:
+            with open(f"{base}.json") as fp:
+                meta = json.load(fp)
+            if not self.persistent:
+                self.vectors = load_vector_index(self.backend_name, f"{base}.index", **self.options)
+        except Exception as e:
+            print(f"Failed to load vector index {base}: {e}")
+            return False
+        self.synced_at = parse_datetime(meta['synced_at'])
+        self.unsaved_changes = 0
+        return True
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(kind, model_name, model_version=''):
+    """Return the process-wide index for ``kind`` and the given model, synced with the DB."""
+    key = (kind, model_name, model_version)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = ItemIndex(kind, model_name, model_version)
+    # Items saved in this process reach the index through signals; only other
+    # processes' rows need the query, so a sync is skipped if one just finished
+    index.sync(max_age=getattr(settings, 'AI_INDEX_SYNC_INTERVAL', 2.0))
+    return index
+
+
+def loaded_indexes(kind):
+    with _indexes_lock:
+        return [index for key, index in _indexes.items() if key[0] == kind]
+
+
+def reset_indexes():
+    """Drop every loaded index; they are rebuilt from the database on next use."""
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def save_indexes():
+    """Persist every loaded index that has unsaved changes."""
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        if index.unsaved_changes:
+            index.save()
+
+
+def on_item_saved(item):
+    """Add, refresh or drop ``item`` in the loaded indexes of its kind."""
+    for index in loaded_indexes(item_kind(item)):
+        if index.accepts(item):
+            try:
+                index.add(item.pk, bytes(item.embedding))
+            except ValueError:
+                index.remove(item.pk)
+        else:
+            index.remove(item.pk)
+
+
+def on_item_deleted(item):
+    for index in loaded_indexes(item_kind(item)):
+        index.remove(item.pk)
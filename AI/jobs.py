@@ -0,0 +1,179 @@
+"""Durable background job queue stored in the application database.
+
+Used when Celery/Redis are not deployed: :func:`enqueue` writes a ``Job`` row
+and ``manage.py runworker`` executes queued jobs on worker threads. A worker
+leases a job for ``AI_JOB_LEASE_SECONDS`` and keeps renewing the lease while
+the job runs; if the worker dies the lease expires and another worker picks
+the job up again. Failed jobs are retried with
+exponential backoff until ``max_attempts`` is reached.
+
+Tasks are plain module-level functions referenced by dotted path, and their
+arguments must be JSON serialisable.
+"""
+
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+def task_path(func):
+    """Dotted import path of a task function (or the path itself)."""
+    if isinstance(func, str):
+        return func
+    # A Celery task keeps the decorated function as ``run``
+    func = getattr(func, 'run', func)
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def enqueue(func, *args, run_at=None, max_attempts=None, **kwargs):
+    """Queue ``func(*args, **kwargs)`` to run on a ``runworker`` process; returns the ``Job``."""
+    return Job.objects.create(
+        task=task_path(func),
+        args=list(args),
+        kwargs=kwargs,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or getattr(settings, 'AI_JOB_MAX_ATTEMPTS', 5),
+    )
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retry number ``attempts`` (1-based), doubling each time."""
+    base = getattr(settings, 'AI_JOB_RETRY_DELAY', 10)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'AI_JOB_MAX_RETRY_DELAY', 3600))
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def claim_job(worker_id=None, lease_seconds=None):
+    """Lease the next due job for ``worker_id``; returns the ``Job`` or None if the queue is idle.
+
+    Claiming is a conditional UPDATE on the row, so concurrent workers (threads
+    or processes, on any database backend) never run the same job twice while
+    its lease is valid. Jobs whose lease expired are treated as queued again.
+    """
+    worker_id = worker_id or default_worker_id()
+    lease_seconds = lease_seconds or getattr(settings, 'AI_JOB_LEASE_SECONDS', 300)
+    now = timezone.now()
+    expired = Q(status='running', locked_until__lt=now)
+    # A job whose worker died on its last allowed attempt is not retried again
+    Job.objects.filter(expired, attempts__gte=F('max_attempts')).update(
+        status='failed', locked_by='', locked_until=None, last_error='Worker lease expired',
+    )
+    due = Q(status='queued', run_at__lte=now) | expired
+    for _ in range(5):
+        candidates = list(Job.objects.filter(due).order_by('run_at', 'id').values_list('id', flat=True)[:10])
+        if not candidates:
+            return None
+        for job_id in candidates:
+            claimed = Job.objects.filter(due, pk=job_id).update(
+                status='running',
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=lease_seconds),
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return Job.objects.get(pk=job_id)
+        # Every candidate was taken by another worker; look again
+    return None
+
+
+def renew_lease(job, lease_seconds):
+    """Extend the lease on a job this worker still holds; returns False once it was lost."""
+    return bool(Job.objects.filter(pk=job.id, status='running', locked_by=job.locked_by).update(
+        locked_until=timezone.now() + timedelta(seconds=lease_seconds),
+    ))
+
+
+def heartbeat(job, lease_seconds, stop_event):
+    """Thread loop renewing ``job``'s lease every third of ``lease_seconds`` until ``stop_event`` is set."""
+    try:
+        while not stop_event.wait(lease_seconds / 3):
+            try:
+                if not renew_lease(job, lease_seconds):
+                    return
+            except Exception as e:
+                # e.g. the database is briefly locked; the next beat tries again
+                print(f"Could not renew the lease on job {job.id}: {e}")
+    finally:
+        connection.close()
+
+
+def run_job(job, lease_seconds=None):
+    """Execute a leased job and record the outcome; returns True on success.
+
+    A heartbeat thread renews the lease while the task runs, so jobs may take
+    longer than ``AI_JOB_LEASE_SECONDS`` without being handed to another worker.
+    """
+    lease_seconds = lease_seconds or getattr(settings, 'AI_JOB_LEASE_SECONDS', 300)
+    stop_heartbeat = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job, lease_seconds, stop_heartbeat),
+                            name=f'job-heartbeat-{job.id}', daemon=True)
+    beat.start()
+    try:
+        func = import_string(job.task)
+        func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        print(f"Job {job.id} ({job.task}) failed on attempt {job.attempts}: {error.strip().splitlines()[-1]}")
+        if job.attempts >= job.max_attempts:
+            fields = {'status': 'failed'}
+        else:
+            fields = {'status': 'queued', 'run_at': timezone.now() + timedelta(seconds=backoff_delay(job.attempts))}
+        Job.objects.filter(pk=job.id, locked_by=job.locked_by).update(
+            locked_by='', locked_until=None, last_error=error, **fields,
+        )
+        return False
+    finally:
+        stop_heartbeat.set()
+        beat.join()
+    Job.objects.filter(pk=job.id, locked_by=job.locked_by).update(
+        status='done', locked_by='', locked_until=None, last_error='',
+    )
+    return True
+
+
+def run_pending(worker_id=None, limit=None, lease_seconds=None):
+    """Run due jobs until the queue is idle (or ``limit`` jobs ran); returns the number run."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job(worker_id, lease_seconds)
+        if job is None:
+            break
+        run_job(job, lease_seconds)
+        count += 1
+    return count
+
+
+def work(stop_event, worker_id=None, poll_interval=None):
+    """Worker thread loop: run jobs as they become due until ``stop_event`` is set."""
+    worker_id = worker_id or default_worker_id()
+    poll_interval = poll_interval or getattr(settings, 'AI_JOB_POLL_INTERVAL', 1.0)
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            ran = run_pending(worker_id, limit=100)
+        except Exception as e:
+            # e.g. the database is briefly locked; try again on the next poll
+            print(f"Job worker {worker_id} error: {e}")
+            ran = 0
+        if not ran:
+            stop_event.wait(poll_interval)
+
+
+def purge_jobs(older_than_days=7):
+    """Delete finished jobs older than ``older_than_days``; failed jobs are kept for inspection."""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    deleted, _ = Job.objects.filter(status='done', updated_at__lt=cutoff).delete()
+    return deleted
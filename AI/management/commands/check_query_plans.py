@@ -0,0 +1,104 @@
+"""
+Management command to verify the hot queries are answered from indexes, not full table scans
+"""
+import re
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
+from django.utils import timezone
+
+from AI.candidates import candidate_filter
+from AI.geo import cell_filter, covering_cells
+from AI.models import FoundProduct, Job, LostProduct, MatchResult, Notification
+
+# SQLite plan lines that read a whole table: "SCAN <table>" without an index
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (?!.*\bUSING (?:COVERING )?INDEX\b)(?!CONSTANT ROW)')
+SQLITE_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def hot_queries():
+    """``(name, queryset)`` for every query issued per request or per match.
+
+    The parameter values are placeholders; only the plan is inspected.
+    """
+    today = date.today()
+    cells = covering_cells(51.5, -0.12, 5)
+    lost = LostProduct(date_lost=today, latitude=51.5, longitude=-0.12, location='Library', category='Wallet')
+    return [
+        # AI/views.py search_items and its stats
+        ('recent matches', MatchResult.objects.filter(match_status='Matched').order_by('-created_at')[:5]),
+        ('matched count', MatchResult.objects.filter(match_status='Matched')),
+        ('lost by date', LostProduct.objects.filter(date_lost__gte=today - timedelta(days=30), date_lost__lte=today)),
+        ('found by date', FoundProduct.objects.filter(date_found__gte=today - timedelta(days=30), date_found__lte=today)),
+        ('lost by location', LostProduct.objects.filter(Exact(Lower('location'), 'library'))),
+        ('found by location', FoundProduct.objects.filter(Exact(Lower('location'), 'library'))),
+        # AI/views.py match_status and AI/matching.py save_match_results
+        ('matches of an item', MatchResult.objects.filter(match_status='Matched', lost_product_id=1)),
+        ('stored pairs', MatchResult.objects.filter(lost_product_id__in=[1, 2], found_product_id__in=[3, 4])),
+        # Users/views.py Dashboard
+        ('user notifications', Notification.objects.filter(user_id=1).order_by('-created_at')),
+        ('unread notifications', Notification.objects.filter(user_id=1, is_sent=False)),
+        ('user lost items', LostProduct.objects.filter(user_id=1).order_by('-created_at')[:3]),
+        ('user found items', FoundProduct.objects.filter(user_id=1).order_by('-created_at')[:3]),
+        # AI/pagination.py: the second page of /api/ai/matches/ and /api/ai/found/
+        ('match list page', MatchResult.objects.filter(created_at__lt=timezone.now()).order_by('-created_at', '-id')[:51]),
+        ('found list page', FoundProduct.objects.filter(created_at__lt=timezone.now()).order_by('-created_at', '-id')[:51]),
+        # AI/candidates.py match candidate pre-selection
+        ('match candidates', FoundProduct.objects.filter(candidate_filter(lost, 'found'))),
+        # AI/geo.py items_near
+        ('found near a point', FoundProduct.objects.filter(cell_filter(cells))),
+        # AI/hashindex.py get_hash_index
+        ('found hash top-up', FoundProduct.objects.filter(updated_at__gte=timezone.now())),
+        # AI/jobs.py claim_job
+        ('due jobs', Job.objects.filter(status='queued', run_at__lte=timezone.now()).order_by('run_at')[:1]),
+    ]
+
+
+def plan_problems(vendor, plan):
+    """Full scans (and sorts in a temporary B-tree on SQLite) found in an ``EXPLAIN`` output."""
+    problems = []
+    for line in plan.splitlines():
+        if vendor == 'sqlite':
+            if SQLITE_FULL_SCAN.search(line):
+                problems.append(f"full scan: {line.strip()}")
+            elif SQLITE_SORT in line:
+                problems.append(f"sort without an index: {line.strip()}")
+        elif 'Seq Scan' in line:
+            problems.append(f"full scan: {line.strip()}")
+    return problems
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN for each hot query and fail if any of them needs a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny tables make sequential scans look cheapest; ask whether an index path exists at all
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                return queryset.explain()
+        return queryset.explain()
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f"Query plan checks are not implemented for {connection.vendor}")
+        failures = 0
+        for name, queryset in hot_queries():
+            plan = self.explain(queryset)
+            problems = plan_problems(connection.vendor, plan)
+            if options['verbose_plans']:
+                self.stdout.write(f"{name}:\n{plan}\n")
+            if problems:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f"{name}: " + '; '.join(problems)))
+            else:
+                self.stdout.write(f"{name}: ok")
+        if failures:
+            raise CommandError(f"{failures} hot queries are not served by an index")
+        self.stdout.write(self.style.SUCCESS('All hot queries use indexes'))
@@ -0,0 +1,95 @@
+"""
+Management command to shrink the MatchResult table to what compact match storage keeps
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django.core.management.base import BaseCommand
+
+from AI.models import MatchResult
+
+WRITE_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Drop stored non-matches and duplicated embedding blobs from MatchResult'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-score', type=float,
+                            default=getattr(settings, 'AI_MATCH_STORE_MIN_SCORE', 0.5),
+                            help='Delete non-matches scoring below this')
+        parser.add_argument('--top-k', type=int,
+                            default=getattr(settings, 'AI_MATCH_STORE_TOP_K', 20),
+                            help='Non-matches kept per lost and per found item (0 = no limit)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Run VACUUM afterwards so SQLite returns the space to the filesystem')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        non_matches = MatchResult.objects.exclude(match_status='Matched')
+
+        # 1. Repeated runs store the same pair again; keep only the newest row per pair and
+        #    status (the key save_match_results dedupes on), so a Matched row is never
+        #    dropped in favour of a later Not Matched one
+        newest = (
+            MatchResult.objects.values('lost_product_id', 'found_product_id', 'match_status')
+            .annotate(newest_id=Max('id')).values_list('newest_id', flat=True)
+        )
+        duplicates = MatchResult.objects.exclude(id__in=newest)
+        self.delete(duplicates, 'duplicate pair/status rows', dry_run)
+
+        # 2. Non-matches below the floor score
+        self.delete(non_matches.filter(similarity_score__lt=options['min_score']),
+                    f'non-matches scoring below {options["min_score"]}', dry_run)
+        self.delete(non_matches.filter(similarity_score__isnull=True), 'unscored non-matches', dry_run)
+
+        # 3. Non-matches in neither the lost item's nor the found item's best top-k; matching
+        #    runs from both sides, and each side's run keeps its own top-k (see should_store)
+        if options['top_k']:
+            ranked = non_matches.annotate(
+                lost_rank=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('lost_product_id')],
+                    order_by=[F('similarity_score').desc(), F('id').desc()],
+                ),
+                found_rank=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('found_product_id')],
+                    order_by=[F('similarity_score').desc(), F('id').desc()],
+                ),
+            )
+            beyond_top_k = ranked.filter(
+                lost_rank__gt=options['top_k'], found_rank__gt=options['top_k'],
+            ).values_list('id', flat=True)
+            self.delete(MatchResult.objects.filter(id__in=list(beyond_top_k)),
+                        f'non-matches outside the top {options["top_k"]} of both their items', dry_run)
+
+        # 4. Embedding copies; the vectors live on the lost/found items
+        blobs = MatchResult.objects.filter(lost_embedding__isnull=False) | \
+            MatchResult.objects.filter(found_embedding__isnull=False)
+        ids = list(blobs.order_by('id').values_list('id', flat=True))
+        if not dry_run:
+            # Batched like delete(), so the UPDATE never holds the write lock for the whole table
+            for start in range(0, len(ids), WRITE_BATCH_SIZE):
+                with transaction.atomic():
+                    MatchResult.objects.filter(id__in=ids[start:start + WRITE_BATCH_SIZE]).update(
+                        lost_embedding=None, found_embedding=None)
+        self.stdout.write(f'{"Would clear" if dry_run else "Cleared"} embedding copies on {len(ids)} rows')
+
+        if options['vacuum'] and not dry_run and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write('Vacuumed the SQLite database')
+
+        self.stdout.write(self.style.SUCCESS('Match table compaction complete!'))
+
+    def delete(self, queryset, label, dry_run):
+        ids = list(queryset.values_list('id', flat=True))
+        if not dry_run:
+            # Delete in batches to keep each write transaction (and SQLite lock) short
+            for start in range(0, len(ids), WRITE_BATCH_SIZE):
+                with transaction.atomic():
+                    MatchResult.objects.filter(id__in=ids[start:start + WRITE_BATCH_SIZE]).delete()
+        self.stdout.write(f'{"Would delete" if dry_run else "Deleted"} {len(ids)} {label}')
@@ -0,0 +1,63 @@
+"""
+Management command to measure how quantized index storage changes ranking against float32
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from AI.embedders import get_embedder
+from AI.index import ITEM_MODELS, VectorIndex, to_unit_vector
+from AI.quantize import FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Compare recall@k, score error, memory and query time of float16/int8 indexes with float32'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['lost', 'found'], default='found',
+                            help='Catalogue to index; queries come from the other kind (or itself)')
+        parser.add_argument('--model', default=None, help='Embedding model name (default: configured model)')
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200, help='Maximum number of query vectors')
+
+    def load(self, kind, model_name):
+        rows = ITEM_MODELS[kind].objects.filter(embedding_model=model_name, embedding__isnull=False)
+        ids, vectors = [], []
+        for item_id, blob in rows.values_list('id', 'embedding').iterator(chunk_size=2000):
+            if blob:
+                ids.append(item_id)
+                vectors.append(to_unit_vector(bytes(blob)))
+        return ids, vectors
+
+    def handle(self, *args, **options):
+        model_name = options['model'] or getattr(get_embedder(), 'name', None)
+        ids, vectors = self.load(options['kind'], model_name)
+        if not ids:
+            raise CommandError(f"No {options['kind']} items have {model_name} embeddings")
+        other = 'lost' if options['kind'] == 'found' else 'found'
+        _query_ids, queries = self.load(other, model_name)
+        queries = (queries or vectors)[:options['queries']]
+        k = min(options['k'], len(ids))
+
+        indexes = {}
+        for fmt in FORMATS:
+            index = VectorIndex(dtype=fmt)
+            for item_id, vec in zip(ids, vectors):
+                index.add(item_id, vec)
+            indexes[fmt] = index
+        reference = [dict(indexes['float32'].search(q, k=k)) for q in queries]
+
+        self.stdout.write(f"{len(ids)} {options['kind']} vectors, {len(queries)} queries, k={k}")
+        for fmt, index in indexes.items():
+            started = time.perf_counter()
+            results = [dict(index.search(q, k=k)) for q in queries]
+            per_query = (time.perf_counter() - started) / len(queries)
+            recall = np.mean([len(ref.keys() & res.keys()) / k for ref, res in zip(reference, results)])
+            exact = [dict(zip(*indexes['float32'].score(q))) for q in queries]
+            errors = [abs(score - scores[item_id]) for res, scores in zip(results, exact)
+                      for item_id, score in res.items()]
+            self.stdout.write(
+                f"{fmt:>8}: recall@{k} {recall:.4f}  max score error {max(errors):.5f}  "
+                f"memory {index.nbytes() / 1024:.1f} KiB  {per_query * 1000:.3f} ms/query"
+            )
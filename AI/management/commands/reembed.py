@@ -0,0 +1,166 @@
+"""
+Management command to (re)compute the stored embeddings of lost and found items in bulk
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from AI.derivatives import embedding_source
+from AI.embedders import EMBEDDERS, get_embedder
+from AI.index import ITEM_MODELS
+from AI.quantize import encode_embedding
+
+EMBEDDING_FIELDS = ['embedding', 'embedding_model', 'embedding_version', 'embedded_at']
+
+
+def init_worker(settings_module):
+    # Spawned worker processes (e.g. on Windows) need Django configured to use the registry
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Compute embeddings for existing lost/found items in batches (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['lost', 'found', 'all'], default='all')
+        parser.add_argument('--model', choices=sorted(EMBEDDERS), default=None,
+                            help='Embedding model to use (default: AI_EMBEDDING_MODEL)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-embed items that already have a current embedding')
+        parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass')
+        parser.add_argument('--chunk-size', type=int, default=512, help='Rows fetched and written per chunk')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Image decoding processes (0 decodes on threads in this process)')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Checkpoint file used to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true', help='Ignore any existing checkpoint')
+        parser.add_argument('--originals', action='store_true',
+                            help='Decode the original uploads instead of the model-sized derivatives')
+
+    def handle(self, *args, **options):
+        embedder = get_embedder(options['model'])
+        if embedder is None:
+            raise CommandError(f"Embedding model {options['model']!r} is not available on this node")
+        embedder.ensure_loaded()
+
+        self.checkpoint_path = options['checkpoint'] or os.path.join(
+            getattr(settings, 'AI_INDEX_DIR', None) or settings.BASE_DIR, 'reembed.checkpoint.json'
+        )
+        checkpoint = {} if options['restart'] else self.read_checkpoint(embedder)
+
+        executor = None
+        if options['workers'] > 0:
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'Retrace.settings'),),
+            )
+        try:
+            kinds = ['lost', 'found'] if options['kind'] == 'all' else [options['kind']]
+            for kind in kinds:
+                self.reembed_kind(kind, embedder, checkpoint, executor, options)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(self.style.SUCCESS('Re-embedding complete!'))
+
+    def reembed_kind(self, kind, embedder, checkpoint, executor, options):
+        model = ITEM_MODELS[kind]
+        qs = model.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            # Items this model failed on before (no vector stored) are retried
+            qs = qs.exclude(embedding_model=embedder.name, embedding_version=embedder.version,
+                            embedding__isnull=False)
+        last_id = checkpoint.get(kind, 0)
+        if last_id:
+            qs = qs.filter(id__gt=last_id)
+            self.stdout.write(f'Resuming {kind} items after id {last_id}')
+
+        total = qs.count()
+        done = embedded = 0
+        started = time.monotonic()
+        chunk = []
+        for item in qs.only('id', 'image').order_by('id').iterator(chunk_size=options['chunk_size']):
+            chunk.append(item)
+            if len(chunk) >= options['chunk_size']:
+                embedded += self.embed_chunk(model, chunk, embedder, executor, options)
+                done += len(chunk)
+                self.save_checkpoint(embedder, checkpoint, kind, chunk[-1].id)
+                self.report(kind, done, total, embedded, started)
+                chunk = []
+        if chunk:
+            embedded += self.embed_chunk(model, chunk, embedder, executor, options)
+            done += len(chunk)
+            self.save_checkpoint(embedder, checkpoint, kind, chunk[-1].id)
+        self.report(kind, done, total, embedded, started)
+
+    def embed_chunk(self, model, items, embedder, executor, options):
+        if executor is not None:
+            # Worker processes open the files themselves, so only paths cross the process boundary
+            try:
+                images = [self.image_source(item, options, path=True) for item in items]
+            except NotImplementedError:
+                images, executor = [self.image_source(item, options) for item in items], None
+        else:
+            images = [self.image_source(item, options) for item in items]
+        matrix, ok = embedder.embed_files(images, batch_size=options['batch_size'], executor=executor)
+
+        now = timezone.now()
+        storage_format = getattr(settings, 'AI_EMBEDDING_STORAGE', 'float32')
+        updated = []
+        for item, row, row_ok in zip(items, matrix, ok):
+            if not row_ok:
+                self.stderr.write(f'Could not embed {model.__name__} {item.id} ({item.image.name})')
+                continue
+            item.embedding = encode_embedding(row, storage_format)
+            item.embedding_model = embedder.name
+            item.embedding_version = embedder.version
+            item.embedded_at = now
+            updated.append(item)
+        model.objects.bulk_update(updated, EMBEDDING_FIELDS, batch_size=options['batch_size'])
+        return len(updated)
+
+    def image_source(self, item, options, path=False):
+        if not options['originals']:
+            # Pre-sized model copy from AI/derivatives.py, when one exists on local storage
+            source = embedding_source(item.image)
+            if isinstance(source, str):
+                return source
+        return item.image.path if path else item.image
+
+    def report(self, kind, done, total, embedded, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            f'{kind}: {done}/{total} items processed, {embedded} embedded '
+            f'({done / elapsed:.1f} items/s, {elapsed:.1f}s elapsed)'
+        )
+
+    # -------------------- Checkpointing --------------------
+
+    def read_checkpoint(self, embedder):
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as fp:
+            data = json.load(fp)
+        if data.get('model') != embedder.name or data.get('version') != embedder.version:
+            self.stdout.write(self.style.WARNING('Ignoring checkpoint written for a different model'))
+            return {}
+        return data.get('last_ids', {})
+
+    def save_checkpoint(self, embedder, checkpoint, kind, last_id):
+        checkpoint[kind] = last_id
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        tmp = f'{self.checkpoint_path}.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'model': embedder.name, 'version': embedder.version, 'last_ids': checkpoint}, fp)
+        os.replace(tmp, self.checkpoint_path)
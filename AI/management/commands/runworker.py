@@ -0,0 +1,89 @@
+"""
+Management command to run the database-backed background job queue (AI/jobs.py)
+"""
+import multiprocessing
+import os
+import threading
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from AI.jobs import default_worker_id, purge_jobs, run_pending, work
+
+
+def run_threads(threads, poll_interval, stop_event):
+    workers = [
+        threading.Thread(target=work, args=(stop_event,),
+                         kwargs={'poll_interval': poll_interval}, name=f'job-worker-{n}', daemon=True)
+        for n in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+def run_process(settings_module, threads, poll_interval):
+    # Child processes (spawned on Windows/macOS) need Django configured first
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+    run_threads(threads, poll_interval, threading.Event())
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (matching, email delivery) when Celery is not used'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'AI_JOB_WORKER_THREADS', 2),
+                            help='Worker threads per process')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Worker processes, each running --threads threads')
+        parser.add_argument('--poll-interval', type=float,
+                            default=getattr(settings, 'AI_JOB_POLL_INTERVAL', 1.0),
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs that are due now, then exit (e.g. from cron)')
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help='Delete finished jobs older than this many days on start-up')
+
+    def handle(self, *args, **options):
+        if options['purge_days']:
+            purged = purge_jobs(options['purge_days'])
+            if purged:
+                self.stdout.write(f'Purged {purged} finished jobs')
+
+        if options['once']:
+            count = run_pending(default_worker_id())
+            self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
+            return
+
+        threads = max(1, options['threads'])
+        self.stdout.write(
+            f"Starting {options['processes']} worker process(es) with {threads} thread(s) each; "
+            'press Ctrl+C to stop'
+        )
+        if options['processes'] <= 1:
+            run_threads(threads, options['poll_interval'], threading.Event())
+            return
+
+        settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'Retrace.settings')
+        processes = [
+            multiprocessing.Process(target=run_process,
+                                    args=(settings_module, threads, options['poll_interval']))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
@@ -0,0 +1,60 @@
+"""
+Management command to create the PostgreSQL tables of the pgvector index backend
+"""
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from AI.embedders import get_embedder
+from AI.index import ITEM_MODELS, index_name, index_options, to_unit_vector
+from AI.pgvector import create_index_table
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+
+class Command(BaseCommand):
+    help = "Create the vector extension and each item index's pgvector table and HNSW index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['lost', 'found', 'all'], default='all')
+        parser.add_argument('--model', default=None, help='Embedding model key (default: configured model)')
+        parser.add_argument('--dim', type=int, default=None,
+                            help='Vector dimension (default: read from stored embeddings or probed from the model)')
+        parser.add_argument('--m', type=int, default=16, help='HNSW graph degree')
+        parser.add_argument('--ef-construction', type=int, default=64, help='HNSW build-time candidate list size')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The pgvector backend needs a PostgreSQL database (set POSTGRES_DB)')
+        embedder = get_embedder(options['model'])
+        if embedder is None:
+            raise CommandError('No embedding model is available')
+        dim = options['dim'] or self.detect_dim(embedder)
+
+        _backend, index_settings = index_options()
+        kinds = ['lost', 'found'] if options['kind'] == 'all' else [options['kind']]
+        for kind in kinds:
+            name = index_name(kind, embedder.name, embedder.version, 'pgvector', index_settings)
+            table = create_index_table(name, dim, m=options['m'], ef_construction=options['ef_construction'])
+            self.stdout.write(f'{kind}: {dim}-d vectors of {embedder.name} in {table}')
+        self.stdout.write(self.style.SUCCESS('pgvector tables ready!'))
+
+    def detect_dim(self, embedder):
+        for model in ITEM_MODELS.values():
+            blob = (model.objects.filter(embedding_model=embedder.name, embedding_version=embedder.version,
+                                         embedding__isnull=False)
+                    .values_list('embedding', flat=True).first())
+            if blob:
+                return to_unit_vector(bytes(blob)).size
+        if Image is not None:
+            buf = BytesIO()
+            Image.new('RGB', (64, 64)).save(buf, format='PNG')
+            buf.seek(0)
+            matrix, ok = embedder.embed_files([buf], batch_size=1)
+            if ok.all():
+                return matrix.shape[1]
+        raise CommandError(f'Could not determine the vector size of {embedder.name}; pass --dim')
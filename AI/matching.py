@@ -0,0 +1,266 @@
+"""Shared lost/found matching pipeline.
+
+Every report path (HTML form views, REST viewsets and the Celery task) goes
+through :func:`match_item`. Item embeddings are persisted on the
+``LostProduct``/``FoundProduct`` rows the first time they are needed, so a new
+report costs one model forward pass instead of one per catalogue item, and
+candidates are scored in one pass against the in-memory index in ``index.py``.
+Only items passing the date/place/category pre-selection in ``candidates.py``
+are embedded and scored (see :func:`search_candidates`).
+"""
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .candidates import candidate_filter, candidate_ids, keep_candidates
+from .db_writer import run_write
+from .derivatives import embedding_source
+from .embedders import get_embedder
+from .hashindex import find_near_duplicates
+from .index import ITEM_MODELS, get_index, item_kind
+from .models import LostProduct, MatchResult
+from .quantize import encode_embedding
+
+MATCH_THRESHOLD = 0.8
+
+
+def get_item_embedding(item, embedder):
+    """Return the stored embedding bytes for ``item``, computing them once if needed.
+
+    The vector is recomputed only when the item has none yet or when it was
+    produced by a different model name/version than ``embedder``. An image the
+    model cannot embed is recorded as failed (model name/version set, no
+    vector) and not attempted again until the image or the model changes, or
+    ``manage.py reembed`` retries it.
+    """
+    if not item.image:
+        return None
+    stored = stored_embedding(item, embedder)
+    if stored is not None or embedding_failed(item, embedder):
+        return stored
+
+    # The model-sized derivative is much cheaper to decode than the original upload
+    emb = embedder.embed_file(embedding_source(item.image))
+    if emb is None:
+        item.embedding = None
+    else:
+        # Stored as float32, float16 or int8 per AI_EMBEDDING_STORAGE; readers decode any of them
+        item.embedding = encode_embedding(np.frombuffer(emb, dtype=np.float32),
+                                          getattr(settings, 'AI_EMBEDDING_STORAGE', 'float32'))
+    item.embedding_model = embedder.name
+    item.embedding_version = embedder.version
+    # For a failure this is the time of the attempt
+    item.embedded_at = timezone.now()
+    # update_fields keeps auto_now fields untouched; post_save refreshes the index
+    item.save(update_fields=['embedding', 'embedding_model', 'embedding_version', 'embedded_at'])
+    return emb
+
+
+def stored_embedding(item, embedder):
+    """The embedding bytes stored on ``item`` if ``embedder`` produced them, else None."""
+    if (item.embedding and item.embedding_model == embedder.name
+            and item.embedding_version == embedder.version):
+        return bytes(item.embedding)
+    return None
+
+
+def embedding_failed(item, embedder):
+    """True if ``embedder`` already tried ``item``'s current image and could not embed it."""
+    return (not item.embedding and item.embedding_model == embedder.name
+            and item.embedding_version == embedder.version)
+
+
+def embed_pending_items(kind, embedder, condition=None):
+    """Compute embeddings for items of ``kind`` that have an image but no current vector.
+
+    ``condition`` (a ``Q``) limits this to the items a match will actually compare.
+    Items ``embedder`` already failed on are skipped (see :func:`get_item_embedding`).
+    """
+    pending = (
+        ITEM_MODELS[kind].objects
+        .exclude(image='').exclude(image__isnull=True)
+        # Covers both stored vectors and recorded failures of this model
+        .exclude(embedding_model=embedder.name, embedding_version=embedder.version)
+    )
+    if condition is not None:
+        pending = pending.filter(condition)
+    for item in pending.iterator():
+        get_item_embedding(item, embedder)
+
+
+def match_item(item, embedder=None, notify=None, threshold=MATCH_THRESHOLD):
+    """Match a lost or found item against every item of the opposite kind.
+
+    ``embedder`` defaults to the configured model from the registry in
+    ``embedders.py``. Compared pairs are recorded as ``MatchResult`` rows
+    according to ``AI_MATCH_STORAGE`` (see :func:`should_store`) and
+    ``notify(lost, found)`` is called for pairs scoring at or above ``threshold``.
+    Returns a list of ``(candidate, similarity, status)`` tuples, best first.
+
+    Candidates are pre-selected, embedded and scored by :func:`candidate_hits`,
+    which :func:`rank_candidates` shares; near-duplicate photos are reported
+    without running the embedding model.
+    """
+    is_lost = isinstance(item, LostProduct)
+    kind = 'found' if item_kind(item) == 'lost' else 'lost'
+    index, hits = candidate_hits(item, embedder, k=getattr(settings, 'AI_MATCH_MAX_CANDIDATES', None))
+    candidates = ITEM_MODELS[kind].objects.in_bulk([item_id for item_id, _score in hits])
+
+    compact = getattr(settings, 'AI_MATCH_STORAGE', 'compact') == 'compact'
+    results = []
+    rows = []
+    for rank, (candidate_id, similarity) in enumerate(hits):
+        candidate = candidates.get(candidate_id)
+        if candidate is None or (index is not None and not index.accepts(candidate)):
+            # Deleted or re-embedded by another process since the index was synced
+            if index is not None:
+                index.remove(candidate_id)
+            continue
+        lost, found = (item, candidate) if is_lost else (candidate, item)
+        status_str = "Matched" if similarity >= threshold else "Not Matched"
+        results.append((candidate, similarity, status_str))
+        if not should_store(similarity, rank, status_str, compact):
+            continue
+        row = MatchResult(
+            lost_product=lost,
+            found_product=found,
+            similarity_score=similarity,
+            threshold_used=threshold,
+            match_status=status_str,
+        )
+        if not compact:
+            # Full mode keeps a copy of both vectors on every row
+            row.lost_embedding = bytes(lost.embedding) if lost.embedding else None
+            row.found_embedding = bytes(found.embedding) if found.embedding else None
+        rows.append(row)
+
+    saved = save_match_results(rows)
+    if notify is not None:
+        # Notify only once the results are committed, outside the write transaction,
+        # and only for matches not recorded (and so already notified) by an earlier run
+        for row in saved:
+            if row.match_status == "Matched":
+                notify(row.lost_product, row.found_product)
+    return results
+
+
+def search_candidates(index, query, kind, condition, allowed, k=None, threshold=None):
+    """Index hits for ``query`` among the pre-selected candidates (see ``candidates.py``).
+
+    A small candidate set (``allowed``) is scored exactly. A large one would
+    bypass the approximate backends and send them a huge id list, so the
+    search runs unrestricted for ``AI_MATCH_OVERSAMPLE`` times the ``k``
+    needed (``AI_MATCH_ANN_K`` when ``k`` is None) and hits outside
+    ``condition`` are dropped.
+    """
+    if condition is None or allowed is not None:
+        return index.search(query, k=k, threshold=threshold, ids=allowed)
+    limit = k or getattr(settings, 'AI_MATCH_ANN_K', 200)
+    hits = index.search(query, k=limit * getattr(settings, 'AI_MATCH_OVERSAMPLE', 4), threshold=threshold)
+    return keep_candidates(hits, kind, condition)[:limit]
+
+
+def candidate_hits(item, embedder=None, k=None, threshold=None, write=True):
+    """``(index, hits)``: the pre-selected candidates for ``item``, scored best first.
+
+    ``hits`` are ``(item_id, similarity)`` pairs of the opposite kind. Items
+    outside the ``candidates.py`` pre-selection are neither embedded nor
+    scored. Near-duplicate photos found through the perceptual-hash index
+    (``hashindex.py``) are returned directly, scored ``1 - distance/64``,
+    with ``index`` None; otherwise ``index`` is the ``ItemIndex`` searched.
+
+    With ``write``, ``item`` and the pending candidates are embedded and saved
+    first. Without it only stored embeddings are used, and ``(None, None)``
+    is returned when ``item`` has an image without a current embedding.
+    """
+    kind = 'found' if item_kind(item) == 'lost' else 'lost'
+    condition = candidate_filter(item, kind)
+    allowed = candidate_ids(kind, condition) if condition is not None else None
+    if allowed is not None and not allowed:
+        return None, []
+    duplicates = keep_candidates(find_near_duplicates(item, kind), kind, condition, allowed)
+    if duplicates:
+        # Re-uploads of the same photo are matches already; skip embedding and scoring
+        hits = [(item_id, 1.0 - distance / 64) for item_id, distance in duplicates]
+        return None, [hit for hit in hits if threshold is None or hit[1] >= threshold][:k]
+    if not item.image:
+        return None, []
+    embedder = embedder or get_embedder()
+    if write:
+        item_embedding = get_item_embedding(item, embedder) if embedder is not None else None
+        if item_embedding is None:
+            return None, []
+        embed_pending_items(kind, embedder, condition)
+    else:
+        item_embedding = stored_embedding(item, embedder) if embedder is not None else None
+        if item_embedding is None:
+            return None, None
+    index = get_index(kind, embedder.name, embedder.version)
+    return index, search_candidates(index, item_embedding, kind, condition, allowed, k=k, threshold=threshold)
+
+
+def rank_candidates(item, k=20, min_score=None, embedder=None):
+    """The ``k`` best candidates of the opposite kind for ``item``, without writing anything.
+
+    Candidates are pre-selected and scored as in :func:`match_item` (see
+    :func:`candidate_hits`), but nothing is embedded or stored: ``item`` must
+    already carry an embedding from ``embedder`` and only candidates already
+    in the index are ranked. Returns ``[(candidate, similarity), ...]`` best
+    first, scoring at least ``min_score``, or None when ``item`` has an image
+    that is not embedded yet.
+    """
+    kind = 'found' if item_kind(item) == 'lost' else 'lost'
+    index, hits = candidate_hits(item, embedder, k=k, threshold=min_score, write=False)
+    if hits is None:
+        return None
+    candidates = ITEM_MODELS[kind].objects.in_bulk([item_id for item_id, _score in hits])
+    return [(candidates[item_id], similarity) for item_id, similarity in hits
+            if item_id in candidates and (index is None or index.accepts(candidates[item_id]))]
+
+
+def should_store(similarity, rank, status_str, compact=True):
+    """Decide whether a compared pair is persisted as a ``MatchResult``.
+
+    ``full`` storage keeps every pair. ``compact`` storage always keeps
+    matches, plus near misses scoring at least ``AI_MATCH_STORE_MIN_SCORE``
+    among the ``AI_MATCH_STORE_TOP_K`` best candidates of the run; embeddings
+    are then read from the items instead of being copied onto the row.
+    """
+    if not compact or status_str == "Matched":
+        return True
+    top_k = getattr(settings, 'AI_MATCH_STORE_TOP_K', 20)
+    if top_k is not None and rank >= top_k:
+        return False
+    return similarity >= getattr(settings, 'AI_MATCH_STORE_MIN_SCORE', 0.5)
+
+
+def save_match_results(rows):
+    """Insert ``MatchResult`` rows with batched INSERTs inside a single transaction.
+
+    Rows repeating a (lost, found, status) already stored are skipped, so
+    re-running a match does not duplicate results. The INSERTs go through
+    the process's single writer thread (``db_writer.py``). Returns the rows
+    inserted.
+    """
+    if not rows:
+        return []
+    return run_write(_insert_new_results, rows)
+
+
+def _insert_new_results(rows):
+    batch_size = getattr(settings, 'AI_MATCH_BULK_BATCH_SIZE', 500)
+    with transaction.atomic():
+        existing = set(MatchResult.objects.filter(
+            lost_product_id__in={row.lost_product_id for row in rows},
+            found_product_id__in={row.found_product_id for row in rows},
+        ).values_list('lost_product_id', 'found_product_id', 'match_status'))
+        new_rows = []
+        for row in rows:
+            key = (row.lost_product_id, row.found_product_id, row.match_status)
+            if key not in existing:
+                existing.add(key)
+                new_rows.append(row)
+        MatchResult.objects.bulk_create(new_rows, batch_size=batch_size)
+    return new_rows
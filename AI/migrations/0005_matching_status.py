@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0004_item_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foundproduct',
+            name='matching_status',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='lostproduct',
+            name='matching_status',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0006_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedEmbedding',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('embedding_version', models.CharField(blank=True, default='', max_length=50)),
+                ('embedding', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'embedding_model', 'embedding_version'), name='unique_cached_embedding')],
+            },
+        ),
+    ]
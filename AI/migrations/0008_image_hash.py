@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0007_embedding_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foundproduct',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='lostproduct',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:45
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0008_image_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foundproduct',
+            name='category',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='lostproduct',
+            name='category',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(fields=['date_found'], name='AI_foundpro_date_fo_4dbbb2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(fields=['latitude', 'longitude'], name='AI_foundpro_latitud_9d2f9c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(django.db.models.functions.text.Lower('location'), name='ai_found_location_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(django.db.models.functions.text.Lower('category'), name='ai_found_category_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(fields=['date_lost'], name='AI_lostprod_date_lo_1263f5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(fields=['latitude', 'longitude'], name='AI_lostprod_latitud_2f3b2a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(django.db.models.functions.text.Lower('location'), name='ai_lost_location_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(django.db.models.functions.text.Lower('category'), name='ai_lost_category_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_geohashes(apps, schema_editor):
+    from AI.geo import encode_geohash
+
+    for model_name in ('LostProduct', 'FoundProduct'):
+        model = apps.get_model('AI', model_name)
+        items = list(model.objects.exclude(latitude__isnull=True).exclude(longitude__isnull=True)
+                     .only('id', 'latitude', 'longitude'))
+        for item in items:
+            item.geohash = encode_geohash(item.latitude, item.longitude)
+        model.objects.bulk_update(items, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0009_candidate_filters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foundproduct',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='lostproduct',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(fields=['geohash'], name='AI_foundpro_geohash_f9fa5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(fields=['geohash'], name='AI_lostprod_geohash_c2e2ab_idx'),
+        ),
+        migrations.RunPython(fill_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0010_geohash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(fields=['user', 'created_at'], name='AI_foundpro_user_id_174df3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(fields=['user', 'created_at'], name='AI_lostprod_user_id_bf8ee7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='matchresult',
+            index=models.Index(fields=['match_status', 'created_at'], name='AI_matchres_match_s_41d1f9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at'], name='AI_notifica_user_id_824758_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0011_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(fields=['created_at', 'id'], name='AI_foundpro_created_533e60_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(fields=['created_at', 'id'], name='AI_lostprod_created_44b6f4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='matchresult',
+            index=models.Index(fields=['created_at', 'id'], name='AI_matchres_created_022116_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routemap',
+            index=models.Index(fields=['created_at', 'id'], name='AI_routemap_created_f884b3_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0012_api_page_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='foundproduct',
+            index=models.Index(fields=['updated_at'], name='AI_foundpro_updated_f1d2aa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lostproduct',
+            index=models.Index(fields=['updated_at'], name='AI_lostprod_updated_02614d_idx'),
+        ),
+    ]
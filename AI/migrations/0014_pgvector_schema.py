@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:12
+
+from django.db import migrations, transaction
+
+
+def create_pgvector_schema(apps, schema_editor):
+    """Create the vector extension and the index sync-state table on PostgreSQL only."""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    try:
+        # A savepoint, so a failure leaves the migration's transaction usable
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    except Exception as e:
+        # e.g. pgvector is not installed on the server or the role may not create extensions;
+        # the NumPy indexes are used until `manage.py setup_pgvector` succeeds
+        print(f"Skipping the pgvector extension: {e}")
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE IF NOT EXISTS ai_vector_index '
+                       '(name text PRIMARY KEY, dim integer, synced_at timestamptz)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI', '0013_hash_index_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pgvector_schema, migrations.RunPython.noop),
+    ]
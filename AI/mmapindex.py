@@ -0,0 +1,250 @@
+"""Vector index kept in memory-mapped files shared by every process on a host.
+
+The ``mmap`` backend (``AI_INDEX_BACKEND = 'mmap'``) stores one directory
+per index under ``AI_INDEX_DIR``:
+
+* ``vectors-<generation>.f32`` - append-only float32 rows, ``dim`` values each,
+* ``ids-<generation>.i64``     - append-only int64 item id of each row; a
+  negative id is a tombstone for a removed item,
+* ``current.json``             - generation number and dimension.
+
+Processes open the files read-only with ``np.memmap``, so the vectors live
+once in the OS page cache however many web/Celery workers there are, and a
+restarted worker starts without reading vectors from the database. Writers
+append under an advisory file lock. Vectors are written before their id, so a
+reader never sees an id without its vector, and a writer first trims any
+vector left without an id by an interrupted append. When more than half the rows are
+dead (replaced or removed), :meth:`MmapIndex.compact` writes the live rows to
+a new generation and swaps ``current.json`` atomically; readers switch on
+their next refresh.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from .index import rank_scores, to_unit_vector
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still serialised within a process
+    fcntl = None
+
+META_FILE = 'current.json'
+
+
+class MmapIndex:
+    """Cosine index over append-only memory-mapped files (see module docstring)."""
+
+    persistent = True  # every change is on disk as soon as add()/remove() return
+
+    def __init__(self, path=None, dim=None, min_compact_rows=1024, **_options):
+        if not path:
+            raise ValueError("The 'mmap' index backend needs AI_INDEX_DIR to be set")
+        self.path = path
+        self.dim = dim
+        self.min_compact_rows = min_compact_rows
+        self._lock = threading.RLock()
+        self._generation = None
+        self._vectors = None
+        self._known = 0
+        self._rows = {}
+        self._dead = 0
+        self._live = None
+        os.makedirs(path, exist_ok=True)
+        self.refresh()
+
+    def __len__(self):
+        self.refresh()
+        return len(self._rows)
+
+    def __contains__(self, item_id):
+        self.refresh()
+        return item_id in self._rows
+
+    # -------------------- Files --------------------
+
+    def files(self, generation):
+        return (os.path.join(self.path, f'vectors-{generation}.f32'),
+                os.path.join(self.path, f'ids-{generation}.i64'))
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(self.path, META_FILE)) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, generation, dim):
+        tmp = os.path.join(self.path, f'{META_FILE}.tmp-{os.getpid()}')
+        with open(tmp, 'w') as fp:
+            json.dump({'generation': generation, 'dim': dim}, fp)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+
+    @contextmanager
+    def file_lock(self):
+        with self._lock, open(os.path.join(self.path, 'lock'), 'a') as fp:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    # -------------------- Reading --------------------
+
+    def refresh(self):
+        """Map rows appended by any process since the last call; reopen after a compaction."""
+        with self._lock:
+            meta = self.read_meta()
+            if meta is None:
+                return
+            if meta['generation'] != self._generation:
+                self._generation, self.dim = meta['generation'], meta['dim']
+                self._vectors, self._known, self._rows, self._dead, self._live = None, 0, {}, 0, None
+            vector_file, id_file = self.files(self._generation)
+            try:
+                count = min(os.path.getsize(id_file) // 8, os.path.getsize(vector_file) // (4 * self.dim))
+            except OSError:
+                return
+            if count <= self._known:
+                return
+            ids = np.memmap(id_file, dtype=np.int64, mode='r', shape=(count,))
+            self._vectors = np.memmap(vector_file, dtype=np.float32, mode='r', shape=(count, self.dim))
+            for row, item_id in enumerate(ids[self._known:count].tolist(), start=self._known):
+                previous = self._rows.pop(abs(item_id), None)
+                self._dead += previous is not None
+                if item_id > 0:
+                    self._rows[item_id] = row
+                else:
+                    self._dead += 1  # the tombstone row itself
+            self._known = count
+            self._live = None
+
+    def live(self):
+        """``(ids, rows)`` arrays of the current row of every live item."""
+        with self._lock:
+            if self._live is None:
+                self._live = (np.fromiter(self._rows.keys(), dtype=np.int64, count=len(self._rows)),
+                              np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows)))
+            return self._live
+
+    def score(self, query, ids=None):
+        vec = to_unit_vector(query)
+        self.refresh()
+        with self._lock:
+            if not self._rows or vec.size != self.dim:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            if ids is not None:
+                ids = np.fromiter((i for i in ids if i in self._rows), dtype=np.int64)
+                rows = np.fromiter((self._rows[i] for i in ids.tolist()), dtype=np.int64, count=len(ids))
+                return ids, np.asarray(self._vectors[rows] @ vec)
+            ids, rows = self.live()
+            # One product over the mapped file (no copy of the matrix), then pick the live rows
+            scores = np.asarray(self._vectors[:self._known] @ vec)
+            return ids, scores[rows]
+
+    def search(self, query, k=None, threshold=None, ids=None):
+        ids, scores = self.score(query, ids)
+        return rank_scores(ids, scores, k, threshold)
+
+    def export(self):
+        self.refresh()
+        with self._lock:
+            if not self._rows:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+            ids, rows = self.live()
+            return ids.copy(), np.asarray(self._vectors[rows], dtype=np.float32)
+
+    # -------------------- Writing --------------------
+
+    def _append(self, item_id, vec):
+        with self.file_lock():
+            meta = self.read_meta()
+            if meta is None:
+                generation = 1
+                for name in self.files(generation):
+                    open(name, 'ab').close()
+                self.write_meta(generation, vec.size)
+            self.refresh()
+            if vec.size != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d embedding, got {vec.size}-d")
+            vector_file, id_file = self.files(self._generation)
+            # An append interrupted between its two writes leaves a vector without
+            # its id (or a partial id); cut both files back to the complete rows
+            # so the next vector lands at its id's offset
+            rows = os.path.getsize(id_file) // 8
+            for name, size in ((id_file, rows * 8), (vector_file, rows * self.dim * 4)):
+                if os.path.getsize(name) > size:
+                    os.truncate(name, size)
+            # Vector first: readers only count rows whose id has been written
+            with open(vector_file, 'ab') as fp:
+                fp.write(vec.astype(np.float32).tobytes())
+            with open(id_file, 'ab') as fp:
+                fp.write(np.int64(item_id).tobytes())
+        self.refresh()
+
+    def add(self, item_id, embedding):
+        vec = to_unit_vector(embedding)
+        self.refresh()
+        with self._lock:
+            if self.dim is not None and vec.size != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d embedding, got {vec.size}-d")
+            row = self._rows.get(item_id)
+            if row is not None and np.array_equal(self._vectors[row], vec):
+                return  # another process already stored this exact vector
+            self._append(item_id, vec)
+
+    def remove(self, item_id):
+        self.refresh()
+        with self._lock:
+            if item_id not in self._rows:
+                return False
+            self._append(-item_id, np.zeros(self.dim, dtype=np.float32))
+            return True
+
+    def needs_compaction(self):
+        self.refresh()
+        return self._dead > max(self.min_compact_rows, len(self._rows))
+
+    def compact(self):
+        """Rewrite the live rows into a new generation and atomically switch readers to it."""
+        with self.file_lock():
+            self.refresh()
+            if self._generation is None:
+                return False
+            old_files = self.files(self._generation)
+            generation = self._generation + 1
+            ids, rows = self.live()
+            order = np.argsort(rows)
+            vector_file, id_file = self.files(generation)
+            with open(vector_file, 'wb') as fp:
+                for start in range(0, len(order), 65536):
+                    chunk = rows[order[start:start + 65536]]
+                    fp.write(np.ascontiguousarray(self._vectors[chunk], dtype=np.float32).tobytes())
+                fp.flush()
+                os.fsync(fp.fileno())
+            with open(id_file, 'wb') as fp:
+                fp.write(ids[order].astype(np.int64).tobytes())
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.write_meta(generation, self.dim)
+            self.refresh()
+        for name in old_files:
+            try:
+                # Processes still mapping the old files keep reading them until they refresh
+                os.remove(name)
+            except OSError:
+                pass
+        return True
+
+    def save(self, path):
+        """Nothing to write: rows are persisted as they are added."""
+
+    @classmethod
+    def load(cls, path, **options):
+        return cls(path=path, **options)
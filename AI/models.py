@@ -1,4 +1,8 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .derivatives import derivative_url
 from django.contrib.auth.models import User
 
 
@@ -19,6 +23,7 @@ class LostProduct(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    category = models.CharField(max_length=100, blank=True, default='')
     date_lost = models.DateField(null=True, blank=True)
     location_lost = models.CharField(max_length=255, null=True, blank=True)
     location = models.CharField(max_length=255, null=True, blank=True)
@@ -26,20 +31,57 @@ class LostProduct(models.Model):
     phone_number = models.CharField(max_length=20, null=True, blank=True)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    # Geohash of latitude/longitude for radius queries, see AI/geo.py
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     contact_info = models.CharField(max_length=255, null=True, blank=True)
     image = models.ImageField(upload_to='lost_product_images/', blank=True, null=True)
+    # Persisted image embedding, computed once per item and reused by every matcher
+    embedding = models.BinaryField(blank=True, null=True, editable=False)
+    embedding_model = models.CharField(max_length=100, blank=True, default='')
+    embedding_version = models.CharField(max_length=50, blank=True, default='')
+    embedded_at = models.DateTimeField(null=True, blank=True)
+    # 64-bit perceptual hash of the photo (hex) for near-duplicate lookup, see AI/hashindex.py
+    image_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
+    # Background matching progress: '', 'pending', 'running', 'done' or 'failed'
+    matching_status = models.CharField(max_length=20, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A user's items, newest first (Users dashboard)
+            models.Index(fields=['user', 'created_at']),
+            # API pages, newest first (AI/pagination.py)
+            models.Index(fields=['created_at', 'id']),
+            # Search date range and candidate pre-selection (see AI/candidates.py)
+            models.Index(fields=['date_lost']),
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['geohash']),
+            models.Index(Lower('location'), name='ai_lost_location_lower_idx'),
+            models.Index(Lower('category'), name='ai_lost_category_lower_idx'),
+            # Hash index top-ups (AI/hashindex.py)
+            models.Index(fields=['updated_at']),
+        ]
+
     def __str__(self):
         return self.name
 
+    @property
+    def thumbnail_url(self):
+        """JPEG thumbnail URL, falling back to the original image."""
+        return derivative_url(self.image, 'thumb') or (self.image.url if self.image else None)
+
+    @property
+    def thumbnail_webp_url(self):
+        return derivative_url(self.image, 'thumb_webp')
+
 
 class FoundProduct(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    category = models.CharField(max_length=100, blank=True, default='')
     date_found = models.DateField(null=True, blank=True)
     location_found = models.CharField(max_length=255, null=True, blank=True)
     location = models.CharField(max_length=255, null=True, blank=True)
@@ -47,14 +89,50 @@ class FoundProduct(models.Model):
     phone_number = models.CharField(max_length=20, null=True, blank=True)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    # Geohash of latitude/longitude for radius queries, see AI/geo.py
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     contact_info = models.CharField(max_length=255, null=True, blank=True)
     image = models.ImageField(upload_to='found_product_images/', blank=True, null=True)
+    # Persisted image embedding, computed once per item and reused by every matcher
+    embedding = models.BinaryField(blank=True, null=True, editable=False)
+    embedding_model = models.CharField(max_length=100, blank=True, default='')
+    embedding_version = models.CharField(max_length=50, blank=True, default='')
+    embedded_at = models.DateTimeField(null=True, blank=True)
+    # 64-bit perceptual hash of the photo (hex) for near-duplicate lookup, see AI/hashindex.py
+    image_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
+    # Background matching progress: '', 'pending', 'running', 'done' or 'failed'
+    matching_status = models.CharField(max_length=20, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A user's items, newest first (Users dashboard)
+            models.Index(fields=['user', 'created_at']),
+            # API pages, newest first (AI/pagination.py)
+            models.Index(fields=['created_at', 'id']),
+            # Search date range and candidate pre-selection (see AI/candidates.py)
+            models.Index(fields=['date_found']),
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['geohash']),
+            models.Index(Lower('location'), name='ai_found_location_lower_idx'),
+            models.Index(Lower('category'), name='ai_found_category_lower_idx'),
+            # Hash index top-ups (AI/hashindex.py)
+            models.Index(fields=['updated_at']),
+        ]
+
     def __str__(self):
         return self.name
 
+    @property
+    def thumbnail_url(self):
+        """JPEG thumbnail URL, falling back to the original image."""
+        return derivative_url(self.image, 'thumb') or (self.image.url if self.image else None)
+
+    @property
+    def thumbnail_webp_url(self):
+        return derivative_url(self.image, 'thumb_webp')
+
 
 class MatchResult(models.Model):
     id = models.AutoField(primary_key=True)
@@ -69,6 +147,14 @@ class MatchResult(models.Model):
     match_score = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Recent matches: filter by status, newest first
+            models.Index(fields=['match_status', 'created_at']),
+            # API pages, newest first (AI/pagination.py)
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Match {self.id}: {self.lost_product.name} - {self.found_product.name}"
 
@@ -83,6 +169,12 @@ class Notification(models.Model):
     sent_at = models.DateTimeField(auto_now_add=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # A user's notifications, newest first
+            models.Index(fields=['user', 'created_at']),
+        ]
+
     def __str__(self):
         return f"Notification {self.id} to {self.user_contact or self.user}"
 
@@ -94,6 +186,12 @@ class RouteMap(models.Model):
     route_data = models.JSONField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # API pages, newest first (AI/pagination.py)
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     def __str__(self):
         if self.lost_product and self.found_product:
             return f"RouteMap {self.id} for {self.lost_product.name} to {self.found_product.name}"
@@ -101,3 +199,52 @@ class RouteMap(models.Model):
             return f"RouteMap {self.id} for {self.lost_product.name}"
         return f"RouteMap {self.id}"
 
+
+
+class CachedEmbedding(models.Model):
+    """Embedding of an image file keyed by a hash of its bytes (see AI/embedding_cache.py)."""
+    id = models.AutoField(primary_key=True)
+    content_hash = models.CharField(max_length=64)
+    embedding_model = models.CharField(max_length=100)
+    embedding_version = models.CharField(max_length=50, blank=True, default='')
+    embedding = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'embedding_model', 'embedding_version'],
+                                    name='unique_cached_embedding'),
+        ]
+
+    def __str__(self):
+        return f"{self.embedding_model} embedding of {self.content_hash[:12]}"
+
+
+class Job(models.Model):
+    """A background task in the database-backed job queue (see AI/jobs.py)."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    task = models.CharField(max_length=255)  # dotted path of the task function
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True, default='')
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f"Job {self.id}: {self.task} ({self.status})"
@@ -0,0 +1,28 @@
+"""Pagination for the AI REST API."""
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Newest-first cursor pagination on ``(created_at, id)``.
+
+    Each page is selected with ``WHERE created_at < <cursor>`` on an index
+    instead of an OFFSET, so deep pages cost the same as the first one and
+    rows inserted in the meantime do not shift pages. ``id`` orders rows
+    created in the same instant. Pages hold ``AI_API_PAGE_SIZE`` rows;
+    ``?page_size=`` is honoured up to ``AI_API_MAX_PAGE_SIZE``.
+
+    Set as ``pagination_class`` on the AI viewsets only: other apps' models
+    have no ``created_at``, and their clients expect unpaginated lists.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        self.page_size = getattr(settings, 'AI_API_PAGE_SIZE', 50)
+        return super().get_page_size(request)
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'AI_API_MAX_PAGE_SIZE', 200)
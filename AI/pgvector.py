@@ -0,0 +1,210 @@
+"""Vector index stored in PostgreSQL with the pgvector extension.
+
+With ``AI_INDEX_BACKEND = 'pgvector'`` on a PostgreSQL database, every item
+index keeps its vectors in a table of its own, ``(item_id, embedding
+vector(dim))``, with an HNSW index on cosine distance, and top-k queries run
+in the database (``ORDER BY embedding <=> query LIMIT k``). All app servers
+share those vectors, so none are held in process memory and app servers stay
+stateless. Each index's last sync time is kept in the ``ai_vector_index``
+table, so a new process only copies the rows embedded since then.
+
+The schema is never changed while serving requests: migration 0014 creates
+the extension and the ``ai_vector_index`` table, and ``manage.py
+setup_pgvector`` creates the vector table of each index (its dimension
+depends on the embedding model). Vectors are passed to the database as text
+literals cast to ``vector``, so no extra Python package is needed. On other
+databases, without the extension, or before an index's table exists,
+``create_vector_index`` falls back to the NumPy index.
+"""
+
+import hashlib
+import re
+
+import numpy as np
+from django.db import connection, transaction
+
+from .index import rank_scores, to_unit_vector
+
+META_TABLE = 'ai_vector_index'
+
+
+def pgvector_available():
+    """Whether the default database is PostgreSQL with the ``vector`` extension installed."""
+    if connection.vendor != 'postgresql':
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'vector'")
+            return cursor.fetchone() is not None
+    except Exception as e:
+        print(f"pgvector is not available: {e}")
+        return False
+
+
+def index_dim(name):
+    """Dimension of the vector table set up for index ``name``, or None if it has none yet."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [META_TABLE])
+        if cursor.fetchone()[0] is None:
+            return None
+        cursor.execute(f'SELECT dim FROM {META_TABLE} WHERE name = %s', [name])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_schema(cursor):
+    """DDL shared by every index: the extension and the sync-state table (migration 0014)."""
+    cursor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS {META_TABLE} '
+                   '(name text PRIMARY KEY, dim integer, synced_at timestamptz)')
+
+
+def create_index_table(name, dim, m=16, ef_construction=64):
+    """Create the vector table and HNSW index of index ``name`` (``manage.py setup_pgvector``)."""
+    table = table_name(name)
+    with transaction.atomic(), connection.cursor() as cursor:
+        create_schema(cursor)
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                       f'(item_id bigint PRIMARY KEY, embedding vector({int(dim)}) NOT NULL)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_hnsw ON {table} '
+                       f'USING hnsw (embedding vector_cosine_ops) '
+                       f'WITH (m = {int(m)}, ef_construction = {int(ef_construction)})')
+        cursor.execute(f'INSERT INTO {META_TABLE} (name, dim) VALUES (%s, %s) '
+                       'ON CONFLICT (name) DO UPDATE SET dim = EXCLUDED.dim', [name, int(dim)])
+    return table
+
+
+def table_name(name):
+    slug = re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+    return f"ai_vec_{slug[:40]}_{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+
+
+def vector_literal(vec):
+    return '[' + ','.join(repr(float(value)) for value in vec) + ']'
+
+
+def parse_vector(text):
+    return np.array(text.strip('[]').split(','), dtype=np.float32)
+
+
+class PgVectorIndex:
+    """Cosine index over a pgvector table (see module docstring)."""
+
+    persistent = True  # rows are in the database as soon as add()/remove() return
+
+    def __init__(self, name=None, ef_search=64, **_options):
+        if not name:
+            raise ValueError("The 'pgvector' index backend needs an index name")
+        self.dim = index_dim(name)
+        if self.dim is None:
+            raise ValueError(f"No pgvector table for index {name!r}; run `manage.py setup_pgvector`")
+        self.name = name
+        self.table = table_name(name)
+        self.ef_search = ef_search
+
+    def __len__(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def __contains__(self, item_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT 1 FROM {self.table} WHERE item_id = %s', [item_id])
+            return cursor.fetchone() is not None
+
+    def add(self, item_id, embedding):
+        vec = to_unit_vector(embedding)
+        if vec.size != self.dim:
+            raise ValueError(f"Expected a {self.dim}-d embedding, got {vec.size}-d")
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {self.table} (item_id, embedding) VALUES (%s, %s::vector) '
+                           'ON CONFLICT (item_id) DO UPDATE SET embedding = EXCLUDED.embedding',
+                           [item_id, vector_literal(vec)])
+
+    def add_many(self, rows):
+        """Upsert ``(item_id, embedding)`` pairs in one statement; returns the ids written."""
+        values = []
+        for item_id, embedding in rows:
+            vec = to_unit_vector(embedding)
+            if vec.size == self.dim:
+                values.append((int(item_id), vector_literal(vec)))
+        if not values:
+            return []
+        placeholders = ', '.join(['(%s, %s::vector)'] * len(values))
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {self.table} (item_id, embedding) VALUES {placeholders} '
+                           'ON CONFLICT (item_id) DO UPDATE SET embedding = EXCLUDED.embedding',
+                           [param for row in values for param in row])
+        return [item_id for item_id, _literal in values]
+
+    def remove(self, item_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE item_id = %s', [item_id])
+            return cursor.rowcount > 0
+
+    def search(self, query, k=None, threshold=None, ids=None):
+        vec = to_unit_vector(query)
+        if vec.size != self.dim:
+            return []
+        literal = vector_literal(vec)
+        sql = f'SELECT item_id, 1 - (embedding <=> %s::vector) FROM {self.table}'
+        params = [literal]
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return []
+            # A pre-selected candidate set is scored exactly through the primary key
+            sql += ' WHERE item_id = ANY(%s)'
+            params.append(ids)
+        else:
+            sql += ' ORDER BY embedding <=> %s::vector'
+            params.append(literal)
+            if k is not None:
+                sql += ' LIMIT %s'
+                params.append(k)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Transaction-local; pgvector caps ef_search at 1000
+            ef_search = min(max(self.ef_search, k or 0), 1000)
+            cursor.execute('SELECT set_config(%s, %s, true)', ['hnsw.ef_search', str(ef_search)])
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return []
+        found = np.array([row[0] for row in rows], dtype=np.int64)
+        scores = np.array([row[1] for row in rows], dtype=np.float32)
+        return rank_scores(found, scores, k, threshold)
+
+    def export(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT item_id, embedding::text FROM {self.table} ORDER BY item_id')
+            rows = cursor.fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+        return (np.array([row[0] for row in rows], dtype=np.int64),
+                np.stack([parse_vector(row[1]) for row in rows]))
+
+    # -------------------- Sync state --------------------
+
+    def load_sync_state(self):
+        """Time the index was last synced with the item tables, by any process."""
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT synced_at FROM {META_TABLE} WHERE name = %s', [self.name])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def save_sync_state(self, synced_at):
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {META_TABLE} (name, dim, synced_at) VALUES (%s, %s, %s) '
+                           'ON CONFLICT (name) DO UPDATE SET synced_at = GREATEST('
+                           f'{META_TABLE}.synced_at, EXCLUDED.synced_at)',
+                           [self.name, self.dim, synced_at])
+
+    def needs_compaction(self):
+        return False
+
+    def save(self, path):
+        """Nothing to write: rows are stored as they are added."""
+
+    @classmethod
+    def load(cls, path, **options):
+        return cls(**options)
@@ -0,0 +1,138 @@
+"""Compact encodings for embedding vectors.
+
+Three formats are supported, for the database blobs (``AI_EMBEDDING_STORAGE``)
+and the index matrices (``AI_INDEX_DTYPE``):
+
+* ``float32`` - 4 bytes per dimension, exact.
+* ``float16`` - 2 bytes per dimension.
+* ``int8``    - 1 byte per dimension plus one float32 scale per vector
+  (symmetric, ``scale = max(|v|) / 127``).
+
+Blobs written before quantization existed are raw float32 bytes and are still
+read as such. Quantized blobs start with a 4-byte header (``\\x00QE`` plus a
+format code) that never occurs at the start of a real float32 embedding: read
+as a float32 it is a value around 1e21.
+"""
+
+import numpy as np
+
+FORMATS = ('float32', 'float16', 'int8')
+HEADER = b'\x00QE'
+CODES = {'float16': b'h', 'int8': b'b'}
+FORMAT_OF_CODE = {code: fmt for fmt, code in CODES.items()}
+
+
+def quantize_int8(matrix):
+    """Per-row symmetric int8 quantization; returns ``(int8 matrix, float32 scales)``."""
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def encode_embedding(vec, fmt='float32'):
+    """Serialise a float vector to bytes in ``fmt``."""
+    vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+    if fmt == 'float32':
+        return vec.tobytes()
+    if fmt == 'float16':
+        return HEADER + CODES[fmt] + vec.astype('<f2').tobytes()
+    if fmt == 'int8':
+        quantized, scales = quantize_int8(vec)
+        return HEADER + CODES[fmt] + scales.astype('<f4').tobytes() + quantized.tobytes()
+    raise ValueError(f"Unknown embedding format: {fmt!r}")
+
+
+def blob_format(blob):
+    blob = bytes(blob[:4])
+    if blob[:3] == HEADER and blob[3:4] in FORMAT_OF_CODE:
+        return FORMAT_OF_CODE[blob[3:4]]
+    return 'float32'
+
+
+def decode_embedding(blob):
+    """Float32 vector of an embedding blob in any supported format."""
+    fmt = blob_format(blob)
+    if fmt == 'float32':
+        return np.frombuffer(blob, dtype=np.float32)
+    payload = memoryview(blob)[4:]
+    if fmt == 'float16':
+        return np.frombuffer(payload, dtype='<f2').astype(np.float32)
+    scale = np.frombuffer(payload[:4], dtype='<f4')[0]
+    return np.frombuffer(payload[4:], dtype=np.int8).astype(np.float32) * scale
+
+
+class QuantizedMatrix:
+    """Growable row matrix of float32, float16 or scaled int8 values.
+
+    float16 rows are rounded to half precision but held as float32: NumPy
+    has no fast half-precision product, and expanding them on every query
+    made scoring several times slower than float32. They are only stored as
+    float16 on disk (:meth:`stored`). int8 rows stay int8 in memory, and
+    :meth:`dot` scores them in fixed-size chunks, so only ``chunk_rows`` rows
+    are ever expanded to float32 at once.
+    """
+
+    def __init__(self, dim, dtype='float32', capacity=0):
+        if dtype not in FORMATS:
+            raise ValueError(f"Unknown index dtype: {dtype!r}")
+        self.dim = dim
+        self.dtype = dtype
+        self.data = np.empty((capacity, dim), dtype=np.int8 if dtype == 'int8' else np.float32)
+        self.scales = np.ones(capacity, dtype=np.float32) if dtype == 'int8' else None
+
+    def __len__(self):
+        return len(self.data)
+
+    def resized(self, capacity, keep):
+        grown = QuantizedMatrix(self.dim, self.dtype, capacity)
+        grown.data[:keep] = self.data[:keep]
+        if self.scales is not None:
+            grown.scales[:keep] = self.scales[:keep]
+        return grown
+
+    def set_row(self, row, vec):
+        if self.dtype == 'int8':
+            quantized, scales = quantize_int8(vec)
+            self.data[row], self.scales[row] = quantized[0], scales[0]
+        else:
+            self.data[row] = np.asarray(vec, dtype=self.dtype)
+
+    def copy_row(self, dst, src):
+        self.data[dst] = self.data[src]
+        if self.scales is not None:
+            self.scales[dst] = self.scales[src]
+
+    def rows(self, stop, start=0):
+        """Float32 copy of rows ``start:stop``."""
+        rows = self.data[start:stop].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[start:stop, None]
+        return rows
+
+    def stored(self, size):
+        """The first ``size`` rows in ``dtype``, as written to disk."""
+        return self.data[:size].astype(self.dtype if self.dtype != 'int8' else np.int8)
+
+    def dot(self, vec, size, chunk_rows=8192):
+        """Scores of the first ``size`` rows against ``vec`` as a float32 array."""
+        if self.scales is None:
+            return self.data[:size] @ vec
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, chunk_rows):
+            stop = min(start + chunk_rows, size)
+            scores[start:stop] = self.data[start:stop].astype(np.float32) @ vec
+        if self.scales is not None:
+            scores *= self.scales[:size]
+        return scores
+
+    def dot_rows(self, vec, rows):
+        """Scores of the rows at positions ``rows`` (an int array) against ``vec``."""
+        scores = np.asarray(self.data[rows], dtype=np.float32) @ vec
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return scores
+
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
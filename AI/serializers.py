@@ -1,111 +1,81 @@
 from rest_framework import serializers
+from .derivatives import derivative_url
 from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
 
 
-class LostProductSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = LostProduct
-        fields = ['id', 'user', 'name', 'description', 'image', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'date_lost', 'created_at']
-        read_only_fields = ['user', 'created_at']
+class SparseFieldsMixin:
+    """Limit GET responses to the fields listed in ``?fields=a,b`` (unknown names are ignored).
 
+    Fields that are dropped are never computed, which matters for the image
+    URLs: each one checks the storage for a derivative file.
+    """
 
-class FoundProductSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = FoundProduct
-        fields = ['id', 'user', 'name', 'description', 'image', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'date_found', 'created_at']
-        read_only_fields = ['user', 'created_at']
-
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = request.GET.get('fields')
+        if not requested:
+            return
+        wanted = {name.strip() for name in requested.split(',') if name.strip()}
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
 
-class MatchResultSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = MatchResult
-        fields = ['id', 'lost_product', 'found_product', 'similarity_score', 'threshold_used', 'match_status', 'notified_users', 'match_score', 'created_at']
-        read_only_fields = ['created_at']
 
+class ImageDerivativesMixin(serializers.Serializer):
+    """Absolute URLs of the resized copies of ``image`` (None until generated)."""
+    thumbnail_url = serializers.SerializerMethodField()
+    thumbnail_webp_url = serializers.SerializerMethodField()
+    model_image_url = serializers.SerializerMethodField()
 
-class NotificationSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Notification
-        fields = ['id', 'user', 'message', 'sent_via', 'is_sent', 'created_at', 'sent_at']
-        read_only_fields = ['created_at', 'sent_at']
+    def derivative(self, obj, kind):
+        url = derivative_url(obj.image, kind)
+        request = self.context.get('request')
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
 
+    def get_thumbnail_url(self, obj):
+        return self.derivative(obj, 'thumb')
 
-class RouteMapSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = RouteMap
-        fields = ['id', 'product', 'lost_product', 'found_product', 'route_data', 'created_at']
-        read_only_fields = ['created_at']
+    def get_thumbnail_webp_url(self, obj):
+        return self.derivative(obj, 'thumb_webp')
 
-from rest_framework import serializers
-from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
+    def get_model_image_url(self, obj):
+        return self.derivative(obj, 'model')
 
 
-class LostProductSerializer(serializers.ModelSerializer):
+class LostProductSerializer(SparseFieldsMixin, ImageDerivativesMixin, serializers.ModelSerializer):
     class Meta:
         model = LostProduct
-        fields = ['id', 'user', 'name', 'description', 'image', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'date_lost', 'location_lost', 'contact_info', 'created_at']
+        fields = ['id', 'user', 'name', 'description', 'category', 'image', 'thumbnail_url', 'thumbnail_webp_url', 'model_image_url', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'date_lost', 'location_lost', 'contact_info', 'created_at']
         read_only_fields = ['user', 'created_at']
 
 
-class FoundProductSerializer(serializers.ModelSerializer):
+class FoundProductSerializer(SparseFieldsMixin, ImageDerivativesMixin, serializers.ModelSerializer):
     class Meta:
         model = FoundProduct
-        fields = ['id', 'user', 'name', 'description', 'image', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'date_found', 'location_found', 'contact_info', 'created_at']
+        fields = ['id', 'user', 'name', 'description', 'category', 'image', 'thumbnail_url', 'thumbnail_webp_url', 'model_image_url', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'date_found', 'location_found', 'contact_info', 'created_at']
         read_only_fields = ['user', 'created_at']
 
 
-class MatchResultSerializer(serializers.ModelSerializer):
+class MatchResultSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MatchResult
-        fields = ['id', 'lost_product', 'found_product', 'similarity_score', 'threshold_used', 'match_status', 'notified_users', 'timestamp', 'created_at']
-        read_only_fields = ['created_at', 'timestamp']
+        fields = ['id', 'lost_product', 'found_product', 'similarity_score', 'threshold_used', 'match_status', 'notified_users', 'match_score', 'created_at']
+        read_only_fields = ['created_at']
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'user', 'message', 'sent_via', 'is_sent', 'created_at', 'sent_at']
         read_only_fields = ['created_at', 'sent_at']
 
 
-class RouteMapSerializer(serializers.ModelSerializer):
+class RouteMapSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = RouteMap
-        fields = ['id', 'product', 'lost_product', 'found_product', 'route_data', 'created_at']
+        fields = ['id', 'lost_product', 'found_product', 'route_data', 'created_at']
         read_only_fields = ['created_at']
-
-from rest_framework import serializers
-from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
-
-
-class LostProductSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = LostProduct
-        fields = ['id', 'user', 'name', 'description', 'image', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'created_at']
-        read_only_fields = ['user', 'created_at']
-
-
-class FoundProductSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = FoundProduct
-        fields = ['id', 'user', 'name', 'description', 'image', 'email', 'phone_number', 'location', 'latitude', 'longitude', 'created_at']
-        read_only_fields = ['user', 'created_at']
-
-
-class MatchResultSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = MatchResult
-        fields = ['id', 'lost_product', 'found_product', 'similarity_score', 'threshold_used', 'match_status', 'notified_users', 'timestamp']
-
-
-class NotificationSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Notification
-        fields = ['id', 'user', 'message', 'sent_via', 'is_sent', 'created_at']
-
-
-class RouteMapSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = RouteMap
-        fields = ['id', 'product', 'route_data', 'created_at']
-
@@ -0,0 +1,68 @@
+"""Model signal handlers for the AI app."""
+
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import hashindex, index
+from .geo import encode_geohash
+from .derivatives import delete_derivatives
+from .models import LostProduct, FoundProduct
+from .tasks import enqueue_derivatives
+
+
+@receiver(pre_save, sender=LostProduct)
+@receiver(pre_save, sender=FoundProduct)
+def reset_stale_embedding(sender, instance, **kwargs):
+    """Drop the persisted embedding when an item's image is replaced and hash the new photo."""
+    instance._image_changed = instance.pk is None and bool(instance.image)
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+        if previous is not None and previous != (instance.image.name or ''):
+            instance._image_changed = True
+            delete_derivatives(instance.image.storage, previous)
+            instance.embedding = None
+            instance.embedding_model = ''
+            instance.embedding_version = ''
+            instance.embedded_at = None
+            instance.image_hash = ''
+    if instance._image_changed and instance.image:
+        instance.image_hash = hashindex.compute_image_hash(instance.image)
+
+
+@receiver(pre_save, sender=LostProduct)
+@receiver(pre_save, sender=FoundProduct)
+def update_geohash(sender, instance, **kwargs):
+    """Keep the geohash column in step with the item's coordinates."""
+    if instance.latitude is None or instance.longitude is None:
+        instance.geohash = ''
+    else:
+        instance.geohash = encode_geohash(instance.latitude, instance.longitude)
+
+
+@receiver(post_save, sender=LostProduct)
+@receiver(post_save, sender=FoundProduct)
+def update_vector_index(sender, instance, **kwargs):
+    index.on_item_saved(instance)
+    hashindex.on_item_saved(instance)
+
+
+@receiver(post_save, sender=LostProduct)
+@receiver(post_save, sender=FoundProduct)
+def update_image_derivatives(sender, instance, **kwargs):
+    """Queue thumbnails and the model-input copy for a new or replaced image."""
+    if not getattr(instance, '_image_changed', False) or not instance.image:
+        return
+    instance._image_changed = False
+    if not getattr(settings, 'AI_DERIVATIVES', True):
+        return
+    enqueue_derivatives('lost' if sender is LostProduct else 'found', instance.pk)
+
+
+@receiver(post_delete, sender=LostProduct)
+@receiver(post_delete, sender=FoundProduct)
+def remove_from_vector_index(sender, instance, **kwargs):
+    index.on_item_deleted(instance)
+    hashindex.on_item_deleted(instance)
+    if instance.image:
+        delete_derivatives(instance.image.storage, instance.image.name)
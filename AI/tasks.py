@@ -1,14 +1,41 @@
-<<<<<<< HEAD
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import close_old_connections, connection, transaction
+
 try:
     from celery import shared_task
 except Exception:
-    # If Celery is not installed, provide a no-op decorator so the
-    # module can be imported and the function can still be called
-    # synchronously in environments without a Celery worker.
+    # Without Celery, tasks stay plain functions that can be called
+    # synchronously, and ``.delay()`` queues them on the database-backed
+    # job queue in jobs.py (run by ``manage.py runworker``) instead.
+    def _with_delay(f):
+        def delay(*args, **kwargs):
+            from .jobs import enqueue
+            return enqueue(f, *args, **kwargs)
+        f.delay = delay
+        return f
+
     def shared_task(*a, **k):
-        def _decorator(f):
-            return f
-        return _decorator
+        if len(a) == 1 and callable(a[0]) and not k:
+            # Used bare, as @shared_task
+            return _with_delay(a[0])
+        return _with_delay
+
+
+MATCHING_PENDING = 'pending'
+MATCHING_RUNNING = 'running'
+MATCHING_DONE = 'done'
+MATCHING_FAILED = 'failed'
+
+
+def set_matching_status(item_type, item_id, status):
+    from .index import ITEM_MODELS
+
+    # update() skips the model signals, so the vector index is not touched
+    ITEM_MODELS[item_type].objects.filter(pk=item_id).update(matching_status=status)
 
 
 @shared_task
@@ -17,127 +44,151 @@ def run_match_for_item(item_type, item_id):
     item_type: 'lost' or 'found'
     """
     # Import inside task to avoid heavy imports at module import time
-    from .models import LostProduct, FoundProduct, MatchResult
-    from .views import generate_embedding, cosine_similarity, send_match_notification
+    from .models import LostProduct, FoundProduct
+    from .views import match_lost_item, match_found_item
 
     if item_type == 'lost':
         try:
-            lost = LostProduct.objects.get(pk=item_id)
+            item = LostProduct.objects.get(pk=item_id)
         except LostProduct.DoesNotExist:
             return
-        if not lost.image:
-            return
-        lost_embedding = generate_embedding(lost.image)
-        for found in FoundProduct.objects.all():
-            if not found.image:
-                continue
-            found_embedding = generate_embedding(found.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding if lost_embedding else b'',
-                found_embedding=found_embedding if found_embedding else b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
-
+        matcher = match_lost_item
     elif item_type == 'found':
         try:
-            found = FoundProduct.objects.get(pk=item_id)
+            item = FoundProduct.objects.get(pk=item_id)
         except FoundProduct.DoesNotExist:
             return
-        if not found.image:
-            return
-        found_embedding = generate_embedding(found.image)
-        for lost in LostProduct.objects.all():
-            if not lost.image:
-                continue
-            lost_embedding = generate_embedding(lost.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding if lost_embedding else b'',
-                found_embedding=found_embedding if found_embedding else b'',
-                similarity_score=similarity,
-                match_status=status_str,
+        matcher = match_found_item
+    else:
+        return
+
+    if not item.image:
+        set_matching_status(item_type, item_id, MATCHING_DONE)
+        return
+    set_matching_status(item_type, item_id, MATCHING_RUNNING)
+    try:
+        matcher(item)
+    except Exception:
+        set_matching_status(item_type, item_id, MATCHING_FAILED)
+        raise
+    set_matching_status(item_type, item_id, MATCHING_DONE)
+
+
+# -------------------- In-process fallback --------------------
+# Without Celery, matching runs on a small thread pool inside the web process
+# so form submissions return before the embedding and scoring work is done.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'AI_MATCH_WORKERS', 2),
+                thread_name_prefix='ai-match',
             )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
-=======
-try:
-    from celery import shared_task
-except Exception:
-    # If Celery is not installed, provide a no-op decorator so the
-    # module can be imported and the function can still be called
-    # synchronously in environments without a Celery worker.
-    def shared_task(*a, **k):
-        def _decorator(f):
-            return f
-        return _decorator
+        return _executor
 
 
-@shared_task
-def run_match_for_item(item_type, item_id):
-    """Background task to run matching for a lost or found item.
-    item_type: 'lost' or 'found'
-    """
-    # Import inside task to avoid heavy imports at module import time
-    from .models import LostProduct, FoundProduct, MatchResult
-    from .views import generate_embedding, cosine_similarity, send_match_notification
+def _run_in_thread(task, *args):
+    close_old_connections()
+    try:
+        task(*args)
+    except Exception as e:
+        print(f"Background task {task.__name__}{args} failed: {e}")
+    finally:
+        # Each pool thread holds its own DB connection; don't leak it
+        connection.close()
 
-    if item_type == 'lost':
+
+def _submit(task, *args):
+    """Hand ``task(*args)`` to the configured queue; see :func:`enqueue_match`."""
+    if getattr(settings, 'AI_JOB_QUEUE', 'thread') == 'database':
+        from .jobs import enqueue
         try:
-            lost = LostProduct.objects.get(pk=item_id)
-        except LostProduct.DoesNotExist:
+            enqueue(task, *args)
             return
-        if not lost.image:
+        except Exception as e:
+            print(f"Could not queue {task.__name__} job, running in-process: {e}")
+    elif getattr(settings, 'CELERY_ENABLED', False):
+        try:
+            task.delay(*args)
             return
-        lost_embedding = generate_embedding(lost.image)
-        for found in FoundProduct.objects.all():
-            if not found.image:
-                continue
-            found_embedding = generate_embedding(found.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding if lost_embedding else b'',
-                found_embedding=found_embedding if found_embedding else b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
+        except Exception as e:
+            print(f"Could not queue {task.__name__} task, running in-process: {e}")
+    if getattr(settings, 'AI_MATCH_WORKERS', 2) > 0:
+        get_executor().submit(_run_in_thread, task, *args)
+    else:
+        try:
+            task(*args)
+        except Exception as e:
+            print(f"{task.__name__}{args} failed: {e}")
 
-    elif item_type == 'found':
+
+def enqueue_match(item_type, item_id):
+    """Schedule matching for a newly reported item and return immediately.
+
+    The item is marked 'pending' and the job is handed off once the current
+    transaction commits: to the database job queue when ``AI_JOB_QUEUE`` is
+    'database', to Celery when ``CELERY_ENABLED`` is set, otherwise to the
+    in-process thread pool (``AI_MATCH_WORKERS`` threads; 0 runs the match
+    inline after commit).
+    """
+    set_matching_status(item_type, item_id, MATCHING_PENDING)
+    transaction.on_commit(lambda: _submit(run_match_for_item, item_type, item_id))
+
+
+@shared_task
+def make_item_derivatives(item_type, item_id):
+    """Background task writing the thumbnails and model-input copy of an item's current image."""
+    from .derivatives import generate_derivatives
+    from .index import ITEM_MODELS
+
+    item = ITEM_MODELS[item_type].objects.filter(pk=item_id).only('id', 'image').first()
+    if item is None or not item.image:
+        return
+    generate_derivatives(item.image)
+
+
+def enqueue_derivatives(item_type, item_id):
+    """Schedule derivative generation for an item once the current transaction commits.
+
+    Runs on the same queue as :func:`enqueue_match`; until it has run, the
+    embedding code and the API read the original image instead.
+    """
+    transaction.on_commit(lambda: _submit(make_item_derivatives, item_type, item_id))
+
+
+@shared_task
+def send_notification_email(subject, message, recipient):
+    """Deliver a match email; raising lets the job queue retry it with backoff."""
+    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [recipient])
+
+
+def queue_email(subject, message, recipient):
+    """Send an email in the background when a task queue is configured, otherwise right away.
+
+    Returns False if an immediate send failed.
+    """
+    if getattr(settings, 'AI_JOB_QUEUE', 'thread') == 'database':
+        from .jobs import enqueue
         try:
-            found = FoundProduct.objects.get(pk=item_id)
-        except FoundProduct.DoesNotExist:
-            return
-        if not found.image:
-            return
-        found_embedding = generate_embedding(found.image)
-        for lost in LostProduct.objects.all():
-            if not lost.image:
-                continue
-            lost_embedding = generate_embedding(lost.image)
-            similarity = cosine_similarity(lost_embedding, found_embedding)
-            status_str = "Matched" if similarity >= 0.8 else "Not Matched"
-            MatchResult.objects.create(
-                lost_product=lost,
-                found_product=found,
-                lost_embedding=lost_embedding if lost_embedding else b'',
-                found_embedding=found_embedding if found_embedding else b'',
-                similarity_score=similarity,
-                match_status=status_str,
-            )
-            if status_str == "Matched":
-                send_match_notification(lost, found)
->>>>>>> 8b1e1d938e70917f9e7bc0a124a56dd9f9496b7e
+            enqueue(send_notification_email, subject, message, recipient)
+            return True
+        except Exception as e:
+            print(f"Could not queue email, sending now: {e}")
+    elif getattr(settings, 'CELERY_ENABLED', False):
+        try:
+            send_notification_email.delay(subject, message, recipient)
+            return True
+        except Exception as e:
+            print(f"Could not queue email, sending now: {e}")
+    try:
+        send_notification_email(subject, message, recipient)
+    except Exception as e:
+        print(f"Failed to send email: {e}")
+        return False
+    return True
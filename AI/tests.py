@@ -1,7 +1,1311 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+import numpy as np
+from PIL import Image
+
+from . import db_writer, tasks
+from .ann import IVFIndex
+from .jobs import claim_job, enqueue, renew_lease, run_job, run_pending
+from .derivatives import derivative_name, embedding_source
+from .geo import encode_geohash, haversine_km, items_near
+from .hashindex import HammingIndex, get_hash_index, reset_hash_indexes
+from .quantize import decode_embedding, encode_embedding
+from .mmapindex import MmapIndex
+from .index import VectorIndex, ItemIndex, get_index, index_name, index_options, reset_indexes
+from .matching import embed_pending_items, get_item_embedding, match_item
+from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap, Job, CachedEmbedding
+from .embedders import Embedder, PseudoBytesEmbedder, decode_image, get_embedder
+from .embedding_cache import embedding_cache
+from .utils import generate_embeddings
 
-# Create your tests here.
 
 class SimpleTestCase(TestCase):
 	def test_example(self):
 		self.assertEqual(1 + 1, 2)
+
+
+def make_image(name='test.jpg', color=(255, 0, 0)):
+    buf = BytesIO()
+    Image.new('RGB', (32, 32), color=color).save(buf, format='JPEG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+def make_noise_image(name='noise.png', seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(32, 32, 3), dtype=np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format='PNG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/png')
+
+
+class MediaTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, AI_INDEX_DIR=os.path.join(self.media_root, 'index'),
+        )
+        self.settings_override.enable()
+        reset_indexes()
+        reset_hash_indexes()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+
+class CountingEmbedder(PseudoBytesEmbedder):
+    name = 'test-model'
+
+    def __init__(self, version='1'):
+        super().__init__()
+        self.version = version
+        self.calls = 0
+
+    def embed_file(self, image_field):
+        self.calls += 1
+        return super().embed_file(image_field)
+
+
+@override_settings(AI_DUPLICATE_MAX_DISTANCE=None)
+class ItemEmbeddingTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.embedder = CountingEmbedder()
+
+    def test_embedding_is_computed_once_and_persisted(self):
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        first = get_item_embedding(lost, self.embedder)
+        again = get_item_embedding(LostProduct.objects.get(pk=lost.pk), self.embedder)
+        self.assertEqual(self.embedder.calls, 1)
+        self.assertEqual(first, again)
+        self.assertEqual(LostProduct.objects.get(pk=lost.pk).embedding_model, 'test-model')
+
+    def test_model_change_recomputes_embedding(self):
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        get_item_embedding(lost, self.embedder)
+        other_version = CountingEmbedder('2')
+        get_item_embedding(lost, other_version)
+        self.assertEqual((self.embedder.calls, other_version.calls), (1, 1))
+        self.assertEqual(LostProduct.objects.get(pk=lost.pk).embedding_version, '2')
+
+    def test_replacing_image_resets_embedding(self):
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        get_item_embedding(lost, self.embedder)
+        lost = LostProduct.objects.get(pk=lost.pk)
+        lost.image = make_image('other.jpg', color=(0, 0, 255))
+        lost.save()
+        self.assertIsNone(LostProduct.objects.get(pk=lost.pk).embedding)
+
+    def test_failed_embedding_is_recorded_and_not_retried(self):
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        with mock.patch.object(PseudoBytesEmbedder, 'embed_file', return_value=None):
+            self.assertIsNone(get_item_embedding(lost, self.embedder))
+        lost = LostProduct.objects.get(pk=lost.pk)
+        self.assertIsNone(lost.embedding)
+        self.assertEqual(lost.embedding_model, 'test-model')
+        self.assertIsNotNone(lost.embedded_at)
+
+        embed_pending_items('lost', self.embedder)
+        self.assertIsNone(get_item_embedding(lost, self.embedder))
+        self.assertEqual(self.embedder.calls, 1)
+        # A new model version tries again
+        self.assertIsNotNone(get_item_embedding(lost, CountingEmbedder('2')))
+
+    @override_settings(AI_MATCH_STORAGE='full')
+    def test_match_item_embeds_each_catalogue_item_once(self):
+        for i in range(3):
+            FoundProduct.objects.create(name=f'Found {i}', image=make_image(f'found{i}.jpg'))
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        match_item(lost, self.embedder)
+        self.assertEqual(self.embedder.calls, 4)
+        second = LostProduct.objects.create(name='Keys', image=make_image('keys.jpg'))
+        results = match_item(second, self.embedder)
+        self.assertEqual(self.embedder.calls, 5)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(MatchResult.objects.count(), 6)
+
+    @override_settings(AI_MATCH_BULK_BATCH_SIZE=2, AI_MATCH_STORAGE='full')
+    def test_match_results_are_bulk_inserted(self):
+        for i in range(5):
+            FoundProduct.objects.create(name=f'Found {i}', image=make_image(f'found{i}.jpg'))
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        embed_pending_items('found', self.embedder)
+        with CaptureQueriesContext(connection) as ctx:
+            match_item(lost, self.embedder)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "AI_matchresult"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(MatchResult.objects.count(), 5)
+
+        match_item(lost, self.embedder)  # a re-run stores no duplicate rows
+        self.assertEqual(MatchResult.objects.count(), 5)
+
+    @override_settings(AI_MATCH_STORAGE='compact', AI_MATCH_STORE_MIN_SCORE=0.999, AI_MATCH_STORE_TOP_K=1)
+    def test_compact_storage_keeps_matches_without_embedding_copies(self):
+        FoundProduct.objects.create(name='Same photo', image=make_image('same.jpg'))
+        for i in range(3):
+            FoundProduct.objects.create(name=f'Other {i}', image=make_noise_image(f'other{i}.png', seed=i))
+        lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        results = match_item(lost, self.embedder, threshold=0.999)
+        self.assertEqual(len(results), 4)
+        stored = MatchResult.objects.get()
+        self.assertEqual(stored.found_product.name, 'Same photo')
+        self.assertEqual(stored.match_status, 'Matched')
+        self.assertIsNone(stored.lost_embedding)
+
+
+class VectorIndexTests(TestCase):
+    def test_search_returns_top_k_above_threshold(self):
+        index = VectorIndex()
+        index.add(1, np.array([1, 0, 0], dtype=np.float32))
+        index.add(2, np.array([1, 1, 0], dtype=np.float32))
+        index.add(3, np.array([0, 0, 1], dtype=np.float32))
+        hits = index.search(np.array([2, 0, 0], dtype=np.float32), k=2, threshold=0.5)
+        self.assertEqual([item_id for item_id, _ in hits], [1, 2])
+        self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+
+    def test_remove_keeps_remaining_rows_searchable(self):
+        index = VectorIndex()
+        for item_id in range(1, 40):
+            index.add(item_id, np.array([item_id, 1], dtype=np.float32))
+        self.assertTrue(index.remove(5))
+        self.assertFalse(index.remove(5))
+        self.assertEqual(len(index), 38)
+        self.assertNotIn(5, [item_id for item_id, _ in index.search([1, 0])])
+        self.assertEqual(index.search([39, 1], k=1)[0][0], 39)
+
+    def test_dimension_mismatch_is_rejected(self):
+        index = VectorIndex()
+        index.add(1, [1, 0])
+        with self.assertRaises(ValueError):
+            index.add(2, [1, 0, 0])
+
+
+class ItemIndexSignalTests(MediaTestCase):
+    def test_index_follows_saves_and_deletes(self):
+        found = FoundProduct.objects.create(name='Umbrella', image=make_image())
+        index = get_index('found', 'test-model', '1')
+        self.assertEqual(len(index), 0)
+        get_item_embedding(found, CountingEmbedder())
+        self.assertIn(found.pk, index)
+        found_pk = found.pk
+        found.delete()
+        self.assertNotIn(found_pk, index)
+
+
+class IVFIndexTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(600, 16)).astype(np.float32)
+
+    def test_ivf_top_hit_matches_exact_search(self):
+        exact, ivf = VectorIndex(), IVFIndex(nlist=8, nprobe=8, min_train_size=100)
+        for item_id, vec in enumerate(self.vectors):
+            exact.add(item_id, vec)
+            ivf.add(item_id, vec)
+        self.assertIsNotNone(ivf.centroids)
+        for query in self.vectors[:20]:
+            self.assertEqual(ivf.search(query, k=1)[0][0], exact.search(query, k=1)[0][0])
+
+    def test_ivf_save_and_load_round_trip(self):
+        ivf = IVFIndex(nlist=4, nprobe=2, min_train_size=50)
+        for item_id, vec in enumerate(self.vectors[:200]):
+            ivf.add(item_id, vec)
+        ivf.remove(3)
+        path = os.path.join(tempfile.mkdtemp(), 'ivf.index')
+        ivf.save(path)
+        loaded = IVFIndex.load(path, nlist=4, nprobe=2)
+        self.assertEqual(len(loaded), 199)
+        self.assertNotIn(3, loaded)
+        self.assertEqual(
+            [item_id for item_id, _ in loaded.search(self.vectors[10], k=3)],
+            [item_id for item_id, _ in ivf.search(self.vectors[10], k=3)],
+        )
+        shutil.rmtree(os.path.dirname(path))
+
+
+class ItemIndexPersistenceTests(MediaTestCase):
+    def test_saved_index_is_reloaded_without_rescanning(self):
+        found = FoundProduct.objects.create(name='Umbrella', image=make_image())
+        get_item_embedding(found, CountingEmbedder())
+        index = get_index('found', 'test-model', '1')
+        self.assertTrue(index.save())
+        reloaded = ItemIndex('found', 'test-model', '1')
+        self.assertTrue(reloaded.load())
+        self.assertIn(found.pk, reloaded)
+        self.assertEqual(reloaded.synced_at, index.synced_at)
+
+    def test_row_committed_after_sync_started_is_picked_up(self):
+        found = FoundProduct.objects.create(name='Umbrella', image=make_image())
+        get_item_embedding(found, CountingEmbedder())
+        index = get_index('found', 'test-model', '1')
+        # Embedded before the sync above started, but committed after it (no signal)
+        late = FoundProduct.objects.create(name='Late', image=make_image('late.jpg'))
+        FoundProduct.objects.filter(pk=late.pk).update(
+            embedding=bytes(FoundProduct.objects.get(pk=found.pk).embedding), embedding_model='test-model',
+            embedding_version='1', embedded_at=timezone.now() - timedelta(seconds=5))
+        index.sync()
+        self.assertIn(late.pk, index)
+
+        changes = index.unsaved_changes
+        index.sync()  # rows already loaded from the overlap window are not added again
+        self.assertEqual(index.unsaved_changes, changes)
+
+    def test_get_index_reuses_a_recent_sync(self):
+        found = FoundProduct.objects.create(name='Umbrella', image=make_image())
+        get_item_embedding(found, CountingEmbedder())
+        index = get_index('found', 'test-model', '1')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIs(get_index('found', 'test-model', '1'), index)
+        self.assertEqual(len(queries), 0)
+        with mock.patch('AI.index.time.monotonic', return_value=index.last_sync + 5), \
+                CaptureQueriesContext(connection) as queries:
+            get_index('found', 'test-model', '1')
+        self.assertEqual(len(queries), 1)
+
+    def test_concurrent_syncs_run_one_at_a_time(self):
+        index = ItemIndex('found', 'test-model', '1')
+        active, overlapped = [], []
+
+        def slow_rows(chunk_size):
+            active.append(1)
+            overlapped.append(len(active) > 1)
+            time.sleep(0.05)
+            active.pop()
+            return iter([])
+
+        # A stand-in model, so the threads never touch the test database
+        model = mock.Mock()
+        queryset = model.objects.filter.return_value
+        queryset.filter.return_value = queryset
+        queryset.values_list.return_value.iterator.side_effect = slow_rows
+        with mock.patch.object(index, 'load', return_value=False), \
+                mock.patch.dict('AI.index.ITEM_MODELS', {'found': model}):
+            threads = [threading.Thread(target=index.sync) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(overlapped, [False, False, False])
+
+
+class EmbedderRegistryTests(TestCase):
+    def test_embedder_is_shared_per_process(self):
+        self.assertIs(get_embedder('pseudo-bytes'), get_embedder('pseudo-bytes'))
+
+    @override_settings(AI_EMBEDDING_MODEL='pseudo-bytes')
+    def test_default_embedder_follows_settings(self):
+        embedder = get_embedder()
+        self.assertEqual((embedder.name, embedder.version), ('pseudo-bytes', '1'))
+
+    @override_settings(AI_EMBEDDING_MODEL='descriptor')
+    def test_model_that_fails_to_load_falls_back(self):
+        from .embedders import DescriptorEmbedder, _instances
+
+        _instances.pop('descriptor', None)
+        self.addCleanup(_instances.pop, 'descriptor', None)
+        with mock.patch('AI.embedders.FALLBACK_ORDER', ['descriptor', 'pseudo-bytes']), \
+                mock.patch.object(DescriptorEmbedder, 'load', side_effect=OSError('weights missing')) as load:
+            self.assertEqual(get_embedder().name, 'pseudo-bytes')
+            self.assertEqual(get_embedder().name, 'pseudo-bytes')
+        load.assert_called_once()
+
+    def test_unknown_model_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_embedder('no-such-model')
+
+
+class BatchedEmbeddingTests(TestCase):
+    def test_generate_embeddings_matches_single_image_path(self):
+        embedder = get_embedder('pseudo-bytes')
+        images = [make_image(f'{i}.jpg', color=(i * 20, 0, 0)) for i in range(5)]
+        matrix = generate_embeddings(images, batch_size=2, embedder=embedder, workers=2)
+        self.assertEqual(matrix.shape, (5, 512))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertTrue(matrix.flags['C_CONTIGUOUS'])
+        for row, image in zip(matrix, images):
+            np.testing.assert_array_equal(row, np.frombuffer(embedder.embed_file(image), dtype=np.float32))
+
+    def test_missing_images_leave_zero_rows(self):
+        matrix, ok = get_embedder('pseudo-bytes').embed_files([make_image(), None], batch_size=4)
+        self.assertEqual(ok.tolist(), [True, False])
+        self.assertFalse(matrix[1].any())
+
+
+class ReembedCommandTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            LostProduct.objects.create(name=f'Lost {i}', image=make_image(f'lost{i}.jpg'))
+        FoundProduct.objects.create(name='Found', image=make_image('found.jpg'))
+        FoundProduct.objects.create(name='No image')
+        self.checkpoint = os.path.join(self.media_root, 'checkpoint.json')
+
+    def reembed(self, **options):
+        out = StringIO()
+        call_command('reembed', model='pseudo-bytes', checkpoint=self.checkpoint,
+                     chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_reembed_fills_every_item_with_an_image(self):
+        output = self.reembed(workers=0)
+        self.assertIn('items/s', output)
+        self.assertEqual(LostProduct.objects.filter(embedding_model='pseudo-bytes').count(), 3)
+        self.assertEqual(FoundProduct.objects.filter(embedding_model='pseudo-bytes').count(), 1)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_reembed_with_worker_processes(self):
+        self.reembed(workers=2, kind='lost')
+        lost = LostProduct.objects.order_by('id').first()
+        expected = get_embedder('pseudo-bytes').embed_file(embedding_source(lost.image))
+        self.assertEqual(bytes(lost.embedding), expected)
+
+    def test_reembed_resumes_from_checkpoint(self):
+        first = LostProduct.objects.order_by('id').first()
+        with open(self.checkpoint, 'w') as fp:
+            json.dump({'model': 'pseudo-bytes', 'version': '1', 'last_ids': {'lost': first.id}}, fp)
+        self.reembed(workers=0, kind='lost')
+        self.assertIsNone(LostProduct.objects.get(pk=first.pk).embedding)
+        self.assertEqual(LostProduct.objects.filter(embedding_model='pseudo-bytes').count(), 2)
+
+
+class CompactMatchesCommandTests(MediaTestCase):
+    def test_compaction_drops_low_scores_duplicates_and_blobs(self):
+        lost = LostProduct.objects.create(name='Wallet')
+        found = [FoundProduct.objects.create(name=f'Found {i}') for i in range(4)]
+        MatchResult.objects.create(lost_product=lost, found_product=found[0], similarity_score=0.9,
+                                   match_status='Matched', lost_embedding=b'x', found_embedding=b'y')
+        MatchResult.objects.create(lost_product=lost, found_product=found[1], similarity_score=0.1)
+        MatchResult.objects.create(lost_product=lost, found_product=found[2], similarity_score=0.6)
+        MatchResult.objects.create(lost_product=lost, found_product=found[2], similarity_score=0.7)
+        MatchResult.objects.create(lost_product=lost, found_product=found[3], similarity_score=0.65)
+
+        call_command('compact_matches', min_score=0.5, top_k=1, stdout=StringIO())
+
+        # found[3]'s row is outside the wallet's top 1 but is found[3]'s best
+        kept = MatchResult.objects.order_by('-similarity_score')
+        self.assertEqual([(r.found_product_id, r.similarity_score) for r in kept],
+                         [(found[0].id, 0.9), (found[2].id, 0.7), (found[3].id, 0.65)])
+        self.assertFalse(MatchResult.objects.filter(lost_embedding__isnull=False).exists())
+
+    def test_embedding_copies_are_cleared_in_batches(self):
+        lost = LostProduct.objects.create(name='Wallet')
+        for i in range(5):
+            MatchResult.objects.create(lost_product=lost, found_product=FoundProduct.objects.create(name=f'F{i}'),
+                                       similarity_score=0.9, match_status='Matched', lost_embedding=b'x')
+        with mock.patch('AI.management.commands.compact_matches.WRITE_BATCH_SIZE', 2), \
+                CaptureQueriesContext(connection) as queries:
+            call_command('compact_matches', stdout=StringIO())
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "AI_matchresult"')]
+        self.assertEqual(len(updates), 3)
+        self.assertFalse(MatchResult.objects.filter(lost_embedding__isnull=False).exists())
+
+    def test_duplicates_are_collapsed_per_status(self):
+        lost = LostProduct.objects.create(name='Wallet')
+        found = FoundProduct.objects.create(name='Found')
+        matched = MatchResult.objects.create(lost_product=lost, found_product=found,
+                                             similarity_score=0.85, match_status='Matched')
+        MatchResult.objects.create(lost_product=lost, found_product=found, similarity_score=0.7)
+        newest = MatchResult.objects.create(lost_product=lost, found_product=found, similarity_score=0.75)
+
+        call_command('compact_matches', min_score=0.5, top_k=1, stdout=StringIO())
+
+        self.assertEqual(sorted(MatchResult.objects.values_list('id', flat=True)), [matched.id, newest.id])
+
+    def test_top_k_keeps_rows_ranked_on_either_side(self):
+        lost = [LostProduct.objects.create(name=f'Lost {i}') for i in range(2)]
+        found = [FoundProduct.objects.create(name=f'Found {i}') for i in range(2)]
+        MatchResult.objects.create(lost_product=lost[0], found_product=found[0], similarity_score=0.79)
+        MatchResult.objects.create(lost_product=lost[0], found_product=found[1], similarity_score=0.78)
+        MatchResult.objects.create(lost_product=lost[1], found_product=found[0], similarity_score=0.6)
+        MatchResult.objects.create(lost_product=lost[1], found_product=found[1], similarity_score=0.55)
+
+        call_command('compact_matches', min_score=0.5, top_k=1, stdout=StringIO())
+
+        # lost[1]/found[1] is second for both items; every other row is someone's best
+        self.assertEqual(sorted(MatchResult.objects.values_list('similarity_score', flat=True)),
+                         [0.6, 0.78, 0.79])
+
+
+@override_settings(AI_MATCH_WORKERS=0, AI_EMBEDDING_MODEL='pseudo-bytes', CELERY_ENABLED=False)
+class AsyncReportTests(MediaTestCase):
+    def test_report_renders_before_matching_and_status_reports_result(self):
+        FoundProduct.objects.create(name='Red wallet', image=make_image('found.jpg'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('report_lost'), {
+                'name': 'Wallet', 'description': 'Red', 'image': make_image('lost.jpg'),
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['matching_pending'])
+        lost = LostProduct.objects.get(name='Wallet')
+        self.assertEqual(lost.matching_status, 'pending')
+        self.assertFalse(MatchResult.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        status = self.client.get(reverse('match_status', args=['lost', lost.id])).json()
+        self.assertEqual(status, {'status': 'done', 'matches_found': 1})
+
+    def test_status_of_unknown_item_type_is_404(self):
+        response = self.client.get(reverse('match_status', args=['other', 1]))
+        self.assertEqual(response.status_code, 404)
+
+
+def failing_task(message):
+    raise RuntimeError(message)
+
+
+contested_claims = []
+
+
+def outliving_task(seconds):
+    """Runs past its lease, checking whether another worker could take the job meanwhile."""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        contested_claims.append(claim_job('w2', lease_seconds=0.6))
+
+
+@override_settings(AI_JOB_RETRY_DELAY=10, AI_JOB_MAX_ATTEMPTS=2)
+class JobQueueTests(MediaTestCase):
+    def test_queued_match_runs_on_worker(self):
+        lost = LostProduct.objects.create(name='Wallet', image=make_image('lost.jpg'))
+        job = enqueue('AI.tasks.run_match_for_item', 'lost', lost.id)
+        self.assertEqual((job.task, job.args), ('AI.tasks.run_match_for_item', ['lost', lost.id]))
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+        self.assertEqual(LostProduct.objects.get(pk=lost.pk).matching_status, 'done')
+
+    def test_failed_job_is_retried_with_backoff_then_marked_failed(self):
+        job = enqueue(failing_task, 'boom')
+        run_job(claim_job('w1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('boom', job.last_error)
+        self.assertIsNone(claim_job('w1'))  # not due until the backoff elapses
+
+        Job.objects.filter(pk=job.pk).update(run_at=job.created_at)
+        run_job(claim_job('w1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_expired_lease_is_reclaimed_by_another_worker(self):
+        job = enqueue(failing_task, 'x')
+        self.assertEqual(claim_job('w1').pk, job.pk)
+        self.assertIsNone(claim_job('w2'))
+
+        Job.objects.filter(pk=job.pk).update(locked_until=job.created_at)
+        reclaimed = claim_job('w2')
+        self.assertEqual((reclaimed.pk, reclaimed.locked_by, reclaimed.attempts), (job.pk, 'w2', 2))
+
+    @override_settings(AI_JOB_QUEUE='database', CELERY_ENABLED=True)
+    def test_database_queue_is_used_even_when_celery_is_importable(self):
+        lost = LostProduct.objects.create(name='Wallet', image=make_image('lost.jpg'))
+        with mock.patch.object(tasks.run_match_for_item, 'delay', create=True) as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            tasks.enqueue_match('lost', lost.id)
+        delay.assert_not_called()
+        job = Job.objects.get()
+        self.assertEqual((job.task, job.args), ('AI.tasks.run_match_for_item', ['lost', lost.id]))
+
+        with mock.patch('AI.tasks.send_mail') as send_mail:
+            self.assertTrue(tasks.queue_email('Match', 'Found it', 'owner@example.com'))
+        send_mail.assert_not_called()
+        self.assertEqual(Job.objects.filter(task='AI.tasks.send_notification_email').count(), 1)
+
+    def test_runworker_once_drains_the_queue(self):
+        enqueue('AI.tasks.set_matching_status', 'lost', 0, 'done')
+        out = StringIO()
+        call_command('runworker', once=True, stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+
+
+class JobLeaseTests(TransactionTestCase):
+    # Real commits, so the heartbeat thread's connection sees the leased row
+
+    def test_heartbeat_keeps_a_job_leased_past_its_lease(self):
+        contested_claims.clear()
+        job = enqueue(outliving_task, 2.0)
+        claimed = claim_job('w1', lease_seconds=0.6)
+        self.assertTrue(run_job(claimed, lease_seconds=0.6))
+        self.assertTrue(contested_claims)
+        self.assertEqual(contested_claims, [None] * len(contested_claims))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 1))
+
+    def test_lost_lease_stops_the_heartbeat(self):
+        job = enqueue(failing_task, 'x')
+        claimed = claim_job('w1', lease_seconds=60)
+        Job.objects.filter(pk=job.pk).update(locked_by='w2')
+        self.assertFalse(renew_lease(claimed, 60))
+
+
+class InferenceCountingEmbedder(Embedder):
+    """Embedder going through the real embed_file path, counting decodes."""
+    key = name = 'test-cached'
+    version = '1'
+
+    def __init__(self):
+        super().__init__()
+        self.prepared = 0
+
+    def load(self):
+        pass
+
+    def prepare(self, image):
+        self.prepared += 1
+        pixels = np.asarray(decode_image(image), dtype=np.float32)
+        return pixels.mean(axis=(0, 1))
+
+    def run_batch(self, prepared):
+        return np.stack(prepared).astype(np.float32)
+
+
+class EmbeddingCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        embedding_cache.clear()
+
+    def test_same_bytes_are_embedded_once(self):
+        embedder = InferenceCountingEmbedder()
+        first = embedder.embed_file(make_image('a.jpg'))
+        second = embedder.embed_file(make_image('copy-of-a.jpg'))
+        self.assertEqual(first, second)
+        self.assertEqual(embedder.prepared, 1)
+        stats = embedding_cache.stats()
+        self.assertEqual((stats['misses'], stats['memory_hits']), (1, 1))
+
+    def test_persistent_tier_survives_a_cold_memory_cache(self):
+        embedder = InferenceCountingEmbedder()
+        emb = embedder.embed_file(make_image('a.jpg'))
+        self.assertEqual(CachedEmbedding.objects.count(), 1)
+
+        embedding_cache.clear()
+        self.assertEqual(embedder.embed_file(make_image('a.jpg')), emb)
+        self.assertEqual(embedder.prepared, 1)
+        self.assertEqual(embedding_cache.stats()['persistent_hits'], 1)
+
+    @override_settings(AI_EMBEDDING_CACHE_SIZE=1, AI_EMBEDDING_CACHE_PERSIST=False)
+    def test_memory_tier_evicts_least_recently_used(self):
+        embedder = InferenceCountingEmbedder()
+        embedder.embed_file(make_image('red.jpg', (255, 0, 0)))
+        embedder.embed_file(make_image('blue.jpg', (0, 0, 255)))
+        embedder.embed_file(make_image('red.jpg', (255, 0, 0)))
+        self.assertEqual(embedder.prepared, 3)
+
+
+class DecodeImageTests(TestCase):
+    def encode(self, size, fmt):
+        buf = BytesIO()
+        Image.new('RGB', size, color=(10, 200, 30)).save(buf, format=fmt)
+        buf.seek(0)
+        return buf
+
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        image = decode_image(self.encode((4000, 3000), 'JPEG'), min_size=224)
+        self.assertGreaterEqual(min(image.size), 224)
+        self.assertLessEqual(min(image.size), 2 * 224)
+        self.assertEqual(image.mode, 'RGB')
+
+    def test_other_formats_are_reduced_after_loading(self):
+        image = decode_image(self.encode((1200, 900), 'PNG'), min_size=224)
+        self.assertEqual(image.size, (300, 225))
+
+    def test_small_images_are_left_alone(self):
+        self.assertEqual(decode_image(self.encode((100, 80), 'JPEG'), min_size=224).size, (100, 80))
+
+    @override_settings(AI_MAX_IMAGE_PIXELS=1000)
+    def test_oversized_images_are_rejected_before_decoding(self):
+        with self.assertRaises(ValueError):
+            decode_image(self.encode((100, 100), 'PNG'))
+
+
+@override_settings(AI_MATCH_WORKERS=0, AI_JOB_QUEUE='thread', CELERY_ENABLED=False)
+class ImageDerivativeTests(MediaTestCase):
+    def create(self, **fields):
+        # Derivatives are queued for after commit; run that job inline
+        with self.captureOnCommitCallbacks(execute=True):
+            return LostProduct.objects.create(**fields)
+
+    def make_large_image(self):
+        buf = BytesIO()
+        Image.new('RGB', (1600, 1200), color=(0, 128, 255)).save(buf, format='JPEG')
+        return SimpleUploadedFile('large.jpg', buf.getvalue(), content_type='image/jpeg')
+
+    def test_upload_creates_thumbnails_and_model_copy(self):
+        lost = self.create(name='Bag', image=self.make_large_image())
+        storage = lost.image.storage
+        with storage.open(derivative_name(lost.image.name, 'thumb')) as fp:
+            self.assertEqual(max(Image.open(fp).size), 320)
+        with storage.open(derivative_name(lost.image.name, 'model')) as fp:
+            self.assertEqual(min(Image.open(fp).size), 256)
+        self.assertTrue(lost.thumbnail_url.endswith('.thumb.jpg'))
+        self.assertEqual(embedding_source(lost.image), storage.path(derivative_name(lost.image.name, 'model')))
+
+    def test_uploads_sharing_a_stem_keep_their_own_derivatives(self):
+        jpeg = self.create(name='Keys', image=make_image('keys.jpg', color=(255, 0, 0)))
+        buf = BytesIO()
+        Image.new('RGB', (32, 32), color=(0, 0, 255)).save(buf, format='PNG')
+        png = self.create(name='Keys', image=SimpleUploadedFile('keys.png', buf.getvalue()))
+        self.assertNotEqual(derivative_name(jpeg.image.name, 'model'), derivative_name(png.image.name, 'model'))
+        for item, color in ((jpeg, (255, 0, 0)), (png, (0, 0, 255))):
+            with Image.open(embedding_source(item.image)) as copy:
+                np.testing.assert_allclose(copy.convert('RGB').getpixel((0, 0)), color, atol=8)
+        png.delete()
+        self.assertTrue(jpeg.image.storage.exists(derivative_name(jpeg.image.name, 'thumb')))
+
+    def test_derivatives_are_generated_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            lost = LostProduct.objects.create(name='Bag', image=self.make_large_image())
+        # Until the queued job runs, everything reads the original
+        self.assertIsNone(derivative_url_or_none(lost))
+        self.assertEqual(embedding_source(lost.image), lost.image)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertIsNotNone(derivative_url_or_none(lost))
+
+    @override_settings(AI_JOB_QUEUE='database')
+    def test_derivatives_go_through_the_job_queue(self):
+        lost = self.create(name='Bag', image=self.make_large_image())
+        job = Job.objects.get()
+        self.assertEqual((job.task, job.args), ('AI.tasks.make_item_derivatives', ['lost', lost.id]))
+        self.assertIsNone(derivative_url_or_none(lost))
+
+    def test_derivatives_are_removed_with_the_item(self):
+        lost = self.create(name='Bag', image=self.make_large_image())
+        thumb = derivative_name(lost.image.name, 'thumb')
+        storage = lost.image.storage
+        lost.delete()
+        self.assertFalse(storage.exists(thumb))
+
+    def test_serializer_exposes_derivative_urls(self):
+        from .serializers import LostProductSerializer
+
+        lost = self.create(name='Bag', image=self.make_large_image())
+        data = LostProductSerializer(lost).data
+        self.assertTrue(data['thumbnail_url'].endswith('.thumb.jpg'))
+        self.assertTrue(data['model_image_url'].endswith('.model.jpg'))
+
+    @override_settings(AI_DERIVATIVES=False)
+    def test_make_derivatives_backfills_existing_items(self):
+        lost = self.create(name='Bag', image=self.make_large_image())
+        self.assertIsNone(derivative_url_or_none(lost))
+        with self.settings(AI_DERIVATIVES=True):
+            call_command('make_derivatives', stdout=StringIO())
+        self.assertIsNotNone(derivative_url_or_none(lost))
+
+
+def derivative_url_or_none(item):
+    from .derivatives import derivative_url
+
+    return derivative_url(item.image, 'model')
+
+
+class DescriptorEmbedderTests(TestCase):
+    def encode(self, image, fmt='JPEG', **params):
+        buf = BytesIO()
+        image.save(buf, format=fmt, **params)
+        buf.seek(0)
+        return buf
+
+    def similarity(self, a, b):
+        embedder = get_embedder('descriptor')
+        va = np.frombuffer(embedder.embed_file(a), dtype=np.float32)
+        vb = np.frombuffer(embedder.embed_file(b), dtype=np.float32)
+        return float(va @ vb)
+
+    def test_reencoded_photo_scores_close_to_one(self):
+        pixels = np.random.default_rng(1).integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        photo = Image.fromarray(pixels).resize((400, 300), Image.BILINEAR)
+        copy = photo.resize((200, 150))
+        self.assertGreater(self.similarity(self.encode(photo, quality=95), self.encode(copy, quality=60)), 0.95)
+
+    def test_different_colours_score_low(self):
+        red = self.encode(Image.new('RGB', (64, 64), (220, 20, 20)))
+        blue = self.encode(Image.new('RGB', (64, 64), (20, 20, 220)))
+        self.assertLess(self.similarity(red, blue), 0.5)
+
+    def test_descriptor_is_deterministic(self):
+        embedder = get_embedder('descriptor')
+        image = Image.new('RGB', (32, 32), (10, 200, 30))
+        self.assertEqual(embedder.embed_file(self.encode(image)), embedder.embed_file(self.encode(image)))
+
+
+class DuplicatePhotoTests(MediaTestCase):
+    def photo(self, name, size=(400, 300), quality=90, seed=3):
+        pixels = np.random.default_rng(seed).integers(0, 256, size=(6, 8, 3), dtype=np.uint8)
+        buf = BytesIO()
+        Image.fromarray(pixels).resize(size, Image.BILINEAR).save(buf, format='JPEG', quality=quality)
+        return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+    def test_hash_is_stored_on_upload(self):
+        lost = LostProduct.objects.create(name='Bag', image=self.photo('bag.jpg'))
+        self.assertEqual(len(lost.image_hash), 16)
+        self.assertEqual(LostProduct.objects.get(pk=lost.pk).image_hash, lost.image_hash)
+
+    def test_hamming_index_finds_hashes_within_radius(self):
+        index = HammingIndex()
+        index.add(1, 0b1011)
+        index.add(2, 0b1011 ^ (1 << 40) ^ (1 << 3))
+        index.add(3, (1 << 64) - 1)
+        self.assertEqual(index.search(0b1011, radius=3), [(1, 0), (2, 2)])
+        index.remove(1)
+        self.assertEqual(index.search(0b1011, radius=1), [])
+
+    def test_reupload_is_matched_without_the_embedding_model(self):
+        found = FoundProduct.objects.create(name='Bag', image=self.photo('bag.jpg'))
+        lost = LostProduct.objects.create(name='Bag', image=self.photo('bag-small.jpg', (200, 150), quality=70))
+        embedder = CountingEmbedder()
+        notified = []
+        results = match_item(lost, embedder, notify=lambda l, f: notified.append((l.id, f.id)))
+        self.assertEqual([(c.id, s) for c, _sim, s in results], [(found.id, 'Matched')])
+        self.assertEqual(embedder.calls, 0)
+
+        match_item(lost, embedder, notify=lambda l, f: notified.append((l.id, f.id)))
+        self.assertEqual(MatchResult.objects.count(), 1)
+        self.assertEqual(notified, [(lost.id, found.id)])
+
+    def test_hash_index_tops_up_changes_from_other_processes(self):
+        index = get_hash_index('found')
+        # Saved here: the signal adds it to this process's index
+        FoundProduct.objects.create(id=20, name='Bag', image=self.photo('bag.jpg'))
+        # Committed by another process (no signals here), with a lower id
+        FoundProduct.objects.bulk_create([FoundProduct(id=10, name='Keys', image_hash='00000000000000ff')])
+        self.assertEqual(get_hash_index('found').search(0xff, radius=0), [(10, 0)])
+
+        # Another process re-hashes an existing item
+        FoundProduct.objects.filter(pk=10).update(image_hash='ffff000000000000', updated_at=timezone.now())
+        index = get_hash_index('found')
+        self.assertEqual(index.search(0xffff000000000000, radius=0), [(10, 0)])
+        self.assertEqual(index.search(0xff, radius=0), [])
+
+    def test_different_photos_are_not_duplicates(self):
+        FoundProduct.objects.create(name='Bag', image=self.photo('bag.jpg', seed=3))
+        lost = LostProduct.objects.create(name='Keys', image=self.photo('keys.jpg', seed=4))
+        from .hashindex import find_near_duplicates
+        self.assertEqual(find_near_duplicates(lost, 'found'), [])
+
+
+class QuantizationTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.matrix = np.random.default_rng(7).standard_normal((200, 64)).astype(np.float32)
+
+    def test_blob_round_trip_and_size(self):
+        vec = self.matrix[0]
+        self.assertEqual(decode_embedding(encode_embedding(vec)).tolist(), vec.tolist())
+        for fmt, size in (('float16', 4 + 128), ('int8', 8 + 64)):
+            blob = encode_embedding(vec, fmt)
+            self.assertEqual(len(blob), size)
+            np.testing.assert_allclose(decode_embedding(blob), vec, atol=np.abs(vec).max() / 100)
+
+    def test_quantized_index_ranks_like_float32(self):
+        indexes = {fmt: VectorIndex(dtype=fmt) for fmt in ('float32', 'float16', 'int8')}
+        for fmt, index in indexes.items():
+            for i, vec in enumerate(self.matrix):
+                index.add(i, vec)
+        self.assertLess(indexes['int8'].nbytes(), indexes['float32'].nbytes() / 3)
+        for query in self.matrix[:20] + 0.1:
+            exact = [i for i, _ in indexes['float32'].search(query, k=5)]
+            for fmt in ('float16', 'int8'):
+                self.assertEqual([i for i, _ in indexes[fmt].search(query, k=1)], exact[:1])
+
+    def test_float16_index_scores_in_float32_and_saves_half_precision(self):
+        index = VectorIndex(dtype='float16')
+        for i, vec in enumerate(self.matrix):
+            index.add(i, vec)
+        self.assertEqual(index._matrix.data.dtype, np.float32)
+        path = os.path.join(self.media_root, 'float16.npz')
+        index.save(path)
+        with np.load(path) as data:
+            self.assertEqual(data['matrix'].dtype, np.float16)
+        loaded = VectorIndex.load(path, dtype='float16')
+        query = self.matrix[0] + 0.1
+        self.assertEqual(loaded.search(query, k=5), index.search(query, k=5))
+
+    def test_quantized_index_survives_remove_and_save(self):
+        index = VectorIndex(dtype='int8')
+        for i, vec in enumerate(self.matrix[:10]):
+            index.add(i, vec)
+        index.remove(3)
+        path = os.path.join(self.media_root, 'int8.npz')
+        index.save(path)
+        loaded = VectorIndex.load(path, dtype='int8')
+        self.assertEqual(loaded.search(self.matrix[9], k=1)[0][0], 9)
+        self.assertEqual(len(VectorIndex.load(path, dtype='float32')), 9)
+
+    @override_settings(AI_EMBEDDING_STORAGE='int8', AI_DUPLICATE_MAX_DISTANCE=None)
+    def test_items_store_int8_blobs_and_still_match(self):
+        found = FoundProduct.objects.create(name='Noise', image=make_noise_image('n.png', seed=1))
+        lost = LostProduct.objects.create(name='Noise', image=make_noise_image('n2.png', seed=1))
+        results = match_item(lost, get_embedder('descriptor'))
+        self.assertEqual(results[0][0].id, found.id)
+        self.assertEqual(bytes(LostProduct.objects.get(pk=lost.pk).embedding)[:3], b'\x00QE')
+        out = StringIO()
+        call_command('quantization_report', model='descriptor', stdout=out)
+        self.assertIn('recall@1', out.getvalue())
+
+
+class MmapIndexTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.media_root, 'shared.mmap')
+        self.vectors = np.random.default_rng(11).standard_normal((50, 16)).astype(np.float32)
+
+    def test_rows_written_by_one_process_are_visible_to_another(self):
+        writer, reader = MmapIndex(path=self.path), MmapIndex(path=self.path)
+        for i, vec in enumerate(self.vectors[:10], start=1):
+            writer.add(i, vec)
+        reader.refresh()
+        self.assertIsInstance(reader._vectors, np.memmap)
+        self.assertEqual(reader.search(self.vectors[4], k=1)[0][0], 5)
+        self.assertEqual(len(reader), 10)
+
+        writer.remove(5)
+        writer.add(6, self.vectors[20])
+        self.assertNotIn(5, reader)
+        self.assertEqual(reader.search(self.vectors[20], k=1)[0][0], 6)
+
+    def test_torn_append_does_not_shift_later_rows(self):
+        writer = MmapIndex(path=self.path)
+        writer.add(1, self.vectors[0])
+
+        def fail_id_append(name, mode='r', *args, **kwargs):
+            if name.endswith('.i64') and mode == 'ab':
+                raise OSError('disk full')
+            return open(name, mode, *args, **kwargs)
+
+        with mock.patch('AI.mmapindex.open', side_effect=fail_id_append, create=True):
+            with self.assertRaises(OSError):
+                writer.add(2, self.vectors[1])  # the vector is written, its id is not
+        writer.add(3, self.vectors[2])
+        reader = MmapIndex(path=self.path)
+        self.assertEqual(len(reader), 2)
+        self.assertEqual(reader.search(self.vectors[2], k=1)[0][0], 3)
+        self.assertAlmostEqual(reader.search(self.vectors[2], k=1)[0][1], 1.0, places=5)
+
+    def test_compaction_swaps_generation_for_every_reader(self):
+        writer = MmapIndex(path=self.path, min_compact_rows=1)
+        reader = MmapIndex(path=self.path)
+        for i, vec in enumerate(self.vectors[:10], start=1):
+            writer.add(i, vec)
+        for i in range(1, 8):
+            writer.remove(i)
+        self.assertTrue(writer.needs_compaction())
+        writer.compact()
+        self.assertFalse(writer.needs_compaction())
+        self.assertEqual(sorted(i for i, _ in reader.search(self.vectors[0])), [8, 9, 10])
+        self.assertEqual(os.path.getsize(reader.files(reader._generation)[1]), 3 * 8)
+
+    @override_settings(AI_INDEX_BACKEND='mmap', AI_DUPLICATE_MAX_DISTANCE=None)
+    def test_restarted_worker_reads_vectors_from_the_shared_file(self):
+        embedder = CountingEmbedder()
+        found = FoundProduct.objects.create(name='Found', image=make_noise_image('f.png', seed=2))
+        get_item_embedding(found, embedder)
+        get_index('found', embedder.name, embedder.version).save()
+
+        reset_indexes()  # simulate a fresh worker process
+        with CaptureQueriesContext(connection) as ctx:
+            index = get_index('found', embedder.name, embedder.version)
+        self.assertIn(found.id, index)
+        # Only rows embedded after the last sync are read from the database
+        selects = [q['sql'] for q in ctx.captured_queries if 'FROM "AI_foundproduct"' in q['sql']]
+        self.assertTrue(selects)
+        self.assertTrue(all('"embedded_at" >=' in sql for sql in selects))
+        self.assertIsInstance(index.vectors, MmapIndex)
+
+
+@override_settings(AI_DUPLICATE_MAX_DISTANCE=None, AI_MATCH_STORAGE='full')
+class CandidateSelectionTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.embedder = CountingEmbedder()
+
+    def found(self, name, seed, **fields):
+        return FoundProduct.objects.create(name=name, image=make_noise_image(f'{name}.png', seed=seed), **fields)
+
+    def matched_ids(self, lost):
+        return sorted(candidate.id for candidate, _sim, _status in match_item(lost, self.embedder))
+
+    def test_date_window_excludes_items_before_search_for_scoring(self):
+        kept = self.found('kept', 1, date_found=date(2024, 5, 3))
+        undated = self.found('undated', 2)
+        self.found('before-loss', 3, date_found=date(2024, 4, 1))
+        self.found('years-later', 4, date_found=date(2027, 5, 1))
+        lost = LostProduct.objects.create(name='Lost', image=make_noise_image('lost.png', seed=9),
+                                          date_lost=date(2024, 5, 1))
+        self.assertEqual(self.matched_ids(lost), sorted([kept.id, undated.id]))
+        # Excluded items are never embedded: the lost item plus two candidates
+        self.assertEqual(self.embedder.calls, 3)
+
+    def test_found_item_is_matched_against_earlier_losses_only(self):
+        lost = LostProduct.objects.create(name='Lost', image=make_noise_image('lost.png', seed=9),
+                                          date_lost=date(2024, 5, 10))
+        LostProduct.objects.create(name='Later', image=make_noise_image('later.png', seed=8),
+                                   date_lost=date(2024, 6, 1))
+        found = self.found('found', 1, date_found=date(2024, 5, 12))
+        results = match_item(found, self.embedder)
+        self.assertEqual([candidate.id for candidate, _sim, _status in results], [lost.id])
+
+    def test_coordinates_and_category_restrict_candidates(self):
+        near = self.found('near', 1, latitude=51.50, longitude=-0.12, category='Wallet')
+        no_coords = self.found('no-coords', 2, category='wallet')
+        self.found('other-campus', 3, latitude=53.48, longitude=-2.24, category='Wallet')
+        self.found('phone', 4, latitude=51.50, longitude=-0.12, category='Phone')
+        lost = LostProduct.objects.create(name='Lost', image=make_noise_image('lost.png', seed=9),
+                                          latitude=51.51, longitude=-0.13, category='WALLET')
+        self.assertEqual(self.matched_ids(lost), sorted([near.id, no_coords.id]))
+
+    @override_settings(AI_MATCH_MAX_DISTANCE_KM=None, AI_MATCH_SAME_CATEGORY=False)
+    def test_filters_can_be_disabled(self):
+        self.found('other-campus', 3, latitude=53.48, longitude=-2.24, category='Wallet')
+        self.found('phone', 4, latitude=51.50, longitude=-0.12, category='Phone')
+        lost = LostProduct.objects.create(name='Lost', image=make_noise_image('lost.png', seed=9),
+                                          latitude=51.51, longitude=-0.13, category='Wallet')
+        self.assertEqual(len(self.matched_ids(lost)), 2)
+
+    @override_settings(AI_MATCH_PREFILTER_MAX_IDS=2, AI_MATCH_ANN_K=10, AI_MATCH_OVERSAMPLE=4)
+    def test_large_candidate_sets_search_unrestricted_then_post_filter(self):
+        kept = [self.found(f'kept{i}', i, date_found=date(2024, 5, 3)) for i in range(3)]
+        get_item_embedding(self.found('years-later', 9, date_found=date(2027, 5, 1)), self.embedder)
+        lost = LostProduct.objects.create(name='Lost', image=make_noise_image('lost.png', seed=9),
+                                          date_lost=date(2024, 5, 1))
+        with mock.patch.object(VectorIndex, 'search', autospec=True, side_effect=VectorIndex.search) as search:
+            self.assertEqual(self.matched_ids(lost), sorted(item.id for item in kept))
+        self.assertIsNone(search.call_args.kwargs['ids'])
+        self.assertEqual(search.call_args.kwargs['k'], 40)
+
+    def test_every_index_backend_searches_only_the_given_ids(self):
+        vectors = np.random.default_rng(5).standard_normal((40, 8)).astype(np.float32)
+        allowed = {3, 7, 11, 12}
+        indexes = [VectorIndex(), VectorIndex(dtype='int8'), IVFIndex(nlist=4, nprobe=1, min_train_size=20),
+                   MmapIndex(path=os.path.join(self.media_root, 'restricted.mmap'))]
+        for index in indexes:
+            for i, vec in enumerate(vectors):
+                index.add(i, vec)
+            hits = index.search(vectors[3], ids=allowed | {999})
+            self.assertEqual({i for i, _ in hits}, allowed)
+            self.assertEqual(hits[0][0], 3)
+            self.assertEqual(index.search(vectors[3], ids=set()), [])
+
+
+class GeohashTests(TestCase):
+    def test_encode_matches_reference_geohash(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_geohash_follows_coordinates_on_save(self):
+        found = FoundProduct.objects.create(name='Keys', latitude=51.5007, longitude=-0.1246)
+        self.assertEqual(FoundProduct.objects.get(pk=found.pk).geohash, encode_geohash(51.5007, -0.1246))
+        found.latitude = found.longitude = None
+        found.save()
+        self.assertEqual(FoundProduct.objects.get(pk=found.pk).geohash, '')
+
+    def test_items_near_matches_brute_force_haversine(self):
+        rng = np.random.default_rng(3)
+        points = np.column_stack([51.5 + rng.uniform(-0.3, 0.3, 300), -0.12 + rng.uniform(-0.5, 0.5, 300)])
+        FoundProduct.objects.bulk_create([
+            FoundProduct(name=f'Item {i}', latitude=lat, longitude=lng, geohash=encode_geohash(lat, lng))
+            for i, (lat, lng) in enumerate(points.tolist())
+        ])
+        ids = list(FoundProduct.objects.order_by('id').values_list('id', flat=True))
+        distances = haversine_km(51.5, -0.12, points[:, 0], points[:, 1])
+        expected = [ids[i] for i in np.argsort(distances) if distances[i] <= 8]
+        with CaptureQueriesContext(connection) as ctx:
+            hits = items_near(FoundProduct.objects.all(), 51.5, -0.12, 8)
+        self.assertEqual([item_id for item_id, _ in hits], expected)
+        self.assertTrue(all(distance <= 8 for _, distance in hits))
+        self.assertIn('"geohash" >=', ctx.captured_queries[0]['sql'])
+
+    def test_near_query_api_returns_nearest_first(self):
+        far = FoundProduct.objects.create(name='Far', latitude=51.60, longitude=-0.12)
+        near = FoundProduct.objects.create(name='Near', latitude=51.501, longitude=-0.12)
+        FoundProduct.objects.create(name='Other city', latitude=53.48, longitude=-2.24)
+        FoundProduct.objects.create(name='No coordinates')
+        # The Product app registers the same route names, so use the AI app's path
+        response = self.client.get('/ai/api/ai/found/', {'near': '51.5,-0.12', 'radius': '20'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()], [near.id, far.id])
+        self.assertAlmostEqual(response.json()[0]['distance_km'], 0.111, places=2)
+
+        bad = self.client.get('/ai/api/ai/found/', {'near': 'here', 'radius': '2'})
+        self.assertEqual(bad.status_code, 400)
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('All hot queries use indexes', out.getvalue())
+
+    def test_full_scans_and_sorts_are_reported(self):
+        from .management.commands.check_query_plans import plan_problems
+        plan = '2 0 0 SCAN AI_matchresult\n5 0 0 USE TEMP B-TREE FOR ORDER BY'
+        self.assertEqual(len(plan_problems('sqlite', plan)), 2)
+        self.assertEqual(plan_problems('sqlite', '3 0 0 SCAN AI_job USING INDEX AI_job_status_90ea1e_idx'), [])
+        self.assertEqual(len(plan_problems('postgresql', 'Seq Scan on "AI_job"')), 1)
+
+
+class DatabaseWriterTests(TestCase):
+    def test_writes_run_inline_for_in_memory_databases_and_transactions(self):
+        self.assertFalse(db_writer.use_writer_thread())
+        self.assertEqual(db_writer.run_write(lambda: threading.current_thread().name),
+                         threading.current_thread().name)
+
+    def test_writes_are_funnelled_through_one_thread(self):
+        with mock.patch.object(db_writer, 'use_writer_thread', return_value=True), \
+                mock.patch.object(db_writer, 'close_old_connections'):
+            names = {db_writer.run_write(lambda: threading.current_thread().name) for _ in range(3)}
+            self.assertEqual(len(names), 1)
+            self.assertTrue(names.pop().startswith(db_writer.THREAD_NAME_PREFIX))
+            with self.assertRaises(ZeroDivisionError):
+                db_writer.run_write(lambda: 1 / 0)
+
+
+class PgVectorIndexTests(MediaTestCase):
+    """The PostgreSQL test needs a throwaway server with pgvector, e.g.
+
+        docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=test pgvector/pgvector:pg16
+        POSTGRES_DB=postgres POSTGRES_USER=postgres POSTGRES_PASSWORD=test python manage.py test AI
+
+    (``pip install pgserver`` gives one without Docker: PostgreSQL with
+    pgvector on a Unix socket, used as ``POSTGRES_HOST``.)
+    """
+
+    def test_falls_back_to_the_numpy_index_without_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('PostgreSQL is configured')
+        with override_settings(AI_INDEX_BACKEND='pgvector'):
+            index = get_index('found', 'test-model', '1')
+        self.assertIsInstance(index.vectors, VectorIndex)
+
+    def require_pgvector(self):
+        from .pgvector import pgvector_available
+        if not pgvector_available():
+            self.skipTest('Needs PostgreSQL with the vector extension (set POSTGRES_DB)')
+
+    @override_settings(AI_INDEX_BACKEND='pgvector')
+    def test_index_without_a_table_falls_back_until_set_up(self):
+        self.require_pgvector()
+        index = get_index('found', 'pseudo-bytes', '1')
+        self.assertIsInstance(index.vectors, VectorIndex)
+        out = StringIO()
+        call_command('setup_pgvector', model='pseudo-bytes', stdout=out)
+        self.assertIn('found: 512-d vectors of pseudo-bytes', out.getvalue())
+        reset_indexes()
+        from .pgvector import PgVectorIndex
+        self.assertIsInstance(get_index('found', 'pseudo-bytes', '1').vectors, PgVectorIndex)
+
+    @override_settings(AI_INDEX_BACKEND='pgvector')
+    def test_sync_upserts_in_batches(self):
+        from .pgvector import create_index_table
+        self.require_pgvector()
+        embedder = CountingEmbedder()
+        create_index_table(index_name('found', embedder.name, embedder.version, 'pgvector', index_options()[1]), 512)
+        for i in range(5):
+            FoundProduct.objects.create(name=f'Found {i}', image=make_noise_image(f'f{i}.png', seed=i))
+        embed_pending_items('found', embedder)
+        with mock.patch('AI.index.SYNC_BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            index = get_index('found', embedder.name, embedder.version)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith(f'INSERT INTO {index.vectors.table}')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(len(index), 5)
+
+    @override_settings(AI_INDEX_BACKEND='pgvector', AI_DUPLICATE_MAX_DISTANCE=None)
+    def test_top_k_runs_in_postgresql(self):
+        from .pgvector import PgVectorIndex, create_index_table, vector_literal
+        self.require_pgvector()
+        embedder = CountingEmbedder()
+        for kind in ('lost', 'found'):
+            create_index_table(index_name(kind, embedder.name, embedder.version, 'pgvector', index_options()[1]), 512)
+        found = [FoundProduct.objects.create(name=f'Found {i}', image=make_noise_image(f'f{i}.png', seed=i))
+                 for i in range(5)]
+        lost = LostProduct.objects.create(name='Lost', image=make_noise_image('lost.png', seed=2))
+        results = match_item(lost, embedder)
+        index = get_index('found', embedder.name, embedder.version)
+        self.assertIsInstance(index.vectors, PgVectorIndex)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(results[0][0].id, found[2].id)
+        self.assertAlmostEqual(results[0][1], 1.0, places=4)
+        everything = dict(index.search(lost.embedding))
+        restricted = index.search(lost.embedding, ids={found[0].id, found[1].id})
+        self.assertEqual({i for i, _ in restricted}, {found[0].id, found[1].id})
+        for item_id, score in restricted:
+            self.assertAlmostEqual(score, everything[item_id], places=5)
+
+        # Top-k queries can use the HNSW index
+        vectors = index.vectors
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN SELECT item_id FROM {vectors.table} ORDER BY embedding <=> %s::vector LIMIT 3',
+                           [vector_literal(decode_embedding(lost.embedding))])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(f'{vectors.table}_hnsw', plan)
+
+        # Another process starts from the stored rows and sync time
+        reloaded = ItemIndex('found', embedder.name, embedder.version)
+        self.assertTrue(reloaded.load())
+        self.assertEqual(len(reloaded), 5)
+        self.assertLessEqual(reloaded.synced_at, index.synced_at)  # saved when rows change
+        self.assertTrue(reloaded.remove(found[0].id))
+        ids, matrix = index.vectors.export()
+        self.assertEqual(sorted(ids.tolist()), sorted(item.id for item in found[1:]))
+        self.assertEqual(matrix.shape[0], 4)
+
+
+@override_settings(AI_API_MAX_PAGE_SIZE=5)
+class ApiPaginationTests(TestCase):
+    def setUp(self):
+        lost = LostProduct.objects.create(name='Lost')
+        found = [FoundProduct.objects.create(name=f'Found {i}') for i in range(12)]
+        MatchResult.objects.bulk_create([
+            MatchResult(lost_product=lost, found_product=item, similarity_score=0.5) for item in found
+        ])
+
+    def test_cursor_pages_cover_every_row_once_newest_first(self):
+        url, seen = '/ai/api/ai/matches/?page_size=5', []
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 5)
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+        expected = list(MatchResult.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        page = self.client.get('/ai/api/ai/found/', {'page_size': 1000}).json()
+        self.assertEqual(len(page['results']), 5)
+        self.assertIsNotNone(page['next'])
+
+    def test_fields_selects_a_sparse_fieldset(self):
+        page = self.client.get('/ai/api/ai/found/', {'fields': 'id,name,nonexistent'}).json()
+        self.assertEqual(set(page['results'][0]), {'id', 'name'})
+
+    def test_other_apps_lists_are_not_paginated(self):
+        for url in ['/Product/api/ai/lost/', '/Product/api/ai/found/', '/Users/profiles/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIsInstance(response.json(), list)
+
+
+class QueryCountTests(TestCase):
+    """The number of queries per page must not grow with the number of rows."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            lost = LostProduct.objects.create(name=f'Lost {self.rows}', location='Library')
+            found = FoundProduct.objects.create(name=f'Found {self.rows}', location='Library')
+            MatchResult.objects.create(lost_product=lost, found_product=found, similarity_score=0.9,
+                                       match_status='Matched')
+            RouteMap.objects.create(lost_product=lost, found_product=found)
+            Notification.objects.create(user=self.user, message=f'Match {self.rows}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if hasattr(response, 'render'):
+                response.render()
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_rows(2)
+        few = self.count_queries(url)
+        self.add_rows(8)
+        self.assertEqual(self.count_queries(url), few, url)
+
+    def test_api_lists(self):
+        for url in ['/ai/api/ai/lost/', '/ai/api/ai/found/', '/ai/api/ai/matches/',
+                    '/ai/api/ai/routes/', '/ai/api/ai/notifications/']:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    def test_browsable_api_match_list(self):
+        self.assertConstantQueries('/ai/api/ai/matches/?format=api')
+
+    def test_admin_changelists(self):
+        for model in ['matchresult', 'routemap', 'notification']:
+            with self.subTest(model=model):
+                self.assertConstantQueries(f'/admin/AI/{model}/')
+
+    def test_search_page(self):
+        for url in ['/ai/search/', '/ai/search/?q=Lost&location=Library']:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+
+@override_settings(AI_DUPLICATE_MAX_DISTANCE=None)
+class CandidatesEndpointTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.embedder = CountingEmbedder()
+        patcher = mock.patch('AI.matching.get_embedder', return_value=self.embedder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FoundProduct.objects.create(name='Same photo', image=make_image('same.jpg'))
+        for i in range(3):
+            FoundProduct.objects.create(name=f'Other {i}', image=make_noise_image(f'other{i}.png', seed=i))
+        embed_pending_items('found', self.embedder)
+        self.lost = LostProduct.objects.create(name='Wallet', image=make_image())
+        get_item_embedding(self.lost, self.embedder)
+
+    def test_returns_top_k_ranked_without_writing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/ai/api/ai/lost/{self.lost.id}/candidates/', {'k': 2})
+        self.assertEqual(response.status_code, 200)
+        candidates = response.json()['candidates']
+        self.assertEqual(len(candidates), 2)
+        self.assertEqual(candidates[0]['name'], 'Same photo')
+        self.assertGreaterEqual(candidates[0]['similarity'], candidates[1]['similarity'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+        writes = [q['sql'] for q in queries.captured_queries
+                  if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(writes, [])
+        self.assertFalse(MatchResult.objects.exists())
+
+    def test_min_score_and_found_side(self):
+        response = self.client.get(f'/ai/api/ai/lost/{self.lost.id}/candidates/', {'min_score': 0.999})
+        self.assertEqual([row['name'] for row in response.json()['candidates']], ['Same photo'])
+        found = FoundProduct.objects.get(name='Same photo')
+        response = self.client.get(f'/ai/api/ai/found/{found.id}/candidates/', {'fields': 'id,name'})
+        self.assertEqual(response.json()['candidates'], [{'id': self.lost.id, 'name': 'Wallet', 'similarity': 1.0}])
+
+    def test_match_action_uses_the_available_embedder(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        with mock.patch('AI.api_views.get_embedder', return_value=self.embedder):
+            response = self.client.post(f'/ai/api/ai/lost/{self.lost.id}/match/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['matches']), 4)
+        with mock.patch('AI.api_views.get_embedder', return_value=None):
+            response = self.client.post(f'/ai/api/ai/lost/{self.lost.id}/match/')
+        self.assertEqual(response.status_code, 503)
+
+    def test_unembedded_item_and_bad_parameters(self):
+        pending = LostProduct.objects.create(name='Keys', image=make_image('keys.jpg'))
+        response = self.client.get(f'/ai/api/ai/lost/{pending.id}/candidates/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIsNone(LostProduct.objects.get(pk=pending.pk).embedding)
+        for params in [{'k': 'ten'}, {'k': 0}, {'min_score': 'high'}]:
+            response = self.client.get(f'/ai/api/ai/lost/{self.lost.id}/candidates/', params)
+            self.assertEqual(response.status_code, 400, params)
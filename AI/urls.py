@@ -28,5 +28,7 @@ urlpatterns = [
     path('report-found/', views.report_found_product, name='report_found'),
     path('add_found_product/', views.add_found_product, name='add_found_product'),
     path('add_lost_product/', views.add_lost_product, name='add_lost_product'),
+    path('embedding-cache/stats/', views.embedding_cache_stats, name='embedding_cache_stats'),
+    path('match-status/<str:item_type>/<int:item_id>/', views.match_status, name='match_status'),
 ]
 
@@ -1,53 +1,39 @@
-import io
 import numpy as np
 from .models import Notification
-
-try:
-    import torch
-    import clip
-    from PIL import Image
-    AI_AVAILABLE = True
-except Exception:
-    torch = None
-    clip = None
-    Image = None
-    AI_AVAILABLE = False
+from .embedders import get_embedder
+from .quantize import decode_embedding
 
 
 def generate_embedding(image_field):
-    """Generate an embedding for the given image using CLIP or a fallback method."""
+    """Generate an embedding for the given image using CLIP or a fallback method.
+
+    CLIP embeddings are looked up in the content-hash embedding cache first.
+    """
     if image_field is None:
         return None
 
-    try:
-        fp = image_field.file if hasattr(image_field, 'file') else image_field
-        fp.seek(0)
-        data = fp.read()
-    except Exception:
-        data = str(image_field).encode('utf-8')
-
     # Use CLIP if available
-    if AI_AVAILABLE and clip is not None:
-        try:
-            model, preprocess = clip.load("ViT-B/32", device="cpu")
-            pil = Image.open(io.BytesIO(data)).convert('RGB')
-            image_input = preprocess(pil).unsqueeze(0)
-            with torch.no_grad():
-                embedding = model.encode_image(image_input)
-                emb = embedding.cpu().numpy().astype(np.float32)
-                return emb.tobytes()
-        except Exception:
-            pass
+    embedder = get_embedder('clip')
+    if embedder is not None:
+        emb = embedder.embed_file(image_field)
+        if emb is not None:
+            return emb
+
+    # Fallback: cheap colour/structure descriptor, or raw-bytes pseudo-embedding without Pillow
+    embedder = get_embedder('descriptor') or get_embedder('pseudo-bytes')
+    return embedder.embed_file(image_field)
+
+
+def generate_embeddings(images, batch_size=32, embedder=None, workers=None):
+    """Embed many images (files or PIL images) with batched inference.
 
-    # Fallback: create a pseudo-embedding from image bytes
-    arr = np.frombuffer(data, dtype=np.uint8)
-    if arr.size == 0:
-        arr = np.arange(128, dtype=np.uint8)
-    vec = np.resize(arr.astype(np.float32), 512)
-    norm = np.linalg.norm(vec)
-    if norm > 0:
-        vec = vec / norm
-    return vec.astype(np.float32).tobytes()
+    Uses the configured embedding model unless ``embedder`` is given and
+    returns a contiguous ``(len(images), dim)`` float32 matrix. Rows of images
+    that could not be decoded are all zeros.
+    """
+    embedder = embedder or get_embedder()
+    matrix, _ok = embedder.embed_files(images, batch_size=batch_size, workers=workers)
+    return matrix
 
 
 def cosine_similarity(emb_a_bytes, emb_b_bytes):
@@ -56,8 +42,8 @@ def cosine_similarity(emb_a_bytes, emb_b_bytes):
     if emb_a_bytes is None or emb_b_bytes is None:
         return 0.0
     try:
-        a = np.frombuffer(emb_a_bytes, dtype=np.float32)
-        b = np.frombuffer(emb_b_bytes, dtype=np.float32)
+        a = decode_embedding(emb_a_bytes)
+        b = decode_embedding(emb_b_bytes)
         if a.size == 0 or b.size == 0:
             return 0.0
         min_len = min(a.size, b.size)
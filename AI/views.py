@@ -6,93 +6,74 @@ an optional ResNet18 embedding model, notification creation, and simple search
 and routing helpers.
 """
 
-import io
 import numpy as np
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
-from django.core.mail import send_mail
+from django.http import JsonResponse, Http404
+from django.urls import reverse
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
 
 from .models import LostProduct, FoundProduct, MatchResult, Notification, RouteMap
+from .embedders import get_embedder
+from .embedding_cache import cache_stats
+from .matching import match_item
+from .quantize import decode_embedding
+from .tasks import enqueue_match, queue_email
 
 
-# Try to import torch and torchvision; code should continue working if not installed.
-try:
-    from PIL import Image
-except Exception:
-    Image = None
-
-try:
-    import torch
-    import torchvision.transforms as transforms
-    import torchvision.models as models
-    from torchvision.models import ResNet18_Weights
-    TORCH_AVAILABLE = True
-except Exception:
-    TORCH_AVAILABLE = False
-
-
-# -------------------- Lazy model loading --------------------
-_resnet_model = None
-_preprocess = None
-_device = None
-
+# -------------------- Shared model loading --------------------
+# Models are loaded once per process by the registry in embedders.py.
 
 def get_model():
     """Return (model, preprocess, device) or (None, None, None) if torch not present."""
-    global _resnet_model, _preprocess, _device
-    if not TORCH_AVAILABLE:
+    embedder = get_embedder('resnet18')
+    if embedder is None:
         return None, None, None
-    if _resnet_model is None:
-        try:
-            _device = "cuda" if torch.cuda.is_available() else "cpu"
-            _resnet_model = models.resnet18(weights=ResNet18_Weights.DEFAULT)
-            _resnet_model = torch.nn.Sequential(*list(_resnet_model.children())[:-1])
-            _resnet_model = _resnet_model.to(_device)
-            _resnet_model.eval()
-            _preprocess = transforms.Compose([
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            ])
-        except Exception as e:
-            print(f"Failed to load model: {e}")
-            return None, None, None
-    return _resnet_model, _preprocess, _device
+    try:
+        embedder.ensure_loaded()
+    except Exception as e:
+        print(f"Failed to load model: {e}")
+        return None, None, None
+    return embedder.model, embedder.preprocess, embedder.device
 
 
 def generate_embedding(image_field):
     """Convert uploaded image to vector embedding using ResNet18.
 
     Returns raw bytes of float32 vector or None on failure / when model unavailable.
+    Images already embedded once are served from the content-hash embedding cache.
     """
-    if not image_field or not TORCH_AVAILABLE or Image is None:
-        return None
-    model, preprocess, device = get_model()
-    if model is None or preprocess is None:
-        return None
-    try:
-        image = Image.open(image_field).convert("RGB")
-        tensor = preprocess(image).unsqueeze(0).to(device)
-        with torch.no_grad():
-            emb = model(tensor)
-        emb = emb.squeeze().cpu().numpy()
-        return emb.astype(np.float32).tobytes()
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
+    embedder = get_embedder('resnet18')
+    if not image_field or embedder is None:
         return None
+    return embedder.embed_file(image_field)
 
 
 def cosine_similarity(vec1, vec2):
-    v1 = np.frombuffer(vec1, dtype=np.float32)
-    v2 = np.frombuffer(vec2, dtype=np.float32)
+    v1 = decode_embedding(vec1)
+    v2 = decode_embedding(vec2)
     denom = (np.linalg.norm(v1) * np.linalg.norm(v2))
     if denom == 0:
         return 0.0
     return float(np.dot(v1, v2) / denom)
 
 
+def match_lost_item(lost):
+    """Match a new lost item against the found catalogue with the configured embedding model."""
+    return match_item(lost, notify=send_match_notification)
+
+
+def match_found_item(found):
+    """Match a new found item against the lost catalogue with the configured embedding model."""
+    return match_item(found, notify=send_match_notification)
+
+
+def count_matches(results):
+    return sum(1 for _candidate, _sim, status in results if status == 'Matched')
+
+
 def add_lost_product(request):
     if request.method == "POST":
         name = request.POST.get("name")
@@ -106,24 +87,7 @@ def add_lost_product(request):
             lost_data['user'] = request.user
         lost = LostProduct.objects.create(**lost_data)
 
-        lost_emb = generate_embedding(image)
-        if lost_emb is not None:
-            for found in FoundProduct.objects.all():
-                if found.image:
-                    found_emb = generate_embedding(found.image)
-                    if found_emb is not None:
-                        sim = cosine_similarity(lost_emb, found_emb)
-                        status = "Matched" if sim >= 0.8 else "Not Matched"
-                        MatchResult.objects.create(
-                            lost_product=lost,
-                            found_product=found,
-                            lost_embedding=lost_emb,
-                            found_embedding=found_emb,
-                            similarity_score=sim,
-                            match_status=status,
-                        )
-                        if status == "Matched":
-                            send_match_notification(lost, found)
+        enqueue_match('lost', lost.id)
         return redirect('home')
     return render(request, "add_lost_product.html")
 
@@ -141,24 +105,7 @@ def add_found_product(request):
             found_data['user'] = request.user
         found = FoundProduct.objects.create(**found_data)
 
-        found_emb = generate_embedding(image)
-        if found_emb is not None:
-            for lost in LostProduct.objects.all():
-                if lost.image:
-                    lost_emb = generate_embedding(lost.image)
-                    if lost_emb is not None:
-                        sim = cosine_similarity(lost_emb, found_emb)
-                        status = "Matched" if sim >= 0.8 else "Not Matched"
-                        MatchResult.objects.create(
-                            lost_product=lost,
-                            found_product=found,
-                            lost_embedding=lost_emb,
-                            found_embedding=found_emb,
-                            similarity_score=sim,
-                            match_status=status,
-                        )
-                        if status == "Matched":
-                            send_match_notification(lost, found)
+        enqueue_match('found', found.id)
         return redirect('home')
     return render(request, "add_found_product.html")
 
@@ -174,10 +121,7 @@ def send_match_notification(lost, found):
     )
     recipient = getattr(lost, 'email', None)
     if recipient and getattr(settings, 'DEFAULT_FROM_EMAIL', None):
-        try:
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [recipient])
-        except Exception as e:
-            print(f"Failed to send email: {e}")
+        queue_email(subject, message, recipient)
     try:
         Notification.objects.create(
             user=getattr(lost, 'user', None),
@@ -218,27 +162,23 @@ def report_lost_product(request):
         email = request.POST.get('email')
         phone_number = request.POST.get('phone_number')
         location = request.POST.get('location')
+        category = request.POST.get('category', '').strip()
         date_lost = request.POST.get('date_lost')
-        data = {'name': name, 'description': description, 'image': image, 'email': email, 'phone_number': phone_number, 'location': location}
+        data = {'name': name, 'description': description, 'category': category, 'image': image, 'email': email, 'phone_number': phone_number, 'location': location}
         if date_lost:
             data['date_lost'] = date_lost
         if request.user.is_authenticated:
             data['user'] = request.user
         lost = LostProduct.objects.create(**data)
-        lost_emb = generate_embedding(image)
-        matches_found = 0
-        if lost_emb is not None:
-            for found in FoundProduct.objects.all():
-                if found.image:
-                    found_emb = generate_embedding(found.image)
-                    if found_emb is not None:
-                        sim = cosine_similarity(lost_emb, found_emb)
-                        status = 'Matched' if sim >= 0.8 else 'Not Matched'
-                        MatchResult.objects.create(lost_product=lost, found_product=found, lost_embedding=lost_emb, found_embedding=found_emb, similarity_score=sim, match_status=status)
-                        if status == 'Matched':
-                            matches_found += 1
-                            send_match_notification(lost, found)
-        return render(request, 'Lost_product.html', {'success': True, 'lost_item': lost, 'matches_found': matches_found})
+        # Matching runs in the background; the page polls match_status for the outcome
+        enqueue_match('lost', lost.id)
+        return render(request, 'Lost_product.html', {
+            'success': True,
+            'lost_item': lost,
+            'matches_found': 0,
+            'matching_pending': bool(lost.image),
+            'match_status_url': reverse('match_status', args=['lost', lost.id]),
+        })
     return render(request, 'Lost_product.html')
 
 
@@ -250,30 +190,49 @@ def report_found_product(request):
         email = request.POST.get('email')
         phone_number = request.POST.get('phone_number')
         location = request.POST.get('location')
+        category = request.POST.get('category', '').strip()
         date_found = request.POST.get('date_found')
-        data = {'name': name, 'description': description, 'image': image, 'email': email, 'phone_number': phone_number, 'location': location}
+        data = {'name': name, 'description': description, 'category': category, 'image': image, 'email': email, 'phone_number': phone_number, 'location': location}
         if date_found:
             data['date_found'] = date_found
         if request.user.is_authenticated:
             data['user'] = request.user
         found = FoundProduct.objects.create(**data)
-        found_emb = generate_embedding(image)
-        matches_found = 0
-        if found_emb is not None:
-            for lost in LostProduct.objects.all():
-                if lost.image:
-                    lost_emb = generate_embedding(lost.image)
-                    if lost_emb is not None:
-                        sim = cosine_similarity(lost_emb, found_emb)
-                        status = 'Matched' if sim >= 0.8 else 'Not Matched'
-                        MatchResult.objects.create(lost_product=lost, found_product=found, lost_embedding=lost_emb, found_embedding=found_emb, similarity_score=sim, match_status=status)
-                        if status == 'Matched':
-                            matches_found += 1
-                            send_match_notification(lost, found)
-        return render(request, 'Found_product.html', {'success': True, 'found_item': found, 'matches_found': matches_found})
+        # Matching runs in the background; the page polls match_status for the outcome
+        enqueue_match('found', found.id)
+        return render(request, 'Found_product.html', {
+            'success': True,
+            'found_item': found,
+            'matches_found': 0,
+            'matching_pending': bool(found.image),
+            'match_status_url': reverse('match_status', args=['found', found.id]),
+        })
     return render(request, 'Found_product.html')
 
 
+def match_status(request, item_type, item_id):
+    """JSON progress of the background matching started for a reported item."""
+    models = {'lost': LostProduct, 'found': FoundProduct}
+    if item_type not in models:
+        raise Http404("Unknown item type")
+    item = get_object_or_404(models[item_type].objects.only('id', 'matching_status'), pk=item_id)
+    matched = MatchResult.objects.filter(match_status='Matched')
+    if item_type == 'lost':
+        matched = matched.filter(lost_product_id=item.id)
+    else:
+        matched = matched.filter(found_product_id=item.id)
+    return JsonResponse({
+        'status': item.matching_status or 'done',
+        'matches_found': matched.values('lost_product_id', 'found_product_id').distinct().count(),
+    })
+
+
+@staff_member_required
+def embedding_cache_stats(request):
+    """Hit/miss counters of this process's embedding cache."""
+    return JsonResponse(cache_stats())
+
+
 def search_items(request):
     context = {'search_performed': False, 'lost_items': [], 'found_items': [], 'matches': [], 'total_results': 0, 'search_params': {}}
     if request.method == 'GET' and (request.GET.get('q') or request.GET.get('category') or request.GET.get('location')):
@@ -290,8 +249,10 @@ def search_items(request):
             lost_items = lost_items.filter(name__icontains=search_query) | lost_items.filter(description__icontains=search_query)
             found_items = found_items.filter(name__icontains=search_query) | found_items.filter(description__icontains=search_query)
         if location_filter:
-            lost_items = lost_items.filter(location__icontains=location_filter)
-            found_items = found_items.filter(location__icontains=location_filter)
+            # The filter is picked from all_locations; LOWER(location) = ... uses the functional index
+            same_location = Exact(Lower('location'), location_filter.lower())
+            lost_items = lost_items.filter(same_location)
+            found_items = found_items.filter(same_location)
         if date_from:
             lost_items = lost_items.filter(date_lost__gte=date_from)
             found_items = found_items.filter(date_found__gte=date_from)
@@ -308,18 +269,14 @@ def search_items(request):
         if search_query:
             matches = matches.filter(lost_product__name__icontains=search_query) | matches.filter(found_product__name__icontains=search_query)
         context.update({'lost_items': lost_items, 'found_items': found_items, 'matches': matches, 'total_results': lost_items.count() + found_items.count()})
-    all_locations = set()
-    for item in LostProduct.objects.all():
-        if getattr(item, 'location', None):
-            all_locations.add(item.location)
-    for item in FoundProduct.objects.all():
-        if getattr(item, 'location', None):
-            all_locations.add(item.location)
+    all_locations = set(LostProduct.objects.exclude(location='').values_list('location', flat=True))
+    all_locations.update(FoundProduct.objects.exclude(location='').values_list('location', flat=True))
+    all_locations.discard(None)
     context['all_locations'] = sorted(list(all_locations))
     context['stats'] = {
         'total_lost': LostProduct.objects.count(),
         'total_found': FoundProduct.objects.count(),
         'total_matches': MatchResult.objects.filter(match_status='Matched').count(),
-    'recent_matches': MatchResult.objects.filter(match_status='Matched').order_by('-created_at')[:5],
+    'recent_matches': MatchResult.objects.filter(match_status='Matched').select_related('lost_product', 'found_product').order_by('-created_at')[:5],
     }
     return render(request, "Search_dashboard.html", context)
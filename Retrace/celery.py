@@ -1,14 +1,17 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Retrace.settings')
 app = Celery('Retrace')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
-import os
-from celery import Celery
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Retrace.settings')
-app = Celery('Retrace')
-app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
+
+@worker_process_init.connect
+def warm_up_embedding_models(**kwargs):
+    # Load the embedding model once per worker process instead of on the first task
+    from django.conf import settings
+    if getattr(settings, 'AI_WARMUP_MODELS', False):
+        from AI.embedders import warm_up
+        warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -79,13 +80,50 @@ WSGI_APPLICATION = 'Retrace.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning applied to every new connection (benchmark: scripts/bench_sqlite.py)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',       # readers no longer wait for a writer, nor it for them
+    'synchronous': 'NORMAL',     # fsync at checkpoints only; durable enough with WAL
+    'busy_timeout': 20000,       # ms to wait for the write lock before "database is locked"
+    'mmap_size': 268435456,      # read up to 256 MB of the file through mmap
+    'cache_size': -65536,        # 64 MB page cache per connection (negative = KiB)
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reuse connections across requests so the pragmas are paid once per thread
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': '; '.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # Take the write lock at BEGIN: a deferred transaction that later writes
+            # fails immediately with "database is locked" instead of waiting
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Optional PostgreSQL (required for AI_INDEX_BACKEND = 'pgvector'), configured from the environment
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    }
+
+
+# AI REST API: list endpoints page newest first by (created_at, id) cursors, see AI/pagination.py
+AI_API_PAGE_SIZE = 50
+AI_API_MAX_PAGE_SIZE = 200  # cap on ?page_size=
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,6 +169,80 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Image embedding model used for matching: 'clip', 'resnet18', 'descriptor' (colour
+# histogram + perceptual hash, Pillow only) or 'pseudo-bytes' (raw file bytes, last resort).
+# Falls back to the next available model when its dependencies are missing.
+AI_EMBEDDING_MODEL = 'clip'
+AI_WARMUP_MODELS = False  # load the embedding model when the ASGI server / Celery worker starts
+# Embeddings are cached by a hash of the image bytes: per-process LRU + database table
+AI_EMBEDDING_CACHE_SIZE = 2048     # in-memory entries per process (0 disables the memory tier)
+AI_EMBEDDING_CACHE_PERSIST = True  # also store them in the CachedEmbedding table
+AI_MAX_IMAGE_PIXELS = 50_000_000   # refuse to decode larger images (bounds memory per embed)
+# Resized copies written next to each uploaded item photo (see AI/derivatives.py),
+# generated in the background on the same queue as matching
+AI_DERIVATIVES = True
+AI_THUMBNAIL_SIZE = 320   # longer side of list thumbnails
+AI_MODEL_COPY_SIZE = 256  # shorter side of the copy read by the embedding models
+
+# Vector index used for lost/found matching (see AI/index.py and AI/ann.py)
+# AI_INDEX_BACKEND: 'exact' (brute force), 'ivf' (NumPy inverted file), 'hnswlib', or
+# 'mmap' (exact search over memory-mapped files in AI_INDEX_DIR shared by all worker processes), or
+# 'pgvector' (vectors and HNSW search in PostgreSQL, shared by all app servers; run
+# `manage.py setup_pgvector` after migrating to create its tables; falls back to 'exact')
+AI_INDEX_BACKEND = 'exact'
+AI_INDEX_NLIST = 256        # ivf: number of k-means buckets
+AI_INDEX_NPROBE = 8         # ivf: buckets scanned per query (higher = better recall, slower)
+AI_INDEX_EF_SEARCH = 64     # hnswlib: search breadth (higher = better recall, slower)
+AI_INDEX_DIR = BASE_DIR / 'vector_index'  # set to None to disable on-disk persistence
+AI_INDEX_SAVE_EVERY = 1000  # persist after this many index changes
+AI_INDEX_SYNC_OVERLAP_SECONDS = 120  # re-scan window for rows that commit after a sync started
+AI_INDEX_SYNC_INTERVAL = 2.0        # seconds get_index reuses a sync before querying again
+# Vector precision: 'float32', 'float16' (half the size) or 'int8' (a quarter, per-vector scale).
+# AI_EMBEDDING_STORAGE applies to the blobs saved on items, AI_INDEX_DTYPE to the index matrix
+# (float16 only shrinks the saved file: it is scored as float32 in memory, int8 stays int8);
+# `manage.py quantization_report` measures the ranking change against float32
+AI_EMBEDDING_STORAGE = 'float32'
+AI_INDEX_DTYPE = 'float32'
+AI_MATCH_MAX_CANDIDATES = None  # nearest candidates compared per report (None = all returned by the index)
+AI_MATCH_BULK_BATCH_SIZE = 500  # MatchResult rows per INSERT statement
+AI_CANDIDATES_MAX_K = 100  # cap on ?k= of /api/ai/<lost|found>/<id>/candidates/
+AI_CANDIDATES_CACHE_SECONDS = 60  # Cache-Control max-age of candidate lists
+AI_DB_WRITER_QUEUE = True       # funnel bulk MatchResult writes through one thread per process (AI/db_writer.py)
+# Candidate pre-selection before any embedding is compared (AI/candidates.py); None/False disables a filter
+AI_MATCH_DATE_WINDOW_DAYS = 180   # lost and found dates at most this far apart
+AI_MATCH_DATE_SLACK_DAYS = 2      # a find may be dated this much before the loss
+AI_MATCH_MAX_DISTANCE_KM = 50     # coordinate box around the item, when it has coordinates
+AI_MATCH_SAME_LOCATION = False    # require the same location text
+AI_MATCH_SAME_CATEGORY = True     # require the same category when both items have one
+AI_MATCH_PREFILTER_MAX_IDS = 2000 # larger candidate sets use the approximate search plus a post-filter
+AI_MATCH_OVERSAMPLE = 4           # ... which fetches this many times the hits needed
+AI_MATCH_ANN_K = 200              # ... and keeps this many when AI_MATCH_MAX_CANDIDATES is None
+
+# Geohash cells for /api/ai/lost/ and /api/ai/found/ ?near=lat,lng&radius=km (AI/geo.py)
+AI_GEOHASH_PRECISION = 9          # characters stored per item (~5 m cells); at most 12
+AI_NEAR_DEFAULT_RADIUS_KM = 5
+AI_NEAR_MAX_RADIUS_KM = 500
+AI_NEAR_MAX_RESULTS = 100
+# 'compact' stores matches plus the best near misses without embedding copies;
+# 'full' stores every compared pair with both embeddings (quadratic growth)
+AI_MATCH_STORAGE = 'compact'
+AI_MATCH_STORE_MIN_SCORE = 0.5  # compact: lowest score kept for non-matches
+AI_MATCH_STORE_TOP_K = 20       # compact: non-matches kept per run (None = no limit)
+# Photos whose perceptual hashes differ in at most this many of 64 bits are matched
+# directly, skipping the embedding model (None disables the duplicate pre-filter)
+AI_DUPLICATE_MAX_DISTANCE = 3
+# Report forms return immediately and matching runs in the background: on Celery
+# when CELERY_ENABLED, otherwise on this many in-process threads (0 = inline after commit)
+AI_MATCH_WORKERS = 2
+# Without Celery, 'database' queues matching, derivatives and match emails as durable jobs in the
+# database, run by `python manage.py runworker`; 'thread' keeps them in-process
+AI_JOB_QUEUE = 'thread'
+AI_JOB_WORKER_THREADS = 2     # runworker threads per process
+AI_JOB_LEASE_SECONDS = 300    # a job is retried elsewhere if its worker is silent this long
+AI_JOB_MAX_ATTEMPTS = 5
+AI_JOB_RETRY_DELAY = 10       # seconds before the first retry; doubles per attempt
+AI_JOB_MAX_RETRY_DELAY = 3600
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,93 @@
+"""Benchmark image decoding for the embedding preprocessor.
+
+Compares the old path (read the whole file, decode at full resolution, then
+resize) with AI.embedders.decode_image (streamed, JPEG draft mode, reduce on
+load). Each mode runs in its own process so peak RSS is measured separately.
+
+    python scripts/bench_decode.py [image ...] [--repeat 10] [--size 224]
+
+Without images a synthetic 12 MP JPEG is generated.
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def resize_shorter_side(image, size):
+    scale = size / min(image.size)
+    return image.resize((round(image.width * scale), round(image.height * scale)))
+
+
+def run_mode(mode, paths, repeat, size):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Retrace.settings')
+    import django
+    django.setup()
+    from PIL import Image
+    from AI.embedders import decode_image
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            if mode == 'full':
+                with open(path, 'rb') as fp:
+                    data = fp.read()
+                image = Image.open(io.BytesIO(data)).convert('RGB')
+            else:
+                image = decode_image(path, size)
+            resize_shorter_side(image, size)
+    per_image = (time.perf_counter() - started) / (repeat * len(paths))
+    print(f"{mode:>6}: {per_image * 1000:8.1f} ms/image   peak RSS {peak_rss_mb():7.1f} MB "
+          f"(+{peak_rss_mb() - baseline:.1f} MB over start-up)")
+
+
+def make_sample(directory):
+    import numpy as np
+    from PIL import Image
+
+    path = os.path.join(directory, 'sample-12mp.jpg')
+    pixels = np.random.default_rng(0).integers(0, 256, size=(3000, 4000, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--size', type=int, default=224, help='Shorter side fed to the model')
+    parser.add_argument('--mode', choices=['full', 'draft'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.images, args.repeat, args.size)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = args.images or [make_sample(tmp)]
+        for mode in ['full', 'draft']:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                            '--repeat', str(args.repeat), '--size', str(args.size)] + images,
+                           check=True, cwd=ROOT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Benchmark SQLite read throughput while matches are writing results.
+
+Reader threads run the search page's recent-matches query while writer
+threads insert MatchResult-sized batches, first with SQLite's defaults
+(rollback journal, deferred transactions, 5 s timeout, every writer on its
+own) and then with the settings in Retrace/settings.py (SQLITE_PRAGMAS,
+IMMEDIATE transactions, writes funnelled through one writer thread as
+AI/db_writer.py does).
+
+    python scripts/bench_sqlite.py [--seconds 5] [--readers 4] [--writers 4] [--batch 200]
+
+Runs against a temporary database file; the project database is untouched.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SCHEMA = """
+CREATE TABLE match (id INTEGER PRIMARY KEY, lost_id INTEGER, found_id INTEGER,
+                    score REAL, status TEXT, created_at REAL);
+CREATE INDEX match_status_created ON match (status, created_at);
+"""
+READ_SQL = "SELECT id, lost_id, found_id, score FROM match WHERE status = 'Matched' ORDER BY created_at DESC LIMIT 5"
+COUNT_SQL = "SELECT COUNT(*) FROM match WHERE status = 'Matched'"
+INSERT_SQL = "INSERT INTO match (lost_id, found_id, score, status, created_at) VALUES (?, ?, ?, ?, ?)"
+
+
+def connect(path, tuned, pragmas):
+    conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+    if tuned:
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+def make_rows(batch):
+    now = time.time()
+    return [(random.randrange(10000), random.randrange(10000), random.random(),
+             'Matched' if random.random() < 0.05 else 'Not Matched', now) for _ in range(batch)]
+
+
+def write_batch(conn, rows, begin):
+    conn.execute(begin)
+    try:
+        conn.executemany(INSERT_SQL, rows)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def run(mode, args, pragmas):
+    tuned = mode == 'tuned'
+    begin = 'BEGIN IMMEDIATE' if tuned else 'BEGIN'
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'bench.sqlite3')
+    setup = connect(path, tuned, pragmas)
+    setup.executescript(SCHEMA)
+    for _ in range(50):
+        write_batch(setup, make_rows(1000), 'BEGIN')
+
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def reader():
+        conn = connect(path, tuned, pragmas)
+        reads, timings = 0, []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(READ_SQL).fetchall()
+                conn.execute(COUNT_SQL).fetchone()
+                reads += 1
+                timings.append(time.perf_counter() - started)
+            except sqlite3.OperationalError:
+                with lock:
+                    counts['locked'] += 1
+        with lock:
+            counts['reads'] += reads
+            latencies.extend(timings)
+
+    # Tuned mode: every batch is written by one thread, like AI/db_writer.py
+    funnel = ThreadPoolExecutor(max_workers=1) if tuned else None
+    funnel_conn = connect(path, tuned, pragmas) if tuned else None
+
+    def writer():
+        conn = None if tuned else connect(path, tuned, pragmas)
+        while not stop.is_set():
+            rows = make_rows(args.batch)
+            try:
+                if funnel is not None:
+                    funnel.submit(write_batch, funnel_conn, rows, begin).result()
+                else:
+                    write_batch(conn, rows, begin)
+                with lock:
+                    counts['writes'] += len(rows)
+            except sqlite3.OperationalError:
+                with lock:
+                    counts['locked'] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if funnel is not None:
+        funnel.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan')
+    print(f"{mode:>7}: {counts['reads'] / args.seconds:9.0f} reads/s   {counts['writes'] / args.seconds:9.0f} rows written/s   "
+          f"p99 read {p99:6.1f} ms   {counts['locked']} 'database is locked' errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=200, help='Rows per write transaction')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Retrace.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+
+    for mode in ['default', 'tuned']:
+        run(mode, args, settings.SQLITE_PRAGMAS)
+
+
+if __name__ == '__main__':
+    main()
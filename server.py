@@ -16,4 +16,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Retrace.settings')
 from django.core.asgi import get_asgi_application
 
 # Create the ASGI application
-app = get_asgi_application()
\ No newline at end of file
+app = get_asgi_application()
+
+# Load the embedding model up front so the first upload doesn't pay for it
+from django.conf import settings
+
+if getattr(settings, 'AI_WARMUP_MODELS', False):
+    from AI.embedders import warm_up
+    warm_up()